@@ -0,0 +1,23 @@
+"""
+Performance benchmarks of the server.
+
+Run them from the server directory with
+
+    python -m benchmarks
+
+which times each benchmark against synthetic upstream responses served in
+process, and prints its mean and 95th percentile latency and its throughput.
+Results are written as JSON with --output; --save-baseline records them as
+the reference in benchmarks/baseline.json.
+
+    python -m benchmarks --compare
+
+compares a run with the baseline and exits with status 1 if the median
+latency, throughput or peak traced memory of any benchmark regressed by
+more than its threshold (`make benchmark-server` does the same).
+
+For load testing, `benchmarks.upstream_server` serves the same synthetic
+upstream responses over HTTP with injected latency and errors,
+`benchmarks.serve_ui` runs the UI against it, and `benchmarks.load` drives
+the UI and reports its throughput and tail latency.
+"""
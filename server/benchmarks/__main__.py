@@ -0,0 +1,61 @@
+"""
+Command line entry point of the benchmarks.
+"""
+import argparse
+import logging
+import os
+import sys
+
+from . import suite  # pylint: disable=unused-import
+from .compare import compare, environment_differences, format_report
+from .runner import read_results, run, write_results
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+
+def main():
+    """
+    Run the benchmarks as the command line options say, exiting with status 1 if a compared one regressed.
+    """
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Run the performance benchmarks.')
+    parser.add_argument('--filter', help='run only the benchmarks whose name contains this text')
+    parser.add_argument('--min-time', type=float, default=1.0,
+                        help='minimum seconds spent timing each benchmark (default: %(default)s)')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='write the results to {0}'.format(os.path.relpath(BASELINE_PATH)))
+    parser.add_argument('--input', help='compare the results in this file instead of running the benchmarks')
+    parser.add_argument('--compare', action='store_true',
+                        help='compare the results with the baseline, exiting with status 1 if any regressed')
+    parser.add_argument('--baseline', default=BASELINE_PATH,
+                        help='baseline results to compare with (default: %(default)s)')
+    for metric in ('latency', 'throughput', 'memory'):
+        parser.add_argument('--{0}-threshold'.format(metric), type=float, dest=metric,
+                            help='tolerated {0} regression as a fraction, overriding every '
+                                 'benchmark\'s own threshold'.format(metric))
+    args = parser.parse_args()
+
+    # Upstream calls are logged at debug level, which would dominate the timings
+    logging.disable(logging.WARNING)
+
+    if args.input:
+        results = read_results(args.input)
+    else:
+        results = run(name_filter=args.filter, min_time=args.min_time)
+    if args.output:
+        write_results(args.output, results)
+    if args.save_baseline:
+        write_results(BASELINE_PATH, results)
+
+    if args.compare:
+        baseline = read_results(args.baseline)
+        overrides = {metric: getattr(args, metric) for metric in ('latency', 'throughput', 'memory')
+                     if getattr(args, metric) is not None}
+        changes, new = compare(baseline, results, overrides)
+        print(format_report(changes, new, environment_differences(baseline, results)))
+        if any(change.regressed for change in changes):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
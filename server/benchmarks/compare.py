@@ -0,0 +1,111 @@
+"""
+Comparison of benchmark results against a baseline.
+
+Each benchmark is compared on its median latency, its throughput and its peak
+traced memory. A metric regresses when it is worse than the baseline by more
+than the benchmark's threshold for it, a fraction of the baseline value.
+"""
+from collections import namedtuple
+
+from .runner import BENCHMARKS, DEFAULT_THRESHOLDS
+
+Change = namedtuple('Change', ['benchmark', 'metric', 'baseline', 'current', 'change', 'threshold', 'regressed'])
+
+# For each compared metric, the result field it is read from and whether larger values are better
+METRICS = {
+    'latency': ('median', False),
+    'throughput': (('items_per_sec', 'ops_per_sec'), True),
+    'memory': ('peak_memory', False)
+}
+
+
+def _value(result, fields):
+    for field in (fields,) if isinstance(fields, str) else fields:
+        if field in result:
+            return result[field]
+    return None
+
+
+def thresholds_for(name, overrides=None):
+    """
+    Regression thresholds of a benchmark: those it was registered with, with overrides applied.
+
+    :param str name: name of the benchmark
+    :param dict overrides: thresholds by metric that take precedence, e.g. from the command line
+    :rtype: dict
+    """
+    thresholds = next((benchmark.thresholds for benchmark in BENCHMARKS if benchmark.name == name),
+                      DEFAULT_THRESHOLDS)
+    return {**thresholds, **(overrides or {})}
+
+
+def compare(baseline, current, overrides=None):
+    """
+    Compare the benchmarks present in both baseline and current results.
+
+    :param dict baseline: results recorded as the reference
+    :param dict current: results of the run being checked
+    :param dict overrides: thresholds by metric applied to every benchmark
+    :return: one Change per benchmark and metric, and the names of benchmarks that have no baseline
+    :rtype: tuple
+    """
+    changes = []
+    new = []
+    for name, result in sorted(current['benchmarks'].items()):
+        reference = baseline['benchmarks'].get(name)
+        if reference is None:
+            new.append(name)
+        else:
+            changes.extend(_compare_result(name, reference, result, thresholds_for(name, overrides)))
+    return changes, new
+
+
+def _compare_result(name, reference, result, thresholds):
+    # The changes in each metric of one benchmark that both results have
+    changes = []
+    for metric, (fields, higher_is_better) in METRICS.items():
+        before, after = _value(reference, fields), _value(result, fields)
+        if not before or after is None:
+            continue
+        change = after / before - 1
+        worse = -change if higher_is_better else change
+        changes.append(Change(name, metric, before, after, change, thresholds[metric], worse > thresholds[metric]))
+    return changes
+
+
+def environment_differences(baseline, current):
+    """
+    Properties of the environment that differ between two runs and make their timings incomparable.
+
+    :rtype: list
+    """
+    keys = ('python', 'implementation', 'machine', 'cpu_count')
+    before, after = baseline.get('environment', {}), current.get('environment', {})
+    return ['{0}: {1} -> {2}'.format(key, before.get(key), after.get(key))
+            for key in keys if before.get(key) != after.get(key)]
+
+
+def format_report(changes, new, differences=()):
+    """
+    Human readable report of a comparison, listing regressions last.
+
+    :rtype: str
+    """
+    def fmt(metric, value):
+        if metric == 'latency':
+            return '{0:.3f} ms'.format(value * 1000)
+        if metric == 'memory':
+            return '{0:,.0f} KiB'.format(value / 1024)
+        return '{0:,.1f}/s'.format(value)
+
+    lines = ['Environment differs from the baseline, so timings may not be comparable: ' + ', '.join(differences)] \
+        if differences else []
+    for change in sorted(changes, key=lambda change: change.regressed):
+        lines.append('{0} {1:<40} {2:<10} {3:>14} -> {4:>14} {5:>+8.1%} (threshold {6:.0%})'.format(
+            'REGRESSED' if change.regressed else 'ok       ', change.benchmark, change.metric,
+            fmt(change.metric, change.baseline), fmt(change.metric, change.current), change.change,
+            change.threshold))
+    lines.extend('new       {0}'.format(name) for name in new)
+    regressions = sum(1 for change in changes if change.regressed)
+    lines.append('{0} regression(s) in {1} comparison(s)'.format(regressions, len(changes)))
+    return '\n'.join(lines)
@@ -0,0 +1,312 @@
+"""
+Load generator for the UI.
+
+    python -m benchmarks.load --duration 30 --concurrency 16 --upstream-args="--latency 0.05 --error-rate 0.01"
+
+starts the upstream stand-in and the UI on free local ports, requests a mix
+of site, site list and provider pages for the duration, and reports the
+throughput and latency percentiles of each. With --target, an already
+running UI is driven instead.
+
+By default each worker sends its next request as soon as the previous one
+completes. With --rate, requests are instead sent on a fixed schedule and
+latency is measured from when each was due, so that a stalled server is not
+hidden by the load generator slowing down with it.
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import json
+import random
+import shlex
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+from .runner import environment, percentile
+
+PAGES = {
+    'site': '/provider/{agency_cd}/site/{site_no}/',
+    'sites': '/provider/{agency_cd}/site/',
+    'provider': '/provider/{agency_cd}/'
+}
+
+
+def _free_port():
+    with contextlib.closing(socket.socket()) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait_until_up(url, timeout=30):
+    until = time.monotonic() + timeout
+    while True:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.exceptions.ConnectionError:
+            if time.monotonic() > until:
+                raise
+            time.sleep(0.2)
+
+
+@contextlib.contextmanager
+def local_servers(upstream_args=(), ui_args=()):
+    """
+    Run the upstream stand-in and the UI in subprocesses for the duration of the block.
+
+    :param upstream_args: extra arguments of benchmarks.upstream_server
+    :param ui_args: extra arguments of benchmarks.serve_ui
+    :return: root URL of the UI
+    """
+    upstream_port, ui_port = _free_port(), _free_port()
+    upstream_url = 'http://127.0.0.1:{0}'.format(upstream_port)
+    ui_url = 'http://127.0.0.1:{0}'.format(ui_port)
+    processes = []
+    try:
+        processes.append(subprocess.Popen(
+            [sys.executable, '-m', 'benchmarks.upstream_server', '--port', str(upstream_port), *upstream_args],
+            stdout=subprocess.DEVNULL))
+        _wait_until_up(upstream_url)
+        processes.append(subprocess.Popen(
+            [sys.executable, '-m', 'benchmarks.serve_ui', '--upstream', upstream_url, '--port', str(ui_port),
+             *ui_args], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        _wait_until_up(ui_url + '/version')
+        yield ui_url
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            process.wait()
+
+
+def parse_mix(text):
+    """
+    Parse a page mix such as 'site=90,sites=5,provider=5' into weights by page.
+
+    :rtype: dict
+    """
+    mix = {}
+    for part in text.split(','):
+        page, _, weight = part.partition('=')
+        if page not in PAGES:
+            raise argparse.ArgumentTypeError('unknown page {0}; expected one of {1}'.format(page, ', '.join(PAGES)))
+        mix[page] = float(weight or 1)
+    return mix
+
+
+class Samples:
+    """
+    Page, status code (None for a failed connection) and latency of each request of a load test, recorded
+    from any thread.
+    """
+
+    def __init__(self):
+        self._samples = []
+        self._lock = threading.Lock()
+
+    def record(self, page, status, latency):
+        """
+        Record the outcome of a request.
+
+        :param str page: the page requested
+        :param int status: the response's status code, or None if the request failed
+        :param float latency: seconds the response took
+        """
+        with self._lock:
+            self._samples.append((page, status, latency))
+
+    def summary(self, duration):
+        """
+        Summary of the samples recorded so far, as returned by `summarize`.
+
+        :param float duration: seconds over which the samples were taken
+        :rtype: dict
+        """
+        with self._lock:
+            samples = list(self._samples)
+        return summarize(samples, duration)
+
+
+class LoadTest:
+    """
+    Requests pages of one provider's sites from the UI and records their outcomes in `samples`.
+
+    :param str target: root URL of the UI
+    :param dict mix: relative weights of the pages requested
+    :param str agency_cd: provider whose pages are requested
+    :param list site_nos: sites whose pages are requested
+    :param int seed: seed of the pages and sites chosen, for reproducible runs
+    """
+
+    def __init__(self, target, mix, agency_cd, site_nos, seed=None):
+        # pylint: disable=too-many-arguments
+        self.target = target.rstrip('/')
+        self.mix = mix
+        # The distinct paths of each page, e.g. one per site for site pages
+        self.paths = {
+            page: list(dict.fromkeys(PAGES[page].format(agency_cd=agency_cd, site_no=site_no)
+                                     for site_no in site_nos))
+            for page in mix
+        }
+        self.samples = Samples()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _next_url(self):
+        with self._lock:
+            page = self._random.choices(list(self.mix), list(self.mix.values()))[0]
+            path = self._random.choice(self.paths[page])
+        return page, self.target + path
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def request(self, due=None, record=True):
+        """
+        Request the next page, recording its latency from `due`, or from now.
+        """
+        page, url = self._next_url()
+        start = time.perf_counter() if due is None else due
+        try:
+            status = self._session().get(url, timeout=120).status_code
+        except requests.exceptions.RequestException:
+            status = None
+        if record:
+            self.samples.record(page, status, time.perf_counter() - start)
+
+    def closed_loop(self, concurrency, duration, record=True):
+        """
+        Keep `concurrency` requests in flight for `duration` seconds.
+        """
+        until = time.perf_counter() + duration
+
+        def worker():
+            while time.perf_counter() < until:
+                self.request(record=record)
+
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def open_loop(self, rate, concurrency, duration, record=True):
+        """
+        Send `rate` requests per second for `duration` seconds, using up to `concurrency` connections.
+        """
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for number in range(int(rate * duration)):
+                due = start + number / rate
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(self.request, due, record)
+
+
+def summarize(samples, duration):
+    """
+    Throughput, outcomes and latency percentiles of samples, overall and by page.
+
+    :param list samples: tuples of page, status code (None for a failed connection) and latency
+    :param float duration: seconds over which the samples were taken
+    :rtype: dict
+    """
+    def stats(selected):
+        latencies = [latency for _, _, latency in selected]
+        statuses = {}
+        for _, status, _ in selected:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        return {
+            'requests': len(selected),
+            'throughput': len(selected) / duration,
+            'errors': sum(1 for _, status, _ in selected if status is None or status >= 500),
+            'statuses': statuses,
+            'mean': sum(latencies) / len(latencies),
+            'p50': percentile(latencies, 0.5),
+            'p90': percentile(latencies, 0.9),
+            'p99': percentile(latencies, 0.99),
+            'max': max(latencies)
+        }
+
+    if not samples:
+        return {'total': None, 'pages': {}}
+    pages = sorted({page for page, _, _ in samples})
+    return {
+        'total': stats(samples),
+        'pages': {page: stats([sample for sample in samples if sample[0] == page]) for page in pages}
+    }
+
+
+def format_summary(summary):
+    """
+    Table of the throughput, errors and latency percentiles of a summary, overall and by page.
+
+    :param dict summary: as returned by `summarize`
+    :rtype: str
+    """
+    lines = ['{0:<10} {1:>8} {2:>9} {3:>7} {4:>9} {5:>9} {6:>9} {7:>9}'.format(
+        'page', 'requests', 'req/s', 'errors', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms')]
+    rows = [('total', summary['total'])] + sorted(summary['pages'].items()) if summary['total'] else []
+    for page, stats in rows:
+        lines.append('{0:<10} {1:>8} {2:>9.1f} {3:>7} {4:>9.1f} {5:>9.1f} {6:>9.1f} {7:>9.1f}'.format(
+            page, stats['requests'], stats['throughput'], stats['errors'], stats['p50'] * 1000,
+            stats['p90'] * 1000, stats['p99'] * 1000, stats['max'] * 1000))
+    return '\n'.join(lines)
+
+
+def main():
+    """
+    Generate load as the command line options say, and report its throughput and latency.
+    """
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.load', description='Generate load on the UI.')
+    parser.add_argument('--target', help='root URL of a running UI (default: start one against the stand-in)')
+    parser.add_argument('--upstream-args', default='',
+                        help='arguments of the stand-in started without --target, e.g. "--latency 0.05"')
+    parser.add_argument('--ui-args', default='', help='arguments of the UI started without --target')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of measured load')
+    parser.add_argument('--warmup', type=float, default=5, help='seconds of unmeasured load before measuring')
+    parser.add_argument('--concurrency', type=int, default=8, help='requests in flight at once')
+    parser.add_argument('--rate', type=float, help='send this many requests per second instead of a closed loop')
+    parser.add_argument('--mix', type=parse_mix, default='site=90,sites=5,provider=5',
+                        help='relative weights of the pages requested (default: %(default)s)')
+    parser.add_argument('--agency-cd', default='CODWR')
+    parser.add_argument('--sites', type=int, default=100,
+                        help='number of sites requested, numbered from 1000 as the stand-in serves them')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--output', help='write the summary as JSON to this file')
+    args = parser.parse_args()
+    mix = parse_mix(args.mix) if isinstance(args.mix, str) else args.mix
+
+    with contextlib.ExitStack() as stack:
+        target = args.target or stack.enter_context(
+            local_servers(shlex.split(args.upstream_args), shlex.split(args.ui_args)))
+        test = LoadTest(target, mix, args.agency_cd, [str(1000 + number) for number in range(args.sites)],
+                        seed=args.seed)
+        for duration, record in ((args.warmup, False), (args.duration, True)):
+            if duration <= 0:
+                continue
+            if args.rate:
+                test.open_loop(args.rate, args.concurrency, duration, record=record)
+            else:
+                test.closed_loop(args.concurrency, duration, record=record)
+
+    summary = test.samples.summary(args.duration)
+    print(format_summary(summary))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump({'environment': environment(), 'arguments': {**vars(args), 'mix': mix}, 'summary': summary},
+                      file, indent=2, sort_keys=True)
+            file.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+"""
+Registry and timing loop of the benchmarks.
+"""
+from collections import namedtuple
+import contextlib
+import datetime
+import json
+import math
+import os
+import platform
+import statistics
+import time
+import tracemalloc
+from unittest import mock
+
+from ngwmn import app
+from ngwmn.services.cache import reset_cache
+from ngwmn.services.classification import reset_memo, shutdown_pool
+from ngwmn.services.lithology_index import reset_index
+
+Benchmark = namedtuple('Benchmark', ['name', 'setup', 'items', 'thresholds'])
+
+BENCHMARKS = []
+
+# Settings under which every benchmark runs: nothing is cached between rounds unless a benchmark says so,
+# and nothing is read from or written to disk
+CONFIG = {
+    'CACHE_BACKEND': None,
+    'LITHOLOGY_MEMO_PATH': None,
+    'LITHOLOGY_INDEX_PATH': None,
+    'LITHOLOGY_PROCESS_POOL': False,
+    'HTTP_RETRIES': 0
+}
+
+
+# Largest tolerated regression of each compared metric, as a fraction of the baseline. Timings of the same
+# revision vary by up to a third between runs on a busy machine; traced memory barely varies at all.
+DEFAULT_THRESHOLDS = {
+    'latency': 0.5,
+    'throughput': 0.33,
+    'memory': 0.1
+}
+
+
+def register(name, setup, items=None, thresholds=None):
+    """
+    Add a benchmark to the suite.
+
+    :param str name: unique name of the benchmark, e.g. 'well_log[100]'
+    :param setup: callable returning a context manager that prepares the benchmark and yields the callable to time
+    :param int items: items processed by each call, to report throughput in items per second
+    :param dict thresholds: overrides of DEFAULT_THRESHOLDS for this benchmark, e.g. for a noisy one
+    """
+    if any(existing.name == name for existing in BENCHMARKS):
+        raise ValueError('Duplicate benchmark {0}'.format(name))
+    BENCHMARKS.append(Benchmark(name, setup, items, {**DEFAULT_THRESHOLDS, **(thresholds or {})}))
+
+
+@contextlib.contextmanager
+def configured(**overrides):
+    """
+    Apply the benchmark settings, and any overrides, with empty caches and memos.
+    """
+    def reset():
+        reset_cache()
+        reset_memo()
+        reset_index()
+        shutdown_pool()
+
+    with mock.patch.dict(app.config, {**CONFIG, **overrides}):
+        reset()
+        try:
+            yield
+        finally:
+            reset()
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of values.
+
+    :param list values: the measurements
+    :param float fraction: e.g. 0.95 for the 95th percentile
+    """
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def measure(benchmark, min_time=1.0, min_rounds=5, max_rounds=10000):
+    """
+    Time a benchmark after one warm-up call, for at least min_time seconds and
+    min_rounds rounds, then trace the memory allocated by one more call.
+    Tracing slows Python down considerably, so it is kept out of the timed rounds.
+
+    :param Benchmark benchmark: the benchmark
+    :return: timings in seconds, throughput, and peak traced memory in bytes
+    :rtype: dict
+    """
+    with configured(), benchmark.setup() as func:
+        func()
+        timings = []
+        started = time.perf_counter()
+        while len(timings) < max_rounds and (len(timings) < min_rounds or time.perf_counter() - started < min_time):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        try:
+            func()
+            peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    mean = statistics.mean(timings)
+    result = {
+        'rounds': len(timings),
+        'mean': mean,
+        'median': statistics.median(timings),
+        'p95': percentile(timings, 0.95),
+        'min': min(timings),
+        'stddev': statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        'ops_per_sec': 1 / mean,
+        'peak_memory': peak_memory
+    }
+    if benchmark.items:
+        result['items_per_sec'] = benchmark.items / mean
+    return result
+
+
+def environment():
+    """
+    Description of the machine and interpreter the benchmarks ran on.
+
+    :rtype: dict
+    """
+    return {
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count()
+    }
+
+
+def run(name_filter=None, min_time=1.0, report=print):
+    """
+    Run the registered benchmarks whose name contains name_filter.
+
+    :param str name_filter: substring of the names of the benchmarks to run, or None for all
+    :param float min_time: minimum seconds spent timing each benchmark
+    :param report: called with a line of text as each benchmark finishes
+    :return: results, in the format written by `write_results`
+    :rtype: dict
+    """
+    results = {}
+    for benchmark in BENCHMARKS:
+        if name_filter and name_filter not in benchmark.name:
+            continue
+        result = results[benchmark.name] = measure(benchmark, min_time=min_time)
+        throughput = ' {0:>12,.0f} items/s'.format(result['items_per_sec']) if 'items_per_sec' in result else ''
+        report('{0:<40} {1:>10.3f} ms mean {2:>10.3f} ms p95 {3:>6} rounds {4:>10,.0f} KiB peak{5}'.format(
+            benchmark.name, result['mean'] * 1000, result['p95'] * 1000, result['rounds'],
+            result['peak_memory'] / 1024, throughput))
+    return {'environment': environment(), 'benchmarks': results}
+
+
+def write_results(path, results):
+    """
+    Write results as JSON.
+    """
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(results, file, indent=2, sort_keys=True)
+        file.write('\n')
+
+
+def read_results(path):
+    """
+    Read results written by `write_results`.
+
+    :rtype: dict
+    """
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
@@ -0,0 +1,54 @@
+"""
+Run the UI with every upstream service pointed at the stand-in.
+
+    python -m benchmarks.serve_ui --upstream http://127.0.0.1:8090 --port 5051
+
+Service roots are read when the application is imported, so they are set on
+the `config` module beforehand. Settings in instance/config.py still take
+precedence.
+"""
+import argparse
+import logging
+
+
+def configure(upstream, cache_backend='memory'):
+    """
+    Point the default configuration at the stand-in. Must be called before ngwmn is imported.
+
+    :param str upstream: root URL of the stand-in
+    :param cache_backend: CACHE_BACKEND setting
+    """
+    import config  # pylint: disable=import-outside-toplevel
+
+    upstream = upstream.rstrip('/')
+    config.SERVICE_ROOT = upstream
+    config.STATS_SERVICE_ROOT = upstream + '/ngwmn_statistics'
+    config.CONFLUENCE_URL = upstream + '/confluence'
+    config.STATISTICS_METHODS_URL = upstream + '/confluence/statistics-methods'
+    config.COOPERATOR_SERVICE_PATTERN = upstream + \
+        '/customer/stories/{site_no}&StartDate=10/1/{year}&EndDate={current_date}'
+    config.CACHE_BACKEND = cache_backend
+    config.LITHOLOGY_MEMO_PATH = None
+
+
+def main():
+    """
+    Run the UI against the stand-in until interrupted.
+    """
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.serve_ui',
+                                     description='Run the UI against the upstream stand-in.')
+    parser.add_argument('--upstream', default='http://127.0.0.1:8090', help='root URL of the stand-in')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5051)
+    parser.add_argument('--no-cache', action='store_true', help='disable caching of upstream responses')
+    args = parser.parse_args()
+
+    configure(args.upstream, cache_backend=None if args.no_cache else 'memory')
+    from ngwmn import app  # pylint: disable=import-outside-toplevel
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+The benchmarks: upstream document parsing, lithology classification, key
+conversion of feature properties, and whole site page rendering.
+"""
+import contextlib
+import functools
+from unittest import mock
+
+from ngwmn import app
+from ngwmn.services.classification import classify_descriptions, description_words
+from ngwmn.services.lithology_parser import classify_material, parse_descriptions
+from ngwmn.services.ngwmn import convert_keys_and_booleans, get_water_quality, get_well_log
+
+from . import synthetic
+from .runner import register
+from .upstream import Upstream, in_process
+
+AGENCY_CD = 'CODWR'
+SITE_NO = '1000'
+
+
+@contextlib.contextmanager
+def well_log(entries):
+    """
+    Fetch and convert a well log of `entries` log entries. In the steady state, the warm-up call has
+    memoized the log's descriptions, so rounds time parsing and memo lookups.
+    """
+    with in_process(Upstream(log_entries=entries)):
+        yield functools.partial(get_well_log, AGENCY_CD, SITE_NO)
+
+
+@contextlib.contextmanager
+def water_quality(activities, streaming=True):
+    """
+    Fetch and convert a water-quality document of `activities` activities, streamed or parsed as a tree.
+    """
+    with mock.patch.dict(app.config, {'WATER_QUALITY_STREAMING': streaming}), \
+            in_process(Upstream(activities=activities, results=4)):
+        yield functools.partial(get_water_quality, AGENCY_CD, SITE_NO)
+
+
+@contextlib.contextmanager
+def classify_each(count):
+    """
+    Classify `count` descriptions one at a time, as a caller without batching would.
+    """
+    descriptions = [description_words(description) for description in synthetic.sample_descriptions(count)]
+    yield lambda: [classify_material(words) for words in descriptions]
+
+
+@contextlib.contextmanager
+def parse_batch(count):
+    """
+    Parse `count` descriptions in one batch, without memoization.
+    """
+    descriptions = [description_words(description) for description in synthetic.sample_descriptions(count)]
+    yield functools.partial(parse_descriptions, descriptions)
+
+
+@contextlib.contextmanager
+def classify_memoized(count):
+    """
+    Classify `count` descriptions through the memo, which the warm-up call fills.
+    """
+    descriptions = [description_words(description) for description in synthetic.sample_descriptions(count)]
+    yield functools.partial(classify_descriptions, descriptions)
+
+
+@contextlib.contextmanager
+def convert_features(count):
+    """
+    Convert the keys and values of the properties of `count` site features.
+    """
+    features = [feature['properties'] for feature in synthetic.site_features(count)['features']]
+    yield lambda: [convert_keys_and_booleans(properties) for properties in features]
+
+
+@contextlib.contextmanager
+def site_page(entries, activities):
+    """
+    Render a site page whose well log has `entries` log entries and whose water-quality document has
+    `activities` activities, through the Flask test client.
+    """
+    client = app.test_client()
+    url = '/provider/{0}/site/{1}/'.format(AGENCY_CD, SITE_NO)
+
+    def render():
+        response = client.get(url)
+        if response.status_code != 200:
+            raise AssertionError('{0} responded {1}'.format(url, response.status_code))
+        return response
+
+    with in_process(Upstream(log_entries=entries, activities=activities, results=4)):
+        yield render
+
+
+for _entries in (10, 100, 1000, 5000):
+    register('well_log[{0}]'.format(_entries), functools.partial(well_log, _entries), items=_entries)
+for _activities in (10, 100, 1000):
+    register('water_quality[{0}]'.format(_activities), functools.partial(water_quality, _activities),
+             items=_activities)
+register('water_quality_tree[1000]', functools.partial(water_quality, 1000, streaming=False), items=1000)
+register('classify_material[200]', functools.partial(classify_each, 200), items=200)
+register('parse_descriptions[1000]', functools.partial(parse_batch, 1000), items=1000)
+register('classify_descriptions_memoized[1000]', functools.partial(classify_memoized, 1000), items=1000)
+for _features in (1000, 10000):
+    register('convert_keys_and_booleans[{0}]'.format(_features), functools.partial(convert_features, _features),
+             items=_features)
+# Site pages wait on calls running in the upstream thread pool, so their timings vary more
+for _entries, _activities in ((100, 20), (1000, 200)):
+    register('site_page[{0}]'.format(_entries), functools.partial(site_page, _entries, _activities),
+             thresholds={'latency': 0.6, 'throughput': 0.4})
@@ -0,0 +1,161 @@
+"""
+Synthetic upstream documents of arbitrary size, scaled up from the mock
+responses used by the unit tests.
+
+Generators are deterministic for a given size and seed, so that runs of the
+benchmarks on different revisions parse identical inputs.
+"""
+import copy
+import json
+import os
+import random
+
+from lxml import etree
+
+from ngwmn.tests.services.mock_data import MOCK_OVERALL_STATS, MOCK_SITES_RESPONSE, MOCK_WELL_LOG_RESPONSE, \
+    MOCK_WQ_RESPONSE
+
+MATERIALS_PATH = os.path.join(os.path.dirname(__file__), '..', 'ngwmn', 'tests', 'services', 'materials.txt')
+
+_GML = 'http://www.opengis.net/gml'
+_GSML = 'urn:cgi:xmlns:CGI:GeoSciML:2.0'
+_GWML = 'http://www.nrcan.gc.ca/xml/gwml/1'
+_WQX = 'http://www.exchangenetwork.net/schema/wqx/2'
+
+
+def load_descriptions():
+    """
+    Well-log interval descriptions seen in the wild, one per line of the test data.
+
+    :rtype: list
+    """
+    with open(MATERIALS_PATH, encoding='utf-8') as file:
+        return [line.strip() for line in file if line.strip()]
+
+
+def sample_descriptions(count, seed=0):
+    """
+    A reproducible sample of real descriptions, with repeats once count exceeds
+    the number available, as happens across the wells of a provider.
+
+    :param int count: number of descriptions
+    :param int seed: seed of the sample
+    :rtype: list
+    """
+    descriptions = load_descriptions()
+    rand = random.Random(seed)
+    return [rand.choice(descriptions) for _ in range(count)]
+
+
+def well_log_document(entries, seed=0):
+    """
+    A well log with the given number of log entries, each described by a
+    description from `sample_descriptions`.
+
+    :param int entries: number of log entries
+    :param int seed: seed of the descriptions
+    :rtype: bytes
+    """
+    root = etree.fromstring(MOCK_WELL_LOG_RESPONSE)
+    well = root.find('.//{%s}WaterWell' % _GWML)
+    templates = well.findall('{%s}logElement' % _GWML)
+    position = well.index(templates[0])
+    for template in templates:
+        well.remove(template)
+
+    depth = 0.0
+    for number, description in enumerate(sample_descriptions(entries, seed)):
+        element = copy.deepcopy(templates[number % len(templates)])
+        unit = element.find('.//{%s}HydrostratigraphicUnit' % _GWML)
+        unit.set('{%s}id' % _GML, 'SYNTHETIC.{0}.'.format(number))
+        unit.find('{%s}description' % _GML).text = description
+        thickness = 1.0 + number % 7
+        element.find('.//{%s}coordinates' % _GML).text = '{0:.2f} {1:.2f}'.format(depth, depth + thickness)
+        depth += thickness
+        well.insert(position + number, element)
+    return etree.tostring(root, xml_declaration=True, encoding='UTF-8')
+
+
+def water_quality_document(activities, results=2):
+    """
+    A WQX document with the given number of activities of `results` results each.
+
+    :param int activities: number of sampling activities
+    :param int results: number of results per activity
+    :rtype: bytes
+    """
+    root = etree.fromstring(MOCK_WQ_RESPONSE)
+    organization = root.find('{%s}Organization' % _WQX)
+    template = organization.find('{%s}Activity' % _WQX)
+    result_templates = template.findall('{%s}Result' % _WQX)
+    for result in result_templates:
+        template.remove(result)
+    organization.remove(template)
+
+    for number in range(activities):
+        activity = copy.deepcopy(template)
+        activity.find('.//{%s}ActivityIdentifier' % _WQX).text = 'synthetic.{0}'.format(number)
+        activity.find('.//{%s}ActivityStartDate' % _WQX).text = '{0}-{1:02d}-{2:02d}'.format(
+            1980 + number % 40, 1 + number % 12, 1 + number % 28)
+        for result_number in range(results):
+            result = copy.deepcopy(result_templates[result_number % len(result_templates)])
+            result.find('.//{%s}ResultMeasureValue' % _WQX).text = str(round(0.1 * (number + result_number), 1))
+            activity.append(result)
+        organization.append(activity)
+    return etree.tostring(root, xml_declaration=True, encoding='UTF-8')
+
+
+def site_features(count, agency_cd='CODWR'):
+    """
+    A geoserver FeatureCollection of the given number of sites of one provider,
+    flagged as being in both the water-level and water-quality networks.
+
+    :param int count: number of sites
+    :param str agency_cd: agency code of the sites
+    :rtype: dict
+    """
+    template = json.loads(MOCK_SITES_RESPONSE)['features'][0]
+    features = []
+    for number in range(count):
+        feature = copy.deepcopy(template)
+        properties = feature['properties']
+        site_no = str(1000 + number)
+        feature['id'] = 'VW_GWDP_GEOSERVER.synthetic.{0}'.format(number)
+        properties.update({
+            'AGENCY_CD': agency_cd,
+            'SITE_NO': site_no,
+            'MY_SITEID': '{0}:{1}'.format(agency_cd, site_no),
+            'FID': '{0}.{1}'.format(agency_cd, site_no),
+            'QW_SN_FLAG': '1',
+            'QW_SN_DESC': 'Yes',
+            'WL_SN_FLAG': '1'
+        })
+        features.append(feature)
+    return {'type': 'FeatureCollection', 'totalFeatures': count, 'features': features}
+
+
+def monthly_statistics(site_no, agency_cd='CODWR'):
+    """
+    Monthly water-level statistics for all twelve months.
+
+    :rtype: dict
+    """
+    monthly = {}
+    for month in range(1, 13):
+        median = 25 + month / 10
+        monthly[str(month)] = {
+            'P10': str(median + 1.5), 'P25': str(median + 0.8), 'P50': str(median), 'P75': str(median - 0.8),
+            'P90': str(median - 1.5), 'P50_MIN': str(median + 2), 'P50_MAX': str(median - 2),
+            'SAMPLE_COUNT': '200', 'RECORD_YEARS': '11', 'MONTH': str(month),
+            'AGENCY_CD': agency_cd, 'SITE_NO': site_no
+        }
+    return monthly
+
+
+def overall_statistics(site_no, agency_cd='CODWR'):
+    """
+    Overall water-level statistics of a ranked site, so that its monthly statistics are fetched too.
+
+    :rtype: dict
+    """
+    return {**MOCK_OVERALL_STATS, 'IS_RANKED': 'Y', 'AGENCY_CD': agency_cd, 'SITE_NO': site_no}
@@ -0,0 +1,189 @@
+"""
+A stand-in for the upstream services a site page calls, answering with
+synthetic documents of configurable size.
+
+`Upstream` routes a request to a response without any networking, so it can
+be served in-process through a requests transport adapter, keeping the
+benchmarks free of socket and scheduling noise.
+"""
+import contextlib
+import functools
+import http
+import io
+import json
+import re
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+
+from requests.adapters import HTTPAdapter
+from urllib3.response import HTTPResponse
+
+from ngwmn.services import http_client
+from ngwmn.tests.services.mock_data import MOCK_PROVIDERS_RESPONSE, MOCK_SIFTA_RESPONSE, MOCK_SITE_INFO
+
+from . import synthetic
+
+_STATISTIC_PATH = re.compile(r'/ngwmn_cache/direct/json/(?P<stat_type>[^/]+)/(?P<agency_cd>[^/]+)/(?P<site_no>[^/]+)$')
+_SITE_NO_FILTER = re.compile(r"SITE_NO='(?P<site_no>(?:[^']|'')*)'")
+
+_XML = {'Content-Type': 'text/xml; charset=UTF-8'}
+_JSON = {'Content-Type': 'application/json'}
+_HTML = {'Content-Type': 'text/html; charset=UTF-8'}
+
+
+# Each upstream endpoint, with a test of whether it serves a request path
+_ENDPOINTS = (
+    ('iddata', lambda path: path.endswith('/ngwmn/iddata')),
+    ('wfs', lambda path: path.endswith('/ngwmn/geoserver/wfs')),
+    ('statistics', lambda path: _STATISTIC_PATH.search(path) is not None),
+    ('agencies', lambda path: path.endswith('/ngwmn/metadata/agencies')),
+    ('sifta', lambda path: '/customer/stories/' in path),
+    ('confluence', lambda path: '/confluence/' in path)
+)
+
+
+def endpoint_name(path):
+    """
+    Name of the upstream endpoint serving a path, for targeting faults and reporting.
+
+    :param str path: path of the request URL
+    :return: 'iddata', 'wfs', 'statistics', 'agencies', 'sifta', 'confluence', or None if none serves it
+    """
+    return next((name for name, serves in _ENDPOINTS if serves(path)), None)
+
+
+class Upstream:
+    """
+    Responses of the NGWMN services, the statistics cache, SIFTA and Confluence
+    for every site of one provider. The synthetic documents are generated on
+    first use.
+
+    :param int log_entries: log entries in each well log
+    :param int activities: activities in each water-quality document
+    :param int results: results of each water-quality activity
+    :param int sites: sites of the provider
+    """
+
+    def __init__(self, log_entries=50, activities=20, results=2, sites=100):
+        self.log_entries = log_entries
+        self.activities = activities
+        self.results = results
+        self.sites = sites
+
+    @functools.cached_property
+    def well_log(self):
+        """The well log document served for every site."""
+        return synthetic.well_log_document(self.log_entries)
+
+    @functools.cached_property
+    def water_quality(self):
+        """The water-quality document served for every site."""
+        return synthetic.water_quality_document(self.activities, self.results)
+
+    @functools.cached_property
+    def features(self):
+        """The WFS feature collection of every site of the provider."""
+        return synthetic.site_features(self.sites)
+
+    def site_feature(self, site_no):
+        """
+        The WFS feature collection of one site.
+
+        :param str site_no: the site's identifier
+        :rtype: dict
+        """
+        template = self.features['features'][0]
+        feature = {**template, 'properties': {**template['properties'], 'SITE_NO': site_no}}
+        return {'type': 'FeatureCollection', 'totalFeatures': 1, 'features': [feature]}
+
+    def respond(self, method, path, query, body):
+        """
+        Answer a request.
+
+        :param str method: HTTP method
+        :param str path: path of the request URL
+        :param dict query: parsed query string, as returned by parse_qs
+        :param dict body: parsed form body, as returned by parse_qs
+        :return: status code, headers and content
+        :rtype: tuple
+        """
+        # pylint: disable=too-many-return-statements
+        endpoint = endpoint_name(path)
+        if endpoint == 'iddata':
+            request = query.get('request', [''])[0]
+            if request == 'well_log':
+                return 200, _XML, self.well_log
+            if request == 'water_quality':
+                return 200, _XML, self.water_quality
+        elif endpoint == 'wfs' and method == 'POST':
+            cql_filter = body.get('CQL_FILTER', [''])[0]
+            site_match = _SITE_NO_FILTER.search(cql_filter)
+            if site_match:
+                document = self.site_feature(site_match.group('site_no').replace("''", "'"))
+            else:
+                document = self.features
+            return 200, _JSON, json.dumps(document).encode('utf-8')
+        elif endpoint == 'agencies':
+            return 200, _JSON, MOCK_PROVIDERS_RESPONSE.encode('utf-8')
+        elif endpoint == 'statistics':
+            match = _STATISTIC_PATH.search(path)
+            stat_type, agency_cd, site_no = match.group('stat_type', 'agency_cd', 'site_no')
+            document = {
+                'site-info': lambda: MOCK_SITE_INFO,
+                'wl-overall': lambda: synthetic.overall_statistics(site_no, agency_cd),
+                'wl-monthly': lambda: synthetic.monthly_statistics(site_no, agency_cd)
+            }.get(stat_type)
+            if document is not None:
+                return 200, _JSON, json.dumps(document()).encode('utf-8')
+        elif endpoint == 'sifta':
+            return 200, _JSON, MOCK_SIFTA_RESPONSE.encode('utf-8')
+        elif endpoint == 'confluence':
+            return 200, _HTML, b'<p>Synthetic provider content</p>'
+        return 404, _HTML, b'Not Found'
+
+
+class UpstreamAdapter(HTTPAdapter):
+    """
+    Transport adapter answering every request from an `Upstream` without
+    opening a connection.
+    """
+
+    def __init__(self, upstream):
+        super().__init__()
+        self.upstream = upstream
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        # pylint: disable=too-many-arguments
+        parts = urlsplit(request.url)
+        body = request.body or ''
+        if isinstance(body, bytes):
+            body = body.decode('utf-8')
+        status, headers, content = self.upstream.respond(request.method, parts.path, parse_qs(parts.query),
+                                                         parse_qs(body))
+        raw = HTTPResponse(body=io.BytesIO(content), headers=headers, status=status,
+                           reason=http.HTTPStatus(status).phrase, preload_content=False)
+        return self.build_response(request, raw)
+
+
+@contextlib.contextmanager
+def in_process(upstream):
+    """
+    Route every upstream call made through ngwmn.services.http_client to an
+    `Upstream` for the duration of the block.
+
+    :param Upstream upstream: the stand-in services
+    """
+    def create_session(retries=True):
+        session = original(retries)
+        adapter = UpstreamAdapter(upstream)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    original = http_client._create_session  # pylint: disable=protected-access
+    http_client.close_sessions()
+    try:
+        with mock.patch('ngwmn.services.http_client._create_session', create_session):
+            yield upstream
+    finally:
+        http_client.close_sessions()
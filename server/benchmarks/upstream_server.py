@@ -0,0 +1,175 @@
+"""
+Standalone HTTP stand-in for the upstream services, for load testing the UI
+without calling cida.usgs.gov.
+
+    python -m benchmarks.upstream_server --port 8090 --latency 0.05 --jitter 0.02 --error-rate 0.01
+
+serves the NGWMN iddata, WFS, statistics and agencies endpoints, SIFTA and
+Confluence from synthetic documents, delaying each response by `latency`
+seconds plus an exponentially distributed `jitter`, and failing a fraction of
+responses. `python -m benchmarks.serve_ui` runs the UI against it.
+"""
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import random
+import sys
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from .upstream import Upstream, endpoint_name
+
+
+class Faults:
+    """
+    Latency and errors injected into the stand-in's responses.
+
+    :param float latency: seconds every response is delayed
+    :param float jitter: mean of an exponentially distributed extra delay, in seconds
+    :param float slow_rate: fraction of responses delayed by slow_latency instead
+    :param float slow_latency: seconds a slow response is delayed
+    :param float error_rate: fraction of responses replaced by an error
+    :param int error_status: status code of the injected errors
+    :param endpoints: names of the endpoints faults apply to, or None for all
+    :param int seed: seed of the random choices, for reproducible runs
+    """
+    # pylint: disable=too-many-instance-attributes,too-few-public-methods
+
+    def __init__(self, latency=0.0, jitter=0.0, slow_rate=0.0, slow_latency=0.0, error_rate=0.0,
+                 error_status=503, endpoints=None, seed=None):
+        # pylint: disable=too-many-arguments
+        self.latency = latency
+        self.jitter = jitter
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.endpoints = set(endpoints) if endpoints else None
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def draw(self, endpoint):
+        """
+        Decide the delay and outcome of a response.
+
+        :param str endpoint: name of the endpoint responding
+        :return: seconds to delay it, and the status code of an error to answer instead, or None
+        :rtype: tuple
+        """
+        if self.endpoints is not None and endpoint not in self.endpoints:
+            return 0.0, None
+        with self._lock:
+            if self._random.random() < self.slow_rate:
+                delay = self.slow_latency
+            else:
+                delay = self.latency + (self._random.expovariate(1 / self.jitter) if self.jitter else 0.0)
+            failed = self._random.random() < self.error_rate
+        return delay, self.error_status if failed else None
+
+
+def make_server(upstream, faults, host='127.0.0.1', port=8090, verbose=False):
+    """
+    Create the HTTP server; call serve_forever() on it to serve requests.
+
+    :param Upstream upstream: the responses to serve
+    :param Faults faults: the latency and errors to inject
+    :rtype: http.server.ThreadingHTTPServer
+    """
+    # pylint: disable=too-many-arguments
+
+    class Handler(BaseHTTPRequestHandler):
+        """Answers each request from upstream, after the faults drawn for it."""
+        protocol_version = 'HTTP/1.1'
+
+        def _respond(self):
+            parts = urlsplit(self.path)
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length).decode('utf-8') if length else ''
+
+            delay, error_status = faults.draw(endpoint_name(parts.path))
+            if delay:
+                time.sleep(delay)
+            if error_status is not None:
+                status, headers, content = error_status, {'Content-Type': 'text/plain'}, b'Injected error'
+            else:
+                status, headers, content = upstream.respond(self.command, parts.path, parse_qs(parts.query),
+                                                            parse_qs(body))
+
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        do_GET = _respond
+        do_POST = _respond
+
+        def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+            if verbose:
+                super().log_message(format, *args)
+
+    class Server(ThreadingHTTPServer):
+        """Serves each connection on a thread of its own."""
+        daemon_threads = True
+
+        def handle_error(self, request, client_address):
+            # The UI closes connections whose responses it no longer waits for, e.g. once a page has failed
+            if not isinstance(sys.exc_info()[1], ConnectionError):
+                super().handle_error(request, client_address)
+
+    return Server((host, port), Handler)
+
+
+def parse_args(args=None):
+    """
+    Parse the command line options of the stand-in.
+
+    :param list args: the arguments, or None for those of the process
+    :rtype: argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.upstream_server',
+                                     description='Serve synthetic upstream responses for load testing.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--log-entries', type=int, default=50, help='log entries in each well log')
+    parser.add_argument('--activities', type=int, default=20, help='activities in each water-quality document')
+    parser.add_argument('--results', type=int, default=2, help='results of each water-quality activity')
+    parser.add_argument('--sites', type=int, default=100, help='sites of the provider')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds every response is delayed')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='mean seconds of exponentially distributed extra delay')
+    parser.add_argument('--slow-rate', type=float, default=0.0,
+                        help='fraction of responses delayed by --slow-latency instead')
+    parser.add_argument('--slow-latency', type=float, default=0.0, help='seconds a slow response is delayed')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of responses that fail')
+    parser.add_argument('--error-status', type=int, default=503, help='status code of failed responses')
+    parser.add_argument('--endpoints', help='comma separated endpoints faults apply to: iddata, wfs, statistics, '
+                                            'agencies, sifta, confluence (default: all)')
+    parser.add_argument('--seed', type=int, help='seed of the injected faults')
+    parser.add_argument('--verbose', action='store_true', help='log every request')
+    return parser.parse_args(args)
+
+
+def main():
+    """
+    Serve the stand-in until interrupted.
+    """
+    args = parse_args()
+    upstream = Upstream(log_entries=args.log_entries, activities=args.activities, results=args.results,
+                        sites=args.sites)
+    faults = Faults(latency=args.latency, jitter=args.jitter, slow_rate=args.slow_rate,
+                    slow_latency=args.slow_latency, error_rate=args.error_rate, error_status=args.error_status,
+                    endpoints=args.endpoints.split(',') if args.endpoints else None, seed=args.seed)
+    server = make_server(upstream, faults, host=args.host, port=args.port, verbose=args.verbose)
+    print('Serving upstream stand-in on http://{0}:{1}/'.format(*server.server_address[:2]), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+
+"""
+Build the precomputed lithology classification index read by get_well_log.
+
+Crawls the well logs of every site of the given providers (or of all
+providers), classifies their distinct interval descriptions in parallel
+processes and writes the index file. Point LITHOLOGY_INDEX_PATH at the file
+to use it.
+"""
+
+import argparse
+import logging
+
+from ngwmn import app
+from ngwmn.services.lithology_index import build_index
+from ngwmn.services.ngwmn import get_providers
+
+
+def main():
+    """Build the index from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('agency_cds', nargs='*', metavar='AGENCY_CD',
+                        help='providers whose well logs are indexed (default: all providers)')
+    parser.add_argument('--output', '-o', default=app.config.get('LITHOLOGY_INDEX_PATH') or 'lithology_index.sqlite',
+                        help='path of the index file (default: LITHOLOGY_INDEX_PATH)')
+    parser.add_argument('--threads', '-t', type=int, default=8, help='well logs fetched at a time')
+    parser.add_argument('--processes', '-p', type=int, default=None,
+                        help='classifying processes (default: one per CPU)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    app.logger.setLevel(logging.INFO)
+    # Each well log is read once, so there is nothing to gain from caching the responses
+    app.config['CACHE_BACKEND'] = None
+
+    agency_cds = args.agency_cds or [provider['agency_cd'] for provider in get_providers()]
+    count = build_index(args.output, agency_cds, threads=args.threads, processes=args.processes)
+    app.logger.info('Wrote %s descriptions to %s', count, args.output)
+
+
+if __name__ == '__main__':
+    main()
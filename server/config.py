@@ -12,3 +12,124 @@ CONFLUENCE_URL = 'place holder - see dev tier for workspace value'
 STATISTICS_METHODS_URL = 'place holder - see dev tier for workspace value'
 # URL pattern for retrieving SIFTA cooperator logos
 COOPERATOR_SERVICE_PATTERN = 'https://water.usgs.gov/customer/stories/{site_no}&StartDate=10/1/{year}&EndDate={current_date}'
+
+# Dispatch the independent upstream calls for a page concurrently. When False, they are made one after another.
+CONCURRENT_FETCH = True
+# Size of the thread pool shared by concurrent upstream calls
+UPSTREAM_MAX_WORKERS = 16
+# Seconds a site page will wait for its upstream calls before giving up with a 504
+SITE_PAGE_TIMEOUT = 30
+# Seconds a site page will wait for its water-quality, statistics and cooperator data before showing those that are
+# not ready as temporarily unavailable. The calls left behind still complete and are cached. None waits for them until
+# SITE_PAGE_TIMEOUT.
+SITE_PAGE_BUDGET = 10
+# Parse water-quality documents incrementally as they are downloaded, rather than loading them whole
+WATER_QUALITY_STREAMING = True
+# Skip site page calls for data that the site's metadata flags, or a recent 404, say does not exist
+PLAN_SITE_FETCHES = True
+# Seconds a provider page will wait for the provider list and its Confluence content before giving up with a 504
+PROVIDER_PAGE_TIMEOUT = 30
+
+# Report the duration, status, size and cache outcome of each request's service calls in a Server-Timing header,
+# and log them as one JSON line per request to the 'ngwmn.access' logger
+SERVER_TIMING = True
+ACCESS_LOG = True
+# Record Prometheus metrics and serve them at /metrics. Off by default, as the endpoint is not authenticated. Under a
+# multi-process server, set the PROMETHEUS_MULTIPROC_DIR environment variable as described in ngwmn/services/metrics.py
+METRICS_ENABLED = False
+# Trace each request, its service calls, XML parses, lithology classification and template rendering, and write
+# the spans of each request as one line of OTLP/JSON to this file, or to standard output if 'stdout'. None disables.
+TRACE_EXPORT = None
+# Let a request be profiled by passing profile=cprofile or profile=sample (or an X-Profile header), and return the
+# profile instead of the page; see ngwmn/services/profiling.py. If PROFILE_KEY is set, the request must also give it as
+# profile_key (or an X-Profile-Key header).
+PROFILE_ON_DEMAND = False
+PROFILE_KEY = None
+# Sample the stacks of every request, and save those of requests taking longer than this many seconds to PROFILE_DIR,
+# keeping the PROFILE_DIR_MAX_FILES most recent. None disables.
+PROFILE_SLOW_REQUESTS = None
+PROFILE_DIR = 'profiles'
+PROFILE_DIR_MAX_FILES = 50
+# Seconds between stack samples
+PROFILE_SAMPLE_INTERVAL = 0.005
+
+# Pooled HTTP sessions, one per upstream host
+HTTP_POOL_CONNECTIONS = 1
+HTTP_POOL_MAXSIZE = 16
+# Seconds allowed to establish a connection and to wait for a response
+HTTP_CONNECT_TIMEOUT = 5
+HTTP_READ_TIMEOUT = 30
+# Retries for connection errors and the listed response statuses, with exponential backoff in seconds
+HTTP_RETRIES = 2
+HTTP_RETRY_BACKOFF = 0.3
+HTTP_RETRY_STATUSES = (502, 503, 504)
+# Per-host circuit breakers: once HTTP_BREAKER_FAILURE_RATE of the last HTTP_BREAKER_WINDOW calls to a host (and at
+# least HTTP_BREAKER_MIN_CALLS) failed to connect, timed out or returned one of HTTP_BREAKER_STATUSES, calls to the
+# host fail with a 503 for HTTP_BREAKER_OPEN_SECONDS, after which HTTP_BREAKER_PROBES calls are let through to test it
+HTTP_BREAKER_ENABLED = True
+HTTP_BREAKER_WINDOW = 20
+HTTP_BREAKER_MIN_CALLS = 10
+HTTP_BREAKER_FAILURE_RATE = 0.5
+HTTP_BREAKER_OPEN_SECONDS = 30
+HTTP_BREAKER_PROBES = 1
+HTTP_BREAKER_STATUSES = (500, 502, 503, 504)
+# Per-host bulkheads: calls in flight to one host, per process, beyond which further calls wait up to
+# HTTP_BULKHEAD_WAIT seconds for a slot before failing with a 503. None disables.
+HTTP_HOST_MAX_CONCURRENCY = 12
+HTTP_BULKHEAD_WAIT = 2
+
+# Cache for upstream responses: 'memory' (per process), 'sqlite' (shared by the processes on a host),
+# 'redis' (shared over the network, requires the redis package) or None to disable caching
+CACHE_BACKEND = 'memory'
+# Least recently used entries beyond this count are evicted (memory and sqlite backends)
+CACHE_MAX_ENTRIES = 2048
+# Pickled, so it must not be writable by other users. None puts it in the Flask instance folder.
+CACHE_SQLITE_PATH = None
+CACHE_REDIS_URL = 'redis://localhost:6379/0'
+# Seconds to cache the responses of each upstream endpoint. Endpoints that are missing or 0 are not cached.
+CACHE_TTL = {
+    'iddata': 6 * 60 * 60,
+    'feature': 24 * 60 * 60,
+    'sites': 24 * 60 * 60,
+    'statistic': 6 * 60 * 60,
+    'providers': 24 * 60 * 60,
+    'well_log': 6 * 60 * 60,
+    'water_quality': 6 * 60 * 60,
+    'statistics': 6 * 60 * 60,
+    'confluence': 24 * 60 * 60
+}
+# Seconds to cache empty responses (e.g. for sites an endpoint has no data for), when shorter than their CACHE_TTL,
+# and to remember that an upstream endpoint responded 404 for a site. 0 or None does neither.
+CACHE_NEGATIVE_TTL = 15 * 60
+# Seconds to cache upstream errors (5xx), raising them again instead of retrying upstream. 0 or None disables.
+CACHE_ERROR_TTL = 30
+# Seconds past their TTL that entries of these endpoints are still served while being refreshed in the background
+CACHE_STALE_TTL = {
+    'well_log': 24 * 60 * 60,
+    'water_quality': 24 * 60 * 60,
+    'statistics': 24 * 60 * 60
+}
+# Entries accessed this many times within CACHE_HOT_WINDOW seconds are hot, and are refreshed in the background
+# once they are in the final CACHE_REFRESH_AHEAD fraction of their TTL
+CACHE_HOT_THRESHOLD = 5
+CACHE_HOT_WINDOW = 60 * 60
+CACHE_REFRESH_AHEAD = 0.2
+# Background refreshes run on a pool of CACHE_REFRESH_WORKERS threads of their own. At most CACHE_REFRESH_MAX_PENDING
+# are queued or running; stale entries beyond that are served as they are until there is room to refresh them.
+CACHE_REFRESH_WORKERS = 2
+CACHE_REFRESH_MAX_PENDING = 32
+
+# Lithology classifications of log descriptions are memoized in an in-process LRU of this many entries,
+# backed by a SQLite store at LITHOLOGY_MEMO_PATH (None to keep them in memory only), e.g. a path in the instance folder
+LITHOLOGY_MEMO_MAX_ENTRIES = 10000
+LITHOLOGY_MEMO_PATH = None
+LITHOLOGY_MEMO_STORE_MAX_ENTRIES = 100000
+# Precomputed classifications of known log descriptions, written by build_lithology_index.py (None if not used)
+LITHOLOGY_INDEX_PATH = None
+# Classify log descriptions on a pool of LITHOLOGY_PROCESSES worker processes rather than in the request thread.
+# Wells wait up to LITHOLOGY_TIMEOUT seconds for their classification, and once LITHOLOGY_MAX_PENDING wells are
+# waiting on the pool, further wells are rendered without materials.
+LITHOLOGY_PROCESS_POOL = False
+LITHOLOGY_PROCESSES = 2
+LITHOLOGY_MAX_PENDING = 4
+LITHOLOGY_TIMEOUT = 5
@@ -41,3 +41,4 @@ def handle_service_exception(error):
 from . import views # pylint: disable=C0413
 from . import filters # pylint: disable=C0413
 from . import services # pylint: disable=C0413
+from . import instrumentation # pylint: disable=C0413
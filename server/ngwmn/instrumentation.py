@@ -0,0 +1,164 @@
+"""
+Request instrumentation. Must be imported (via ngwmn.__init__) for its request
+hooks to register.
+
+The service calls made for each request are timed, and the timings returned
+in a Server-Timing header and written as one JSON line per request to the
+`ngwmn.access` logger, so that the upstream dominating a slow page can be
+identified. The duration of each request is also recorded in the request
+metrics, and the request is traced if TRACE_EXPORT is set.
+
+Requests are also profiled on demand, or when slow, as described in
+ngwmn/services/profiling.py.
+"""
+import hmac
+import json
+import logging
+
+from flask import Response, request
+
+from . import app
+from .services.metrics import observe_request
+from .services.profiling import MODES, save_profile, start_profile, stop_profile
+from .services.timing import begin_request, current_request, end_request
+from .services.tracing import current_span, end_trace, start_trace
+
+access_logger = logging.getLogger('ngwmn.access')
+access_logger.setLevel(logging.INFO)
+
+
+def access_record(response, timings):
+    """
+    Structured access log record of a request.
+
+    :param flask.Response response: the response to the request
+    :param RequestTimings timings: the timings of the request
+    :rtype: dict
+    """
+    record = {
+        'method': request.method,
+        'path': request.path,
+        'query': request.query_string.decode('utf-8', 'replace'),
+        'status': response.status_code,
+        'duration_ms': round(timings.elapsed() * 1000, 1),
+        'upstream': timings.summary()
+    }
+    root = current_span()
+    if root is not None:
+        record['trace_id'] = root.context.trace.trace_id
+    return record
+
+
+@app.before_request
+def start_timing():
+    """
+    Start collecting the timings of the request's service calls, and start
+    its trace.
+    """
+    begin_request()
+    rule = request.url_rule.rule if request.url_rule is not None else request.path
+    start_trace('{0} {1}'.format(request.method, rule), request.headers.get('traceparent'), **{
+        'http.method': request.method,
+        'http.route': rule,
+        'http.target': request.full_path if request.query_string else request.path
+    })
+
+
+def requested_profile():
+    """
+    The profiling mode requested by the request being handled, if on-demand
+    profiling is enabled by PROFILE_ON_DEMAND and the request gives the
+    PROFILE_KEY, if one is set.
+
+    :return: 'cprofile', 'sample' or None
+    :rtype: str
+    """
+    if not app.config.get('PROFILE_ON_DEMAND'):
+        return None
+    mode = request.headers.get('X-Profile') or request.args.get('profile')
+    if mode not in MODES:
+        return None
+    key = app.config.get('PROFILE_KEY')
+    given = request.headers.get('X-Profile-Key') or request.args.get('profile_key') or ''
+    if key and not hmac.compare_digest(key.encode('utf-8'), given.encode('utf-8')):
+        return None
+    return mode
+
+
+@app.before_request
+def start_profiling():
+    """
+    Profile the request if it asks to be, or sample it if slow requests are
+    being captured.
+    """
+    mode = requested_profile()
+    if mode is not None:
+        start_profile(mode, on_demand=True)
+    elif app.config.get('PROFILE_SLOW_REQUESTS') is not None:
+        start_profile('sample')
+
+
+@app.after_request
+def finish_profiling(response):
+    """
+    Return the profile of a request profiled on demand in place of its
+    response, or save the samples of a request slower than
+    PROFILE_SLOW_REQUESTS to PROFILE_DIR.
+    """
+    profile = stop_profile()
+    if profile is None:
+        return response
+    name = request.endpoint or 'unmatched'
+    if profile.on_demand:
+        content, mimetype, extension = profile.artifact()
+        artifact = Response(content, mimetype=mimetype, headers={
+            'Content-Disposition': 'attachment; filename="{0}.{1}"'.format(name, extension),
+            'Cache-Control': 'no-store',
+            'X-Profiled-Status': str(response.status_code)
+        })
+        if 'Server-Timing' in response.headers:
+            artifact.headers['Server-Timing'] = response.headers['Server-Timing']
+        return artifact
+    if profile.duration >= app.config['PROFILE_SLOW_REQUESTS']:
+        try:
+            path = save_profile(profile, name)
+        except OSError as err:
+            app.logger.warning('Could not save the profile of a slow request: %s', err)
+        else:
+            app.logger.info('Saved the profile of %s, which took %.0f ms, to %s', request.path,
+                            profile.duration * 1000, path)
+    return response
+
+
+@app.after_request
+def report_timing(response):
+    """
+    Record the request's metrics, and add the Server-Timing header and write
+    the access log record, if enabled by SERVER_TIMING and ACCESS_LOG.
+    """
+    timings = current_request()
+    if timings is None:
+        return response
+    root = current_span()
+    if root is not None:
+        root.set_attribute('http.status_code', response.status_code)
+        if response.status_code >= 500:
+            root.error = response.status
+    observe_request(request.endpoint, response.status_code, timings.elapsed())
+    if app.config.get('SERVER_TIMING'):
+        response.headers['Server-Timing'] = timings.server_timing()
+    if app.config.get('ACCESS_LOG'):
+        access_logger.info(json.dumps(access_record(response, timings), sort_keys=True))
+    return response
+
+
+@app.teardown_request
+def stop_timing(error=None):
+    """
+    Stop collecting timings once the request is finished, and export its
+    trace. Profiling is stopped too, in case the request failed before its
+    response was made.
+    """
+    end_request()
+    end_trace(error)
+    stop_profile()
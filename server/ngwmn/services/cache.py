@@ -0,0 +1,574 @@
+"""
+Response cache for upstream service calls.
+
+Three interchangeable backends are provided: an in-process memory cache, an
+on-disk SQLite cache that can be shared by all worker processes on a host, and
+a Redis-compatible network cache. The backend and the time-to-live of each
+upstream endpoint are chosen in the application configuration.
+
+Endpoints with a stale TTL are served stale-while-revalidate: once an entry
+expires it is still returned immediately while a background task refreshes
+it, and frequently accessed entries are refreshed shortly before they expire.
+Refreshes run on a small pool of their own, so that they never hold up the
+upstream calls of the requests being handled.
+
+Empty results, e.g. for a site an upstream service has no data for, are
+cached for the shorter CACHE_NEGATIVE_TTL, and upstream errors (5xx) for a few
+seconds of CACHE_ERROR_TTL, so that repeated requests for missing sites, and
+retries while a service is failing, do not all reach upstream.
+"""
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import functools
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from ngwmn import app
+from ngwmn.services import ServiceException
+from ngwmn.services.concurrency import current_deadline, remaining
+from ngwmn.services.metrics import observe_cache
+from ngwmn.services.resilience import UpstreamUnavailable
+from ngwmn.services.timing import note_cache
+
+# Returned by the backends' `get` when a key is absent or expired, since None is a valid cached value
+MISSING = object()
+
+
+class CachedError:
+    """
+    Stored in place of a result when an upstream call failed, so that the
+    failure is raised again, without calling upstream, until it expires.
+    """
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, message, status_code):
+        self.message = message
+        self.status_code = status_code
+
+    def raise_again(self):
+        """
+        Raise the failure as a ServiceException.
+        """
+        raise ServiceException(message=self.message, status_code=self.status_code)
+
+
+class MemoryCache:
+    """
+    In-process cache with per-entry expiry and least-recently-used eviction.
+    Values are stored as-is, so callers must treat them as read-only.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Return the value stored for key, or MISSING if absent or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISSING
+            expires, value = entry
+            if expires is not None and expires <= time.time():
+                del self._entries[key]
+                return MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """
+        Store a value, evicting the least recently used entries if full.
+
+        :param str key: cache key
+        :param value: value to store
+        :param ttl: seconds until the entry expires, or None to keep it until evicted
+        """
+        expires = time.time() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        """
+        Remove key from the cache, if present.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """
+        Remove every entry.
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteCache:
+    """
+    On-disk cache stored in a SQLite database. Every process that opens the same
+    file shares its entries. Values are serialized by `serializer`, pickle by
+    default, so the file must not be writable by other users; values it cannot
+    decode are treated as missing. Expired entries and the least recently used
+    entries beyond `max_entries` are pruned on write. Reads and writes the
+    database cannot take, e.g. because it is locked for longer than the timeout
+    or the disk is full, are logged and treated as misses and skipped writes.
+    """
+
+    def __init__(self, path, max_entries=10000, serializer=pickle):
+        self.path = path
+        self.max_entries = max_entries
+        self.serializer = serializer
+        self._local = threading.local()
+        self._connection().execute(
+            'CREATE TABLE IF NOT EXISTS cache '
+            '(key TEXT PRIMARY KEY, value BLOB, expires REAL, accessed REAL)'
+        )
+
+    def _connection(self):
+        # sqlite3 connections may not be shared between threads, so keep one per thread
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        """
+        Return the value stored for key, or MISSING if absent or expired.
+        """
+        now = time.time()
+        connection = self._connection()
+        try:
+            row = connection.execute(
+                'SELECT value FROM cache WHERE key = ? AND (expires IS NULL OR expires > ?)', (key, now)
+            ).fetchone()
+            if row is None:
+                return MISSING
+            connection.execute('UPDATE cache SET accessed = ? WHERE key = ?', (now, key))
+        except sqlite3.OperationalError as err:
+            app.logger.warning('Could not read %s from the SQLite cache: %s', key, err)
+            return MISSING
+        try:
+            return self.serializer.loads(row[0])
+        except (ValueError, pickle.UnpicklingError):
+            return MISSING
+
+    def set(self, key, value, ttl=None):
+        """
+        Store a value, pruning expired and least recently used entries.
+
+        :param str key: cache key
+        :param value: value to store, which the serializer must be able to encode
+        :param ttl: seconds until the entry expires, or None to keep it until evicted
+        """
+        now = time.time()
+        encoded = self.serializer.dumps(value)
+        if isinstance(encoded, bytes):
+            encoded = sqlite3.Binary(encoded)
+        connection = self._connection()
+        try:
+            connection.execute(
+                'INSERT OR REPLACE INTO cache (key, value, expires, accessed) VALUES (?, ?, ?, ?)',
+                (key, encoded, now + ttl if ttl else None, now)
+            )
+            connection.execute('DELETE FROM cache WHERE expires IS NOT NULL AND expires <= ?', (now,))
+            connection.execute(
+                'DELETE FROM cache WHERE key IN '
+                '(SELECT key FROM cache ORDER BY accessed DESC LIMIT -1 OFFSET ?)', (self.max_entries,)
+            )
+        except sqlite3.OperationalError as err:
+            app.logger.warning('Could not write %s to the SQLite cache: %s', key, err)
+
+    def delete(self, key):
+        """
+        Remove key from the cache, if present.
+        """
+        self._connection().execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def clear(self):
+        """
+        Remove every entry.
+        """
+        self._connection().execute('DELETE FROM cache')
+
+
+class RedisCache:
+    """
+    Cache stored in a Redis-compatible server, shared by every process that
+    connects to it. Values are pickled and expiry is left to the server; LRU
+    eviction is governed by the server's `maxmemory-policy` setting.
+
+    Requires the optional `redis` package.
+    """
+
+    def __init__(self, url, prefix='ngwmn:'):
+        import redis  # pylint: disable=import-outside-toplevel
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        """
+        Return the value stored for key, or MISSING if absent or expired.
+        """
+        value = self._client.get(self.prefix + key)
+        if value is None:
+            return MISSING
+        return pickle.loads(value)
+
+    def set(self, key, value, ttl=None):
+        """
+        Store a value.
+
+        :param str key: cache key
+        :param value: picklable value to store
+        :param ttl: seconds until the entry expires, or None to keep it until evicted
+        """
+        self._client.set(self.prefix + key, pickle.dumps(value), ex=int(ttl) if ttl else None)
+
+    def delete(self, key):
+        """
+        Remove key from the cache, if present.
+        """
+        self._client.delete(self.prefix + key)
+
+    def clear(self):
+        """
+        Remove every entry under this cache's prefix.
+        """
+        for key in self._client.scan_iter(match=self.prefix + '*'):
+            self._client.delete(key)
+
+
+class AccessTracker:
+    """
+    Counts accesses per key within a fixed time window, to tell hot keys from
+    cold ones. Counts are kept per process; the least recently accessed keys
+    beyond `max_keys` are forgotten.
+    """
+
+    def __init__(self, window=3600, max_keys=10000):
+        self.window = window
+        self.max_keys = max_keys
+        self._counts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key):
+        """
+        Record an access to key.
+
+        :return: number of accesses to key in the current window, including this one
+        """
+        now = time.time()
+        with self._lock:
+            window_start, count = self._counts.get(key, (now, 0))
+            if now - window_start >= self.window:
+                window_start, count = now, 0
+            count += 1
+            self._counts[key] = (window_start, count)
+            self._counts.move_to_end(key)
+            while len(self._counts) > self.max_keys:
+                self._counts.popitem(last=False)
+        return count
+
+    def clear(self):
+        """
+        Forget every count.
+        """
+        with self._lock:
+            self._counts.clear()
+
+
+_CACHE = None
+_CACHE_CREATED = False
+_CACHE_LOCK = threading.Lock()
+_TRACKER = AccessTracker(window=app.config.get('CACHE_HOT_WINDOW', 3600))
+
+# Set while a background refresh runs, so that it reads through to upstream instead of nested cache entries
+_BYPASS = contextvars.ContextVar('cache_bypass', default=False)
+_REFRESHING = set()
+_REFRESHING_LOCK = threading.Lock()
+_REFRESH_EXECUTOR = None
+_REFRESH_EXECUTOR_LOCK = threading.Lock()
+# Holds a flag for the cached call in progress, set by `skip_store` if its result must not be stored
+_SKIP_STORE = contextvars.ContextVar('cache_skip_store', default=None)
+
+
+def _create_cache():
+    backend = app.config.get('CACHE_BACKEND')
+    if not backend:
+        return None
+    if backend == 'memory':
+        return MemoryCache(max_entries=app.config.get('CACHE_MAX_ENTRIES', 1024))
+    if backend == 'sqlite':
+        path = app.config.get('CACHE_SQLITE_PATH')
+        if not path:
+            os.makedirs(app.instance_path, mode=0o700, exist_ok=True)
+            path = os.path.join(app.instance_path, 'ngwmn_ui_cache.sqlite')
+        return SQLiteCache(path, max_entries=app.config.get('CACHE_MAX_ENTRIES', 10000))
+    if backend == 'redis':
+        return RedisCache(app.config['CACHE_REDIS_URL'])
+    raise ValueError('Unknown CACHE_BACKEND: {0}'.format(backend))
+
+
+def get_cache():
+    """
+    Return the configured cache backend, creating it on first use.
+
+    :return: the cache, or None if caching is disabled
+    """
+    global _CACHE, _CACHE_CREATED  # pylint: disable=global-statement
+    with _CACHE_LOCK:
+        if not _CACHE_CREATED:
+            _CACHE = _create_cache()
+            _CACHE_CREATED = True
+    return _CACHE
+
+
+def reset_cache():
+    """
+    Discard the current cache backend so that the next use recreates it from
+    the application configuration. The entries of an in-process cache are lost.
+    """
+    global _CACHE, _CACHE_CREATED  # pylint: disable=global-statement
+    with _CACHE_LOCK:
+        _CACHE = None
+        _CACHE_CREATED = False
+    _TRACKER.clear()
+
+
+def cache_key(endpoint, *args, **kwargs):
+    """
+    Build the cache key for a call to an upstream endpoint.
+
+    :param str endpoint: name of the upstream endpoint, as used in CACHE_TTL
+    :return: key identifying the endpoint and arguments
+    :rtype: str
+    """
+    parts = [str(arg) for arg in args]
+    parts.extend('{0}={1}'.format(name, value) for name, value in sorted(kwargs.items()))
+    return '{0}:{1}'.format(endpoint, '|'.join(parts))
+
+
+def mark_absent(endpoint, *args, **kwargs):
+    """
+    Remember for CACHE_NEGATIVE_TTL seconds, like an empty response, that an
+    upstream endpoint has no data (e.g. responded 404) for these arguments.
+
+    :param str endpoint: name of the upstream endpoint
+    """
+    cache = get_cache()
+    ttl = app.config.get('CACHE_NEGATIVE_TTL')
+    if cache is not None and ttl:
+        cache.set('absent:' + cache_key(endpoint, *args, **kwargs), True, ttl)
+
+
+def is_absent(endpoint, *args, **kwargs):
+    """
+    Whether an upstream endpoint recently reported that it has no data for
+    these arguments.
+
+    :param str endpoint: name of the upstream endpoint
+    :rtype: bool
+    """
+    cache = get_cache()
+    if cache is None:
+        return False
+    return cache.get('absent:' + cache_key(endpoint, *args, **kwargs)) is True
+
+
+def skip_store():
+    """
+    Keep the result of the cached call in progress, and of the cached calls it
+    is part of, from being stored, e.g. because it is incomplete. The result is
+    still returned to the caller.
+    """
+    flag = _SKIP_STORE.get()
+    if flag is not None:
+        flag.set()
+
+
+def _load(func, *args, **kwargs):
+    # Call func, returning its result and whether the result may be stored
+    outer = _SKIP_STORE.get()
+    flag = threading.Event()
+    token = _SKIP_STORE.set(flag)
+    try:
+        value = func(*args, **kwargs)
+    finally:
+        _SKIP_STORE.reset(token)
+    if flag.is_set() and outer is not None:
+        outer.set()
+    return value, not flag.is_set()
+
+
+def _note_lookup(endpoint, outcome):
+    # Reads through during a background refresh are not lookups
+    if not _BYPASS.get():
+        note_cache(outcome)
+        observe_cache(endpoint, outcome)
+
+
+def get_refresh_executor():
+    """
+    Return the thread pool that background refreshes run on, creating it on
+    first use. It is separate from the pool of the requests' upstream calls.
+
+    :rtype: concurrent.futures.ThreadPoolExecutor
+    """
+    global _REFRESH_EXECUTOR  # pylint: disable=global-statement
+    with _REFRESH_EXECUTOR_LOCK:
+        if _REFRESH_EXECUTOR is None:
+            _REFRESH_EXECUTOR = ThreadPoolExecutor(
+                max_workers=app.config.get('CACHE_REFRESH_WORKERS', 2),
+                thread_name_prefix='ngwmn-refresh'
+            )
+    return _REFRESH_EXECUTOR
+
+
+def _refresh_in_background(key, load):
+    # Refreshes beyond CACHE_REFRESH_MAX_PENDING are dropped; the entry is served stale until a later lookup
+    # finds room for its refresh
+    with _REFRESHING_LOCK:
+        if key in _REFRESHING or len(_REFRESHING) >= app.config.get('CACHE_REFRESH_MAX_PENDING', 32):
+            return
+        _REFRESHING.add(key)
+
+    def refresh():
+        token = _BYPASS.set(True)
+        try:
+            load()
+        except Exception:  # pylint: disable=broad-except
+            app.logger.warning('Background refresh of %s failed', key, exc_info=True)
+        finally:
+            _BYPASS.reset(token)
+            with _REFRESHING_LOCK:
+                _REFRESHING.discard(key)
+
+    get_refresh_executor().submit(refresh)
+
+
+def _negative_ttl(ttl):
+    negative_ttl = app.config.get('CACHE_NEGATIVE_TTL')
+    return min(ttl, negative_ttl) if negative_ttl else None
+
+
+def _is_cacheable_error(err):
+    # Calls refused by a circuit breaker or bulkhead, and calls cut short by the deadline of the request being
+    # handled, say nothing about how upstream would answer the next request
+    if err.status_code < 500 or isinstance(err, UpstreamUnavailable):
+        return False
+    left = remaining(current_deadline())
+    return left is None or left > 0
+
+
+def _load_or_fail(cache, key, load):
+    # Load a missing entry, storing the failure for CACHE_ERROR_TTL if upstream failed
+    try:
+        return _load(load)
+    except ServiceException as err:
+        error_ttl = app.config.get('CACHE_ERROR_TTL')
+        if error_ttl and _is_cacheable_error(err):
+            cache.set(key, CachedError(err.message, err.status_code), error_ttl)
+        raise
+
+
+def _get_or_revalidate(endpoint, cache, key, ttl, stale_ttl, load):  # pylint: disable=too-many-arguments
+    def store(value, storable):
+        if not storable:
+            return
+        if value:
+            cache.set(key, {'value': value, 'fresh_until': time.time() + ttl}, ttl + stale_ttl)
+            return
+        # Empty results are not served stale, so that data appearing upstream is shown as soon as they expire
+        negative_ttl = _negative_ttl(ttl)
+        if negative_ttl:
+            cache.set(key, {'value': value, 'fresh_until': time.time() + negative_ttl}, negative_ttl)
+
+    def load_and_store():
+        value, storable = _load(load)
+        store(value, storable)
+        return value
+
+    entry = MISSING if _BYPASS.get() else cache.get(key)
+    if isinstance(entry, CachedError):
+        _note_lookup(endpoint, 'error')
+        entry.raise_again()
+    if entry is MISSING:
+        _note_lookup(endpoint, 'miss')
+        value, storable = _load_or_fail(cache, key, load)
+        store(value, storable)
+        return value
+
+    is_hot = _TRACKER.hit(key) >= app.config.get('CACHE_HOT_THRESHOLD', 1)
+    fresh_for = entry['fresh_until'] - time.time()
+    if not entry['value']:
+        _note_lookup(endpoint, 'negative')
+    else:
+        _note_lookup(endpoint, 'hit' if fresh_for > 0 else 'stale')
+    if fresh_for <= 0 or (is_hot and fresh_for <= ttl * app.config.get('CACHE_REFRESH_AHEAD', 0)):
+        _refresh_in_background(key, load_and_store)
+    return entry['value']
+
+
+def cached(endpoint):
+    """
+    Decorator caching the result of a service function for the TTL configured
+    for `endpoint` in CACHE_TTL. Empty results (None, empty lists, etc.) are
+    cached for CACHE_NEGATIVE_TTL instead, if it is shorter, or not at all if it
+    is not set. A ServiceException with a 5xx status is cached for
+    CACHE_ERROR_TTL and raised again by the calls made meanwhile, unless it was
+    raised by a circuit breaker or bulkhead or once the deadline of the request
+    being handled had passed. Other exceptions, and results that called
+    `skip_store`, are not cached. Calls pass straight through if caching is
+    disabled or the endpoint has no TTL.
+
+    If the endpoint also has a CACHE_STALE_TTL, expired results are served for
+    that much longer while they are refreshed in the background, and results
+    accessed at least CACHE_HOT_THRESHOLD times within CACHE_HOT_WINDOW are
+    refreshed once they are within the final CACHE_REFRESH_AHEAD fraction of
+    their TTL.
+
+    :param str endpoint: name of the upstream endpoint
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            cache = get_cache()
+            ttl = app.config.get('CACHE_TTL', {}).get(endpoint)
+            if cache is None or not ttl:
+                return func(*args, **kwargs)
+
+            key = cache_key(endpoint, *args, **kwargs)
+            stale_ttl = app.config.get('CACHE_STALE_TTL', {}).get(endpoint)
+            if stale_ttl:
+                return _get_or_revalidate(endpoint, cache, key, ttl, stale_ttl, lambda: func(*args, **kwargs))
+
+            if not _BYPASS.get():
+                value = cache.get(key)
+                if isinstance(value, CachedError):
+                    _note_lookup(endpoint, 'error')
+                    value.raise_again()
+                if value is not MISSING:
+                    _note_lookup(endpoint, 'hit' if value else 'negative')
+                    return value
+
+            _note_lookup(endpoint, 'miss')
+            value, storable = _load_or_fail(cache, key, lambda: func(*args, **kwargs))
+            if storable:
+                if value:
+                    cache.set(key, value, ttl)
+                elif _negative_ttl(ttl):
+                    cache.set(key, value, _negative_ttl(ttl))
+            return value
+        return wrapper
+    return decorator
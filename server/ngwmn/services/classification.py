@@ -0,0 +1,294 @@
+"""
+Memoized lithology classification of well-log interval descriptions.
+
+The same descriptions repeat across thousands of wells, so the colors and
+materials of each distinct description are remembered in a bounded in-process
+LRU, backed by an optional on-disk SQLite store that is shared by the
+processes on a host and survives restarts.
+
+Classification is CPU-bound Python that holds the GIL, so it can optionally be
+run on a pool of worker processes instead of in the request thread.
+"""
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import json
+import re
+import threading
+import time
+
+from ngwmn import app
+from ngwmn.services.cache import MISSING, MemoryCache, SQLiteCache, skip_store
+from ngwmn.services.lithology_index import get_index
+from ngwmn.services.lithology_parser import CLASSIFIER_VERSION, get_colors, parse_descriptions
+from ngwmn.services.metrics import observe_lithology
+from ngwmn.services.tracing import current_span, span
+
+
+class ClassificationMemo:
+    """
+    Classifications keyed on a description's normalized word tuple, held in an
+    LRU of `max_entries` and, if `path` is given, in a SQLite store of up to
+    `store_max_entries`, as JSON. Values are shared, so callers must treat them
+    as read-only.
+    """
+
+    def __init__(self, max_entries=10000, path=None, store_max_entries=100000):
+        self._memory = MemoryCache(max_entries=max_entries)
+        self._store = SQLiteCache(path, max_entries=store_max_entries, serializer=json) if path else None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _store_key(key):
+        # Words never contain spaces, so joining them is unambiguous. The version
+        # keeps stored results of an older classifier from being used.
+        return 'v{0}:{1}'.format(CLASSIFIER_VERSION, ' '.join(key))
+
+    def get(self, key):
+        """
+        Return the classification stored for key, or MISSING.
+
+        :param tuple key: normalized words of the description
+        """
+        value = self._memory.get(key)
+        if value is MISSING and self._store is not None:
+            value = self._store.get(self._store_key(key))
+            if value is not MISSING:
+                self._memory.set(key, value)
+        with self._lock:
+            if value is MISSING:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value, persist=True):
+        """
+        Store the classification of a description.
+
+        :param tuple key: normalized words of the description
+        :param dict value: the description's colors and materials
+        :param bool persist: whether to store it on disk as well as in memory
+        """
+        self._memory.set(key, value)
+        if persist and self._store is not None:
+            self._store.set(self._store_key(key), value)
+
+    def stats(self):
+        """
+        Lookup counts since the memo was created.
+
+        :rtype: dict
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+    def clear(self):
+        """
+        Remove every classification, including those in the on-disk store, and reset the counts.
+        """
+        self._memory.clear()
+        if self._store is not None:
+            self._store.clear()
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+
+_MEMO = None
+_MEMO_LOCK = threading.Lock()
+
+
+def get_memo():
+    """
+    Return the classification memo configured by the LITHOLOGY_MEMO_* settings,
+    creating it on first use.
+
+    :rtype: ClassificationMemo
+    """
+    global _MEMO  # pylint: disable=global-statement
+    with _MEMO_LOCK:
+        if _MEMO is None:
+            _MEMO = ClassificationMemo(
+                max_entries=app.config.get('LITHOLOGY_MEMO_MAX_ENTRIES', 10000),
+                path=app.config.get('LITHOLOGY_MEMO_PATH'),
+                store_max_entries=app.config.get('LITHOLOGY_MEMO_STORE_MAX_ENTRIES', 100000)
+            )
+    return _MEMO
+
+
+def reset_memo():
+    """
+    Discard the current memo so that the next use recreates it from the
+    application configuration. Its on-disk store, if any, is kept.
+    """
+    global _MEMO  # pylint: disable=global-statement
+    with _MEMO_LOCK:
+        _MEMO = None
+
+
+_POOL = None
+_POOL_SLOTS = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_pool():
+    """
+    Return the pool of classifying processes and the semaphore bounding the
+    batches pending on it, creating them on first use.
+
+    :return: pool and semaphore
+    :rtype: tuple
+    """
+    global _POOL, _POOL_SLOTS  # pylint: disable=global-statement
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ProcessPoolExecutor(max_workers=app.config.get('LITHOLOGY_PROCESSES', 2))
+            _POOL_SLOTS = threading.BoundedSemaphore(app.config.get('LITHOLOGY_MAX_PENDING', 4))
+        return _POOL, _POOL_SLOTS
+
+
+def shutdown_pool():
+    """
+    Shut down the pool of classifying processes, if any. A new pool is created on next use.
+    """
+    global _POOL, _POOL_SLOTS  # pylint: disable=global-statement
+    with _POOL_LOCK:
+        pool, _POOL, _POOL_SLOTS = _POOL, None, None
+    if pool is not None:
+        pool.shutdown(wait=False)
+
+
+def _parse_in_pool(memo, keys):
+    """
+    Parse descriptions on the process pool, waiting up to LITHOLOGY_TIMEOUT
+    seconds. Results that arrive after the timeout are still memoized.
+
+    If the pool cannot take the batch, because it is broken or was just shut
+    down, the descriptions are parsed in this process instead.
+
+    :return: the parsed descriptions, or None if the pool is saturated or too slow
+    """
+    pool, slots = get_pool()
+    if not slots.acquire(blocking=False):
+        app.logger.warning('Lithology classification pool is saturated; skipped %s descriptions', len(keys))
+        return None
+
+    def done(future):
+        slots.release()
+        if not future.cancelled() and future.exception() is None:
+            for key, value in zip(keys, future.result()):
+                memo.set(key, value)
+
+    try:
+        future = pool.submit(parse_descriptions, keys)
+    except (BrokenProcessPool, RuntimeError) as err:
+        slots.release()
+        app.logger.error('Lithology classification pool rejected %s descriptions (%s); parsing them in process',
+                         len(keys), err)
+        if isinstance(err, BrokenProcessPool):
+            shutdown_pool()
+        parsed = parse_descriptions(keys)
+        for key, value in zip(keys, parsed):
+            memo.set(key, value)
+        return parsed
+
+    future.add_done_callback(done)
+    try:
+        return future.result(timeout=app.config.get('LITHOLOGY_TIMEOUT'))
+    except FutureTimeoutError:
+        app.logger.warning('Timed out classifying %s descriptions', len(keys))
+    except BrokenProcessPool:
+        app.logger.error('Lithology classification pool is broken; it will be recreated', exc_info=True)
+        shutdown_pool()
+    return None
+
+
+def description_words(description):
+    """
+    Split an interval description into lower-cased words.
+
+    :param description: the description's text, or None
+    :rtype: list
+    """
+    return re.findall(r'\w+', (description or '').lower())
+
+
+def normalize(words):
+    """
+    Memo key for a description.
+
+    :param list words: words of the description
+    :rtype: tuple
+    """
+    return tuple(word.lower() for word in words)
+
+
+def _record(sources, seconds=None, mode='inline'):
+    # Record the classification in the lithology metrics and in the classification span, if traced
+    observe_lithology(sources, seconds, mode)
+    classification_span = current_span()
+    if classification_span is not None:
+        for source, count in sources.items():
+            classification_span.set_attribute('ngwmn.lithology.{0}'.format(source), count)
+        classification_span.set_attribute('ngwmn.lithology.mode', mode)
+
+
+def classify_descriptions(descriptions):
+    """
+    Returns the colors and lithology classifications of several descriptions.
+    Each is looked up in the memo, then in the precomputed index, if any;
+    descriptions found in neither are parsed in one batch, on the process
+    pool if LITHOLOGY_PROCESS_POOL is set. If the pool is saturated or does not
+    respond within LITHOLOGY_TIMEOUT, those descriptions get no materials.
+
+    :param list descriptions: list of arrays of words, each describing a material
+    :return: list of dicts with the 'colors' and 'materials' of each description
+    :rtype: list
+    """
+    with span('classify_descriptions', **{'ngwmn.lithology.descriptions': len(descriptions)}):
+        return _classify_descriptions(descriptions)
+
+
+def _classify_descriptions(descriptions):
+    memo = get_memo()
+    index = get_index()
+    keys = [normalize(words) for words in descriptions]
+    found = {}
+    sources = {'memo': 0, 'index': 0}
+    for key in keys:
+        if key in found:
+            continue
+        found[key] = memo.get(key)
+        if found[key] is not MISSING:
+            sources['memo'] += 1
+        elif index is not None:
+            found[key] = index.get(key)
+            if found[key] is not MISSING:
+                sources['index'] += 1
+                memo.set(key, found[key], persist=False)
+
+    missing = [key for key, value in found.items() if value is MISSING]
+    if not missing:
+        _record(sources)
+        return [found[key] for key in keys]
+
+    start = time.perf_counter()
+    if not app.config.get('LITHOLOGY_PROCESS_POOL'):
+        for key, value in zip(missing, parse_descriptions(missing)):
+            found[key] = value
+            memo.set(key, value)
+        _record({**sources, 'parsed': len(missing)}, time.perf_counter() - start)
+        return [found[key] for key in keys]
+
+    parsed = _parse_in_pool(memo, missing)
+    if parsed is None:
+        # Leave out the materials, and keep the incomplete result from being cached
+        skip_store()
+        parsed = [{'colors': get_colors(key), 'materials': []} for key in missing]
+        _record({**sources, 'skipped': len(missing)})
+    else:
+        _record({**sources, 'parsed': len(missing)}, time.perf_counter() - start, mode='pool')
+    found.update(zip(missing, parsed))
+    return [found[key] for key in keys]
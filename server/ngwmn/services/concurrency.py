@@ -0,0 +1,166 @@
+"""
+Helpers for dispatching independent service calls concurrently.
+"""
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import contextlib
+import contextvars
+import threading
+import time
+
+from ngwmn import app
+from ngwmn.services import ServiceException
+from ngwmn.services.metrics import observe_unavailable
+from ngwmn.services.profiling import run_profiled
+
+_EXECUTOR = None
+_EXECUTOR_LOCK = threading.Lock()
+# Deadline by which the service calls made in the current context must be answered
+_DEADLINE = contextvars.ContextVar('concurrency_deadline', default=None)
+
+
+def get_executor():
+    """
+    Return the shared thread pool used for upstream service calls, creating it
+    on first use.
+
+    :rtype: concurrent.futures.ThreadPoolExecutor
+    """
+    global _EXECUTOR  # pylint: disable=global-statement
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None:
+            _EXECUTOR = ThreadPoolExecutor(
+                max_workers=app.config.get('UPSTREAM_MAX_WORKERS', 16),
+                thread_name_prefix='ngwmn-upstream'
+            )
+    return _EXECUTOR
+
+
+def submit(func, *args, **kwargs):
+    """
+    Schedule a call on the shared thread pool. The call runs in a copy of the
+    caller's context, so that context variables such as the request's timings
+    carry over, and is profiled along with the caller if it is being profiled.
+    When CONCURRENT_FETCH is disabled, the call is made immediately in the
+    calling thread and an already-completed future is returned, so callers
+    need only one code path.
+
+    :param func: the callable to run
+    :return: future holding the result of the call
+    :rtype: concurrent.futures.Future
+    """
+    if app.config.get('CONCURRENT_FETCH'):
+        return get_executor().submit(contextvars.copy_context().run, run_profiled, func, *args, **kwargs)
+
+    future = Future()
+    try:
+        future.set_result(func(*args, **kwargs))
+    except Exception as err:  # pylint: disable=broad-except
+        future.set_exception(err)
+    return future
+
+
+def completed(value):
+    """
+    Return an already-completed future holding value, for calls that are skipped.
+
+    :rtype: concurrent.futures.Future
+    """
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+def deadline(timeout):
+    """
+    Convert a timeout in seconds into an absolute deadline.
+
+    :param float timeout: seconds from now, or None for no deadline
+    :return: deadline on the time.monotonic() clock, or None
+    """
+    if timeout is None:
+        return None
+    return time.monotonic() + timeout
+
+
+def earliest(*deadlines):
+    """
+    The earliest of several deadlines, ignoring those that are None.
+
+    :return: deadline on the time.monotonic() clock, or None if there are none
+    """
+    deadlines = [until for until in deadlines if until is not None]
+    return min(deadlines) if deadlines else None
+
+
+@contextlib.contextmanager
+def bounded_by(until):
+    """
+    Context manager bounding the HTTP timeouts of the service calls made
+    within it, and of those it submits to the thread pool, by a deadline.
+
+    :param until: deadline returned by `deadline`, or None
+    """
+    token = _DEADLINE.set(until)
+    try:
+        yield
+    finally:
+        _DEADLINE.reset(token)
+
+
+def current_deadline():
+    """
+    The deadline set by the innermost `bounded_by` in the current context.
+
+    :return: deadline on the time.monotonic() clock, or None
+    """
+    return _DEADLINE.get()
+
+
+def remaining(until):
+    """
+    Seconds left before a deadline, never less than zero.
+
+    :param until: deadline returned by `deadline`, or None
+    :return: seconds remaining, or None if there is no deadline
+    """
+    if until is None:
+        return None
+    return max(0, until - time.monotonic())
+
+
+def result(future, until=None):
+    """
+    Wait for a future's result, giving up at the deadline.
+
+    :param concurrent.futures.Future future: the pending call
+    :param until: deadline returned by `deadline`, or None to wait indefinitely
+    :return: the call's result; exceptions raised by the call are re-raised
+    :raises ServiceException: if the deadline passes before the call completes
+    """
+    try:
+        return future.result(timeout=remaining(until))
+    except FutureTimeoutError as err:
+        app.logger.error('Timed out waiting for backing service call')
+        raise ServiceException(message='timed out waiting for backing service', status_code=504) from err
+
+
+def partial_result(future, until, section):
+    """
+    Wait for the result of an optional section of a page, giving up at the
+    deadline. A call that is given up on keeps running, so that its result
+    is still cached for later requests.
+
+    :param concurrent.futures.Future future: the pending call
+    :param until: deadline returned by `deadline`, or None to wait indefinitely
+    :param str section: name of the section, for the logs and metrics
+    :return: the call's result, or None if it was not ready by the deadline or failed with a ServiceException
+    """
+    try:
+        return future.result(timeout=remaining(until))
+    except FutureTimeoutError:
+        app.logger.warning('Leaving out %s, which was not ready in time', section)
+        observe_unavailable(section, 'late')
+    except ServiceException as err:
+        app.logger.warning('Leaving out %s (reason: %s)', section, err.message)
+        observe_unavailable(section, 'error')
+    return None
@@ -2,11 +2,16 @@
 Functions for accessing information from a confluence RSS feed
 """
 
-import requests
-
 from ngwmn import app
+from ngwmn.services import http_client
+from ngwmn.services.cache import cached, skip_store
+from ngwmn.services.singleflight import coalesce
+from ngwmn.services.timing import timed
 
 
+@timed('confluence')
+@coalesce('confluence')
+@cached('confluence')
 def pull_feed(url):
     """
     pull page data from a my.usgs.gov MD dynamic content pages
@@ -15,9 +20,11 @@ def pull_feed(url):
     """
     app.logger.debug('Parsing content from %s.', url)
     try:
-        response = requests.get(url)
+        response = http_client.get(url)
         text = response.text
     except:
+        # A failed fetch is not cached as an empty page
+        skip_store()
         text = ''
 
     # TODO individual error handling and logging
@@ -0,0 +1,188 @@
+"""
+Shared HTTP client for calls to upstream services.
+
+Each upstream host gets one keep-alive requests.Session with its own
+connection pool, so repeated calls to the same host reuse TCP and TLS
+connections instead of opening new ones, and its own circuit breaker and
+bulkhead (see ngwmn/services/resilience.py). Calls that fail to get a
+response raise ServiceException.
+
+Calls made within the deadline of the request being handled are not retried,
+since the retries and their backoff would outlast it; each host has a second
+session without retries for them.
+"""
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError, ReadTimeoutError
+from urllib3.util.retry import Retry
+
+from ngwmn import app
+from ngwmn.services import ServiceException
+from ngwmn.services.concurrency import current_deadline, remaining
+from ngwmn.services.resilience import Guard
+from ngwmn.services.timing import note_response
+
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+_GUARDS = {}
+_GUARDS_LOCK = threading.Lock()
+
+
+def _host_key(url):
+    parts = urlsplit(url)
+    return '{0}://{1}'.format(parts.scheme, parts.netloc)
+
+
+def _create_session(retries=True):
+    retry = Retry(
+        total=app.config.get('HTTP_RETRIES', 0) if retries else 0,
+        backoff_factor=app.config.get('HTTP_RETRY_BACKOFF', 0),
+        status_forcelist=app.config.get('HTTP_RETRY_STATUSES', ()),
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(
+        pool_connections=app.config.get('HTTP_POOL_CONNECTIONS', 1),
+        pool_maxsize=app.config.get('HTTP_POOL_MAXSIZE', 10),
+        max_retries=retry
+    )
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_session(url, retries=True):
+    """
+    Return the pooled session for the host serving the given URL.
+
+    :param str url: absolute URL of the upstream resource
+    :param bool retries: whether the session retries failed calls as configured by HTTP_RETRIES
+    :rtype: requests.Session
+    """
+    key = (_host_key(url), retries)
+    with _SESSIONS_LOCK:
+        session = _SESSIONS.get(key)
+        if session is None:
+            session = _SESSIONS[key] = _create_session(retries)
+    return session
+
+
+def close_sessions():
+    """
+    Close and forget every pooled session. New sessions are created on next use.
+    """
+    with _SESSIONS_LOCK:
+        for session in _SESSIONS.values():
+            session.close()
+        _SESSIONS.clear()
+
+
+def get_guard(url):
+    """
+    Return the circuit breaker and bulkhead of the host serving the given URL.
+
+    :param str url: absolute URL of the upstream resource
+    :rtype: ngwmn.services.resilience.Guard
+    """
+    key = _host_key(url)
+    with _GUARDS_LOCK:
+        guard = _GUARDS.get(key)
+        if guard is None:
+            guard = _GUARDS[key] = Guard(key)
+    return guard
+
+
+def reset_guards():
+    """
+    Forget the state of every host's circuit breaker and bulkhead. New ones are created on next use.
+    """
+    with _GUARDS_LOCK:
+        _GUARDS.clear()
+
+
+def _timeout():
+    # The configured timeouts, shortened to the time left before the deadline, and whether they were shortened
+    timeout = (app.config.get('HTTP_CONNECT_TIMEOUT'), app.config.get('HTTP_READ_TIMEOUT'))
+    left = remaining(current_deadline())
+    if left is None:
+        return timeout, False
+    if left <= 0:
+        raise ServiceException(message='timed out waiting for backing service', status_code=504)
+    shortened = tuple(left if value is None else min(value, left) for value in timeout)
+    return shortened, shortened != timeout
+
+
+def _timed_out(err):
+    # Timeouts that were retried until the retries ran out are raised as a ConnectionError wrapping a MaxRetryError
+    if isinstance(err, requests.exceptions.Timeout):
+        return True
+    reason = err.args[0] if isinstance(err, requests.exceptions.ConnectionError) and err.args else None
+    return isinstance(reason, MaxRetryError) and isinstance(reason.reason, ReadTimeoutError)
+
+
+def request(method, url, **kwargs):
+    """
+    Make an HTTP request through the pooled session for the URL's host. The
+    configured connect and read timeouts apply unless `timeout` is given,
+    shortened to the time left before the deadline of the request being
+    handled, if any (see concurrency.bounded_by). The response's status and
+    size are recorded in the timed service call in progress. Calls made
+    within a deadline are not retried, and timeouts that are due to the
+    deadline do not count as failures of the host.
+
+    A streamed response gives back its bulkhead slot once its headers have
+    been received; reading its body is bounded by the read timeout only.
+
+    :param str method: HTTP method
+    :param str url: absolute URL of the upstream resource
+    :return: the upstream response
+    :rtype: requests.Response
+    :raises ServiceException: if the host's circuit breaker is open or its bulkhead is full (503), the call timed
+        out or the deadline has passed (504), or the call failed to connect (503)
+    """
+    shortened = False
+    if 'timeout' not in kwargs:
+        kwargs['timeout'], shortened = _timeout()
+    guard = get_guard(url)
+    guard.enter()
+    success = None
+    try:
+        response = get_session(url, retries=current_deadline() is None).request(method, url, **kwargs)
+        success = guard.succeeded(response)
+    except requests.exceptions.RequestException as err:
+        timed_out = _timed_out(err)
+        # A host that only failed to answer within what was left of the deadline may well be healthy
+        success = None if timed_out and shortened else False
+        app.logger.error('%s request to %s failed (reason: %s)', method, url, str(err))
+        if timed_out:
+            raise ServiceException(message='timed out waiting for backing service', status_code=504) from err
+        raise ServiceException() from err
+    finally:
+        guard.exit(success)
+    note_response(response, streamed=kwargs.get('stream', False))
+    return response
+
+
+def get(url, params=None, **kwargs):
+    """
+    Make a GET request through the pooled session for the URL's host.
+
+    :param str url: absolute URL of the upstream resource
+    :param dict params: query string parameters
+    :rtype: requests.Response
+    """
+    return request('GET', url, params=params, **kwargs)
+
+
+def post(url, data=None, **kwargs):
+    """
+    Make a POST request through the pooled session for the URL's host.
+
+    :param str url: absolute URL of the upstream resource
+    :param data: request body
+    :rtype: requests.Response
+    """
+    return request('POST', url, data=data, **kwargs)
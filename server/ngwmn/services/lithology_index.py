@@ -0,0 +1,210 @@
+"""
+Precomputed lithology classification index.
+
+The index is a read-only SQLite file mapping every distinct well-log interval
+description of one or more providers to its colors and materials. It is built
+offline by `build_lithology_index.py`, which crawls the providers' well logs
+and classifies their descriptions in parallel processes, so that requests do
+not pay for fuzzy matching on descriptions that are already known.
+"""
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import json
+import os
+import sqlite3
+import threading
+
+from ngwmn import app
+from ngwmn.services.cache import MISSING
+from ngwmn.services.lithology_parser import CLASSIFIER_VERSION, parse_descriptions
+
+# Descriptions classified per task sent to a worker process
+CHUNK_SIZE = 500
+
+_DESCRIPTIONS_PATH = ('.//gwml:WaterWell/gwml:logElement/gsml:MappedInterval/gsml:specification'
+                      '/gwml:HydrostratigraphicUnit/gml:description')
+
+
+class LithologyIndex:
+    """
+    Read-only view of an index file. An index built by a different classifier
+    version than the running one is treated as empty.
+    """
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        row = self._connection().execute("SELECT value FROM meta WHERE name = 'classifier_version'").fetchone()
+        self.current = row is not None and row[0] == str(CLASSIFIER_VERSION)
+        if not self.current:
+            app.logger.warning('Ignoring lithology index %s built by another classifier version', path)
+
+    def _connection(self):
+        # sqlite3 connections may not be shared between threads, so keep one per thread
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect('file:{0}?mode=ro'.format(self.path), uri=True)
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        """
+        Return the classification of a description, or MISSING if it is not in the index.
+
+        :param tuple key: normalized words of the description
+        """
+        if not self.current:
+            return MISSING
+        row = self._connection().execute(
+            'SELECT colors, materials FROM classification WHERE words = ?', (' '.join(key),)
+        ).fetchone()
+        if row is None:
+            return MISSING
+        return {'colors': json.loads(row[0]), 'materials': json.loads(row[1])}
+
+
+_INDEX = None
+_INDEX_LOADED = False
+_INDEX_LOCK = threading.Lock()
+
+
+def get_index():
+    """
+    Return the index at LITHOLOGY_INDEX_PATH, opening it on first use.
+
+    :return: the index, or None if none is configured or the file does not exist
+    """
+    global _INDEX, _INDEX_LOADED  # pylint: disable=global-statement
+    with _INDEX_LOCK:
+        if not _INDEX_LOADED:
+            path = app.config.get('LITHOLOGY_INDEX_PATH')
+            if path and os.path.exists(path):
+                _INDEX = LithologyIndex(path)
+            elif path:
+                app.logger.warning('Lithology index %s does not exist', path)
+            _INDEX_LOADED = True
+    return _INDEX
+
+
+def reset_index():
+    """
+    Close the current index so that the next use reopens it, e.g. after it has been rebuilt.
+    """
+    global _INDEX, _INDEX_LOADED  # pylint: disable=global-statement
+    with _INDEX_LOCK:
+        _INDEX = None
+        _INDEX_LOADED = False
+
+
+def well_log_descriptions(agency_cd, site_no):
+    """
+    Words of every interval description in a site's well log, as get_well_log splits them.
+
+    :param str agency_cd: agency code for the agency that manages the location
+    :param str site_no: the location's identifier
+    :rtype: list
+    """
+    # Imported here because get_well_log itself consults this module's index
+    # pylint: disable=import-outside-toplevel
+    from ngwmn.services.classification import description_words
+    from ngwmn.services.ngwmn import WELL_LOG_NAMESPACES, get_iddata
+
+    xml = get_iddata('well_log', agency_cd, site_no)
+    if xml is None:
+        return []
+    namespaces = {prefix: xml.nsmap.get(prefix, uri) for prefix, uri in WELL_LOG_NAMESPACES.items()}
+    return [description_words(node.text if node.text != 'unknown' else None)
+            for node in xml.findall(_DESCRIPTIONS_PATH, namespaces)]
+
+
+def collect_descriptions(agency_cds, threads=8):
+    """
+    Crawl the well logs of every site of the given providers.
+
+    :param list agency_cds: agency codes of the providers
+    :param int threads: number of well logs fetched at a time
+    :return: distinct normalized descriptions
+    :rtype: set
+    """
+    from ngwmn.services.ngwmn import get_sites  # pylint: disable=import-outside-toplevel
+
+    sites = [(agency_cd, site['site_no']) for agency_cd in agency_cds for site in get_sites(agency_cd)]
+    app.logger.info('Collecting well log descriptions of %s sites', len(sites))
+
+    def fetch(site):
+        try:
+            return well_log_descriptions(*site)
+        except Exception:  # pylint: disable=broad-except
+            app.logger.warning('Could not fetch the well log of %s %s', *site, exc_info=True)
+            return []
+
+    descriptions = set()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for words_list in executor.map(fetch, sites):
+            descriptions.update(tuple(words) for words in words_list if words)
+    return descriptions
+
+
+def classify(descriptions, processes=None):
+    """
+    Classify descriptions in chunks on a pool of worker processes.
+
+    :param descriptions: normalized descriptions
+    :param processes: number of worker processes; None for one per CPU, 1 to classify in this process
+    :return: pairs of description and classification
+    :rtype: list
+    """
+    descriptions = sorted(descriptions)
+    chunks = [descriptions[start:start + CHUNK_SIZE] for start in range(0, len(descriptions), CHUNK_SIZE)]
+    if processes == 1:
+        results = map(parse_descriptions, chunks)
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = list(executor.map(parse_descriptions, chunks))
+    return [pair for chunk, parsed in zip(chunks, results) for pair in zip(chunk, parsed)]
+
+
+def write_index(path, classifications):
+    """
+    Write an index file. The file is replaced atomically, so running servers
+    never see a partly written index.
+
+    :param str path: path of the index file
+    :param classifications: pairs of normalized description and classification
+    """
+    temp_path = path + '.tmp'
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    connection = sqlite3.connect(temp_path)
+    try:
+        with connection:
+            connection.execute('CREATE TABLE meta (name TEXT PRIMARY KEY, value TEXT)')
+            connection.execute('CREATE TABLE classification '
+                               '(words TEXT PRIMARY KEY, colors TEXT, materials TEXT) WITHOUT ROWID')
+            connection.execute("INSERT INTO meta VALUES ('classifier_version', ?)", (str(CLASSIFIER_VERSION),))
+            connection.executemany('INSERT INTO classification VALUES (?, ?, ?)', (
+                (' '.join(key), json.dumps(value['colors']), json.dumps(value['materials']))
+                for key, value in classifications
+            ))
+        connection.execute('VACUUM')
+    finally:
+        connection.close()
+    os.replace(temp_path, path)
+
+
+def build_index(path, agency_cds, threads=8, processes=None):
+    """
+    Build an index of the well log descriptions of the given providers.
+
+    :param str path: path of the index file
+    :param list agency_cds: agency codes of the providers
+    :param int threads: number of well logs fetched at a time
+    :param processes: number of classifying processes, as for `classify`
+    :return: number of descriptions in the index
+    :rtype: int
+    """
+    descriptions = collect_descriptions(agency_cds, threads=threads)
+    app.logger.info('Classifying %s distinct descriptions', len(descriptions))
+    classifications = classify(descriptions, processes=processes)
+    write_index(path, classifications)
+    return len(classifications)
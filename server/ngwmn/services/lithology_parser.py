@@ -3,7 +3,12 @@ This module includes routines to parse unstructured lithology material strings
 and extract a structured list of lithology types and colors.
 """
 
-from fuzzywuzzy import process
+import bisect
+import re
+import threading
+
+from rapidfuzz import fuzz, process
+from rapidfuzz.distance import Indel, Levenshtein
 import webcolors
 
 
@@ -256,15 +261,177 @@ LITH_STRINGS = {
 COLORS = set(webcolors.CSS3_NAMES_TO_HEX.keys())
 
 
-def _compare_scores(score_a, score_b):
-    # a and b are of form: (option, score)
+# Changed whenever the classification of a description may change, so that stored results are not reused
+CLASSIFIER_VERSION = 4
+
+# Lithology strings in ranking order, as scored (see _process); equal scores rank the earlier string first
+_LITH_CHOICES = list(LITH_STRINGS)
+_NON_WORD = re.compile(r'(?ui)\W')
+
+# Number of best-scoring lithology strings considered, and of distinct classifications returned
+_MATCH_LIMIT = 10
+_MATERIAL_LIMIT = 5
+
+# rapidfuzz's WRatio, which takes the best partial alignment rather than a heuristic one, never
+# scores a pair more than this far below _weighted_ratio, so it bounds the exact score from above
+_BOUND_SLACK = 1
+
+
+def _process(value):
+    # Keep ASCII letters and digits only, lower-cased, as fuzzywuzzy's full_process(force_ascii=True) does
+    value = ''.join(char for char in value if ord(char) < 128)
+    return _NON_WORD.sub(' ', value).lower().strip()
+
+
+_PROCESSED_CHOICES = [_process(choice) for choice in _LITH_CHOICES]
+
+
+def _ratio(value_a, value_b):
+    if value_a == value_b:
+        return 100
+    if not value_a or not value_b:
+        return 0
+    return round(100 * Indel.normalized_similarity(value_a, value_b))
+
+
+def _partial_ratio(value_a, value_b):
+    if value_a == value_b:
+        return 100
+    if not value_a or not value_b:
+        return 0
+    shorter, longer = (value_a, value_b) if len(value_a) <= len(value_b) else (value_b, value_a)
+
+    # Compare the shorter string with the window of the longer one at each matching block
+    best = 0
+    for block in Levenshtein.opcodes(shorter, longer).as_matching_blocks():
+        start = max(block.b - block.a, 0)
+        similarity = Indel.normalized_similarity(shorter, longer[start:start + len(shorter)])
+        if similarity > .995:
+            return 100
+        best = max(best, similarity)
+    return round(100 * best)
 
-    # If the scores are the same, give preference to the option with a longer
-    # length - which should be more "specific".
-    if score_a[1] == score_b[1]:
-        return len(score_a[0]) - len(score_b[0])
 
-    return score_a[1] - score_b[1]
+def _sorted_tokens(value):
+    return ' '.join(sorted(value.split()))
+
+
+def _token_set_ratio(value_a, value_b, ratio):
+    tokens_a = set(value_a.split())
+    tokens_b = set(value_b.split())
+    intersection = ' '.join(sorted(tokens_a & tokens_b))
+    combined_a = (intersection + ' ' + ' '.join(sorted(tokens_a - tokens_b))).strip()
+    combined_b = (intersection + ' ' + ' '.join(sorted(tokens_b - tokens_a))).strip()
+    return max(ratio(intersection, combined_a), ratio(intersection, combined_b), ratio(combined_a, combined_b))
+
+
+def _weighted_ratio(value_a, value_b):
+    """
+    Similarity score of two processed strings, from 0 to 100. This is the
+    weighted ratio of fuzzywuzzy (with python-Levenshtein), which this module
+    used previously, reproduced exactly so that classifications are unchanged.
+    """
+    if not value_a or not value_b:
+        return 0
+
+    base = _ratio(value_a, value_b)
+    length_ratio = max(len(value_a), len(value_b)) / min(len(value_a), len(value_b))
+    if length_ratio < 1.5:
+        return round(max(
+            base,
+            _ratio(_sorted_tokens(value_a), _sorted_tokens(value_b)) * .95,
+            _token_set_ratio(value_a, value_b, _ratio) * .95
+        ))
+
+    partial_scale = .6 if length_ratio > 8 else .9
+    return round(max(
+        base,
+        _partial_ratio(value_a, value_b) * partial_scale,
+        _partial_ratio(_sorted_tokens(value_a), _sorted_tokens(value_b)) * .95 * partial_scale,
+        _token_set_ratio(value_a, value_b, _partial_ratio) * .95 * partial_scale
+    ))
+
+
+def _best_matches(query, bounds):
+    # Score candidates exactly in order of their upper bound, until no remaining
+    # bound can beat the worst of the best _MATCH_LIMIT exact scores
+    best = []
+    for index in sorted(range(len(bounds)), key=bounds.__getitem__, reverse=True):
+        if len(best) == _MATCH_LIMIT and -best[-1][0] > bounds[index] + _BOUND_SLACK:
+            break
+        bisect.insort(best, (-_weighted_ratio(query, _PROCESSED_CHOICES[index]), index))
+        del best[_MATCH_LIMIT:]
+    return [_LITH_CHOICES[index] for _, index in best]
+
+
+def _fuzzy_classify(queries):
+    # Score processed, non-empty descriptions against all lithology strings in one batch
+    bounds = process.cdist(queries, _PROCESSED_CHOICES, scorer=fuzz.WRatio, processor=None)
+    classifications = []
+    for query, row in zip(queries, bounds):
+        # Return the lithology IDs of the highest-ranked scores, without duplicates
+        materials = []
+        for match in _best_matches(query, row):
+            material = LITH_STRINGS[match]
+            if material not in materials:
+                materials.append(material)
+            if len(materials) == _MATERIAL_LIMIT:
+                break
+        classifications.append(materials)
+    return classifications
+
+
+# Fuzzy rankings of the descriptions that are exactly a lithology string, by processed string; built on first use
+_PHRASE_RANKINGS = None
+_PHRASE_RANKINGS_LOCK = threading.Lock()
+
+
+def _phrase_rankings():
+    global _PHRASE_RANKINGS  # pylint: disable=global-statement
+    with _PHRASE_RANKINGS_LOCK:
+        if _PHRASE_RANKINGS is None:
+            _PHRASE_RANKINGS = dict(zip(_PROCESSED_CHOICES, _fuzzy_classify(_PROCESSED_CHOICES)))
+        return _PHRASE_RANKINGS
+
+
+def parse_descriptions(descriptions):
+    """
+    Returns the colors and lithology classifications of several textual
+    descriptions. A description that is exactly a lithology string is looked
+    up in a table of precomputed rankings; the others are fuzzy matched
+    against the lithology strings, all in one batch, scoring repeated
+    descriptions once. Either way, the ranking is the same.
+
+    :param list descriptions: list of arrays of free-form words, each describing a material
+    :return: list of dicts with the 'colors' and 'materials' of each description
+    :rtype: list
+    """
+    rankings = _phrase_rankings()
+    parsed = []
+    # Results still to be fuzzy matched, by processed description
+    fuzzy = {}
+    for words in descriptions:
+        query = _process(' '.join(words))
+        parsed.append({'colors': _colors(query), 'materials': list(rankings.get(query, []))})
+        if query and query not in rankings:
+            fuzzy.setdefault(query, []).append(parsed[-1])
+
+    if fuzzy:
+        for results, materials in zip(fuzzy.values(), _fuzzy_classify(list(fuzzy))):
+            for result in results:
+                result['materials'] = list(materials)
+    return parsed
+
+
+def classify_materials(descriptions):
+    """
+    Returns the lithology classifications of several textual descriptions.
+
+    :param list descriptions: list of arrays of free-form words, each describing a material
+    :return: list of material classifications, one list per description
+    :rtype: list
+    """
+    return [parsed['materials'] for parsed in parse_descriptions(descriptions)]
 
 
 def classify_material(words):
@@ -275,31 +442,25 @@ def classify_material(words):
     :return: list of material classifications
     :rtype: list
     """
+    return classify_materials([words])[0]
 
-    if not words:
-        return []
-
-    material_string = ' '.join(words)
-    matches = process.extract(
-        material_string,
-        LITH_STRINGS.keys(),
-        limit=10
-    )
-
-    # Return the lithology IDs of the highest-ranked scores, without duplicates
-    materials = []
-    for match in matches:
-        material = LITH_STRINGS[match[0]]
-        if material not in materials:
-            materials.append(material)
-        if len(materials) == 5:
-            break
 
-    return materials
+def _colors(query):
+    # Distinct hex codes of the named web colors in a processed description, in order of occurrence
+    colors = []
+    for token in query.split():
+        color = webcolors.CSS3_NAMES_TO_HEX.get(token)
+        if color is not None and color not in colors:
+            colors.append(color)
+    return colors
 
 
 def get_colors(words):
-    return [
-        webcolors.CSS3_NAMES_TO_HEX[color]
-        for color in COLORS & set(words)
-    ]
+    """
+    Returns the hex codes of the named web colors in a textual description.
+
+    :param list words: array of free-form words describing a material
+    :return: distinct color hex codes, in order of occurrence
+    :rtype: list
+    """
+    return _colors(_process(' '.join(words)))
@@ -0,0 +1,205 @@
+"""
+Prometheus metrics of requests, service calls, caches and parsing.
+
+Under a multi-process server such as gunicorn, set the PROMETHEUS_MULTIPROC_DIR
+environment variable to an empty directory writable by every worker before
+the application starts. Each process then writes its metrics to files there,
+and /metrics aggregates the files of all processes. The directory must be
+emptied when the server restarts, and the server should call
+`mark_process_dead` as each worker exits, e.g. from gunicorn's `child_exit`
+hook:
+
+    def child_exit(server, worker):
+        from ngwmn.services.metrics import mark_process_dead
+        mark_process_dead(worker.pid)
+"""
+import os
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, \
+    multiprocess
+
+from ngwmn import app
+
+_DURATION_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+_SIZE_BUCKETS = tuple(1024 * 4 ** power for power in range(9))
+
+REQUEST_DURATION = Histogram(
+    'ngwmn_request_duration_seconds', 'Time to handle a request, by Flask endpoint', ['endpoint'],
+    buckets=_DURATION_BUCKETS)
+REQUESTS = Counter(
+    'ngwmn_requests', 'Requests handled, by Flask endpoint and status code', ['endpoint', 'status'])
+CALL_DURATION = Histogram(
+    'ngwmn_service_call_duration_seconds', 'Duration of service calls, including cache lookups', ['call'],
+    buckets=_DURATION_BUCKETS)
+CALL_ERRORS = Counter(
+    'ngwmn_service_call_errors', 'Service calls that raised an exception', ['call'])
+UPSTREAM_RESPONSES = Counter(
+    'ngwmn_upstream_responses', 'Upstream responses, by service call and status code', ['call', 'status'])
+CACHE_LOOKUPS = Counter(
+    'ngwmn_cache_lookups',
+    'Upstream response cache lookups, by endpoint and outcome (hit, miss, stale, negative or error)',
+    ['endpoint', 'outcome'])
+COALESCED_CALLS = Counter(
+    'ngwmn_coalesced_calls', 'Calls that waited for an identical call in flight instead of making their own',
+    ['endpoint'])
+LITHOLOGY_DESCRIPTIONS = Counter(
+    'ngwmn_lithology_descriptions', 'Well-log descriptions classified, by source of the classification '
+    '(memo, index, parsed or skipped)', ['source'])
+LITHOLOGY_DURATION = Histogram(
+    'ngwmn_lithology_classification_seconds', 'Time to parse the descriptions of a well log that were not memoized',
+    ['mode'], buckets=_DURATION_BUCKETS)
+UPSTREAM_REJECTIONS = Counter(
+    'ngwmn_upstream_rejections', 'Upstream calls failed without being made, by host and reason (circuit_open or '
+    'bulkhead_full)', ['host', 'reason'])
+CIRCUIT_TRANSITIONS = Counter(
+    'ngwmn_circuit_breaker_transitions', 'Upstream circuit breaker state changes, by host and new state',
+    ['host', 'state'])
+SECTIONS_UNAVAILABLE = Counter(
+    'ngwmn_page_sections_unavailable', 'Optional page sections left out, by section and reason (late or error)',
+    ['section', 'reason'])
+DOCUMENT_SIZE = Histogram(
+    'ngwmn_xml_document_bytes', 'Size of the XML documents received from the iddata service', ['request'],
+    buckets=_SIZE_BUCKETS)
+
+
+def _enabled():
+    return app.config.get('METRICS_ENABLED')
+
+
+def observe_request(endpoint, status, seconds):
+    """
+    Record a handled request.
+
+    :param str endpoint: Flask endpoint, or None if no route matched
+    :param int status: response status code
+    :param float seconds: time taken to handle the request
+    """
+    if _enabled():
+        endpoint = endpoint or 'unmatched'
+        REQUEST_DURATION.labels(endpoint).observe(seconds)
+        REQUESTS.labels(endpoint, str(status)).inc()
+
+
+def observe_call(call):
+    """
+    Record a finished service call.
+
+    :param ngwmn.services.timing.Call call: the call
+    """
+    if _enabled():
+        CALL_DURATION.labels(call.name).observe(call.duration)
+        if call.error is not None:
+            CALL_ERRORS.labels(call.name).inc()
+        if call.status is not None:
+            UPSTREAM_RESPONSES.labels(call.name, str(call.status)).inc()
+
+
+def observe_cache(endpoint, outcome):
+    """
+    Record the outcome of a cache lookup.
+
+    :param str endpoint: name of the cached endpoint
+    :param str outcome: 'hit', 'miss', 'stale', 'negative' or 'error'
+    """
+    if _enabled():
+        CACHE_LOOKUPS.labels(endpoint, outcome).inc()
+
+
+def observe_coalesced(endpoint):
+    """
+    Record a call that shared the result of an identical call in flight.
+
+    :param str endpoint: name of the coalesced endpoint
+    """
+    if _enabled():
+        COALESCED_CALLS.labels(endpoint).inc()
+
+
+def observe_lithology(sources, seconds=None, mode='inline'):
+    """
+    Record the classification of the descriptions of a well log.
+
+    :param dict sources: numbers of descriptions by where their classification came from
+    :param float seconds: time spent parsing descriptions, or None if none were parsed
+    :param str mode: 'inline' or 'pool'
+    """
+    if _enabled():
+        for source, count in sources.items():
+            if count:
+                LITHOLOGY_DESCRIPTIONS.labels(source).inc(count)
+        if seconds is not None:
+            LITHOLOGY_DURATION.labels(mode).observe(seconds)
+
+
+def observe_rejection(host, reason):
+    """
+    Record an upstream call failed without being made.
+
+    :param str host: the upstream host, e.g. 'https://cida.usgs.gov'
+    :param str reason: 'circuit_open' or 'bulkhead_full'
+    """
+    if _enabled():
+        UPSTREAM_REJECTIONS.labels(host, reason).inc()
+
+
+def observe_circuit(host, state):
+    """
+    Record a change of state of an upstream circuit breaker.
+
+    :param str host: the upstream host
+    :param str state: 'open', 'half_open' or 'closed'
+    """
+    if _enabled():
+        CIRCUIT_TRANSITIONS.labels(host, state).inc()
+
+
+def observe_unavailable(section, reason):
+    """
+    Record an optional page section left out.
+
+    :param str section: name of the section, e.g. 'statistics'
+    :param str reason: 'late' if it was not ready by the deadline, or 'error'
+    """
+    if _enabled():
+        SECTIONS_UNAVAILABLE.labels(section, reason).inc()
+
+
+def observe_document(request, size):
+    """
+    Record the size of an XML document received from the iddata service.
+
+    :param str request: the iddata request, e.g. 'well_log'
+    :param int size: bytes received
+    """
+    if _enabled():
+        DOCUMENT_SIZE.labels(request).observe(size)
+
+
+def _multiprocess_dir():
+    return os.environ.get('PROMETHEUS_MULTIPROC_DIR') or os.environ.get('prometheus_multiproc_dir')
+
+
+def exposition():
+    """
+    The current metrics in the Prometheus text format, aggregated over every
+    process if running in multi-process mode.
+
+    :return: the metrics, and their content type
+    :rtype: tuple
+    """
+    if _multiprocess_dir():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid):
+    """
+    Discard the live metrics of a process that has exited, in multi-process mode.
+
+    :param int pid: process id of the exited worker
+    """
+    if _multiprocess_dir():
+        multiprocess.mark_process_dead(pid)
@@ -6,16 +6,28 @@ import json
 import re
 from urllib.parse import urljoin
 
-import requests as r
+from lxml import etree
+import requests
+import urllib3
 
 from ngwmn import app
-from ngwmn.services import ServiceException
-from ngwmn.services.lithology_parser import classify_material, get_colors
-from ngwmn.xml_utils import parse_xml
+from ngwmn.services import ServiceException, http_client
+from ngwmn.services.cache import cached, mark_absent, skip_store
+from ngwmn.services.metrics import observe_document
+from ngwmn.services.classification import classify_descriptions, description_words
+from ngwmn.services.singleflight import coalesce
+from ngwmn.services.timing import timed
+from ngwmn.services.tracing import span
+from ngwmn.xml_utils import Attribute, Const, Each, ExtractionPlan, Group, Index, Text, parse_xml
 
 SERVICE_ROOT = app.config.get('SERVICE_ROOT')
 
+# Elements of a WQX document that the streaming water-quality parser stops at
+WQX_STREAMED_TAGS = ('{*}Organization', '{*}OrganizationDescription', '{*}Activity')
 
+
+@timed('iddata')
+@coalesce('iddata')
 def get_iddata(request, agency_cd, location_id, service_root=SERVICE_ROOT):
     """
     Make a NGWMN iddata service request.
@@ -28,37 +40,42 @@ def get_iddata(request, agency_cd, location_id, service_root=SERVICE_ROOT):
     :rtype: etree._Element or None
 
     """
+    content = _get_iddata_content(request, agency_cd, location_id, service_root)
+    if content is None:
+        return None
+    with span('parse_xml', **{'ngwmn.request': request, 'ngwmn.document_bytes': len(content)}):
+        return parse_xml(content)
 
-    resp = r.get(urljoin(service_root, 'ngwmn/iddata'), params={
+
+@cached('iddata')
+def _get_iddata_content(request, agency_cd, location_id, service_root):
+    resp = _iddata_response(request, agency_cd, location_id, service_root)
+    if resp is None:
+        return None
+    observe_document(request, len(resp.content))
+    return resp.content
+
+
+def _iddata_response(request, agency_cd, location_id, service_root, **kwargs):
+    resp = http_client.get(urljoin(service_root, 'ngwmn/iddata'), params={
         'request': request,
         'agency_cd': agency_cd,
         'siteNo': location_id
-    })
+    }, **kwargs)
 
     if resp.status_code == 404:
+        resp.close()
+        mark_absent('iddata', request, agency_cd, location_id, service_root)
         return None
 
     if resp.status_code != 200:
+        resp.close()
         msg = '%s error from %s (reason: %s)'
         app.logger.error(msg, resp.status_code, resp.url, resp.reason)
         raise ServiceException()
 
     app.logger.debug('Got %s response from %s', resp.status_code, resp.url)
-    return parse_xml(resp.content)
-
-
-def _find(parent, tag, default=None):
-    if parent is None:
-        return default
-
-    node = parent.find(tag, parent.nsmap)
-    if node is None:
-        return default
-
-    if not node.text or node.text == 'unknown':
-        return default
-
-    return node.text
+    return resp
 
 
 def _cast(to_type, value):
@@ -86,6 +103,96 @@ def _coordinates(value):
     }
 
 
+def _location(value):
+    if value is None:
+        return None
+    pos = re.split(' |,', value)
+    return {
+        'latitude': pos[0],
+        'longitude': pos[1]
+    }
+
+
+WQX_NAMESPACES = {'wqx': 'http://www.exchangenetwork.net/schema/wqx/2'}
+
+_WQX_METHOD = {
+    'identifier': Text('wqx:MethodIdentifier'),
+    'identifier_context': Text('wqx:MethodIdentifierContext'),
+    'name': Text('wqx:MethodName')
+}
+
+_WQX_TIME = {
+    'time': Text('wqx:Time'),
+    'time_zone_code': Text('wqx:TimeZoneCode')
+}
+
+_WQX_ORGANIZATION = {
+    'id': Text('wqx:OrganizationIdentifier'),
+    'name': Text('wqx:OrganizationFormalName')
+}
+
+_WQX_ACTIVITY = {
+    'description': Group('wqx:ActivityDescription', {
+        'identifier': Text('wqx:ActivityIdentifier'),
+        'type_code': Text('wqx:ActivityTypeCode'),
+        'media_name': Text('wqx:ActivityMediaName'),
+        'start_date': Text('wqx:ActivityStartDate'),
+        'start_time': Group('wqx:ActivityStartTime', _WQX_TIME),
+        'project_identifier': Text('wqx:ProjectIdentifier'),
+        'monitoring_location_identifier': Text('wqx:MonitoringLocationIdentifier'),
+        'comment_text': Text('wqx:ActivityCommentText')
+    }),
+    'sample_description': Group('wqx:SampleDescription', {
+        'collection_method': Group('wqx:SampleCollectionMethod', _WQX_METHOD),
+        'collection_equipment_name': Text('wqx:SampleCollectionEquipmentName')
+    }),
+    'results': Each('wqx:Result', {
+        'pcode': Text('wqx:USGSPcode'),
+        'provider_name': Text('wqx:ProviderName'),
+        'description': Group('wqx:ResultDescription', {
+            'detection_condition_text': Text('wqx:ResultDetectionConditionText'),
+            'characteristic_name': Text('wqx:CharacteristicName'),
+            'sample_fraction_text': Text('wqx:ResultSampleFractionText'),
+            'measure': Group('wqx:ResultMeasure', {
+                'value': Text('wqx:ResultMeasureValue'),
+                'unit_code': Text('wqx:MeasureUnitCode'),
+            }),
+            'value_type_name': Text('wqx:ResultValueTypeName'),
+            'temperature_basis_text': Text('wqx:ResultTemperatureBasisText'),
+            'comment_text': Text('wqx:ResultCommentText')
+        }),
+        'analytical_method': Group('wqx:ResultAnalyticalMethod', _WQX_METHOD),
+        'lab_information': Group('wqx:ResultLabInformation', {
+            'analysis_start_date': Text('wqx:AnalysisStartDate'),
+            'analysis_start_time': Group('wqx:AnalysisStartTime', _WQX_TIME),
+            'detection_quantitation_limit': Group('wqx:ResultDetectionQuantitationLimit', {
+                'type_name': Text('wqx:DetectionQuantitationLimitTypeName'),
+                'measure': Group('wqx:DetectionQuantitationLimitMeasure', {
+                    'value': Text('wqx:MeasureValue'),
+                    'unit_code': Text('wqx:MeasureUnitCode')
+                })
+            })
+        })
+    })
+}
+
+# Extraction plans for a WQX Organization element, and for the pieces of one met while streaming
+WATER_QUALITY_PLAN = ExtractionPlan(Group('.', {
+    'organization': Group('wqx:OrganizationDescription', _WQX_ORGANIZATION),
+    'activities': Each('wqx:Activity', _WQX_ACTIVITY)
+}), WQX_NAMESPACES)
+ORGANIZATION_PLAN = ExtractionPlan(Group('.', _WQX_ORGANIZATION), WQX_NAMESPACES)
+ACTIVITY_PLAN = ExtractionPlan(Group('.', _WQX_ACTIVITY), WQX_NAMESPACES)
+
+
+def _wqx_namespaces(elem):
+    # WQX documents put their elements in the default namespace, if any
+    return {'wqx': elem.nsmap.get(None) if elem is not None else None}
+
+
+@timed('water_quality')
+@coalesce('water_quality')
+@cached('water_quality')
 def get_water_quality(agency_cd, location_id):
     """
     Retrieves water-quality data from the NGWMN iddata service.
@@ -95,6 +202,9 @@ def get_water_quality(agency_cd, location_id):
     :return: array of activity dictionaries
     :rtype: array
     """
+    if app.config.get('WATER_QUALITY_STREAMING'):
+        return _stream_water_quality(agency_cd, location_id)
+
     xml = get_iddata('water_quality', agency_cd, location_id)
     if xml is None:
         return {}
@@ -103,72 +213,183 @@ def get_water_quality(agency_cd, location_id):
     if organization is None:
         return {}
 
+    return WATER_QUALITY_PLAN(organization, _wqx_namespaces(xml))
+
+
+def _discard(elem):
+    # Free a converted element, along with any already-converted siblings before it
+    elem.clear()
+    while elem.getprevious() is not None:
+        del elem.getparent()[0]
+
+
+def _interrupted_transfer(resp, parse_span, err):
+    # The error to raise when a streamed response stalls or breaks off partway through
+    app.logger.error('Water-quality response from %s was interrupted (reason: %s)', resp.url, str(err))
+    if parse_span is not None:
+        parse_span.error = type(err).__name__
+    skip_store()
+    if isinstance(err, (urllib3.exceptions.ReadTimeoutError, requests.exceptions.Timeout)):
+        return ServiceException(message='timed out waiting for backing service', status_code=504)
+    return ServiceException(message='backing service response was interrupted', status_code=502)
+
+
+def _close_transfer(resp, parse_span):
+    # Record the size of a streamed response, however much of it was read, and release its connection
+    observe_document('water_quality', resp.raw.tell())
+    if parse_span is not None:
+        parse_span.set_attribute('ngwmn.document_bytes', resp.raw.tell())
+    resp.close()
+
+
+def _stream_water_quality(agency_cd, location_id, service_root=SERVICE_ROOT):
+    """
+    Streaming counterpart of get_water_quality. The response is parsed as it is
+    read, and each Activity is discarded from the tree once it has been
+    converted, so memory use does not grow with the size of the document.
+    """
+    resp = _iddata_response('water_quality', agency_cd, location_id, service_root, stream=True)
+    if resp is None:
+        return {}
+
+    resp.raw.decode_content = True
+    organization_count = 0
+    organization = None
+    activities = []
+    with span('parse_xml', **{'ngwmn.request': 'water_quality', 'ngwmn.streamed': True}) as parse_span:
+        try:
+            for event, elem in etree.iterparse(resp.raw, events=('start', 'end'), resolve_entities=False,
+                                               no_network=True, tag=WQX_STREAMED_TAGS):
+                name = etree.QName(elem).localname
+                if name == 'Organization':
+                    if event == 'start':
+                        organization_count += 1
+                    continue
+                # Like get_water_quality, only the first Organization is used
+                if event == 'start' or organization_count != 1:
+                    continue
+
+                if name == 'OrganizationDescription':
+                    organization = ORGANIZATION_PLAN(elem, _wqx_namespaces(elem))
+                else:
+                    activities.append(ACTIVITY_PLAN(elem, _wqx_namespaces(elem)))
+                _discard(elem)
+        except etree.XMLSyntaxError as err:
+            app.logger.error('Invalid water-quality XML from %s (reason: %s)', resp.url, str(err))
+            if parse_span is not None:
+                parse_span.error = type(err).__name__
+            # Possibly a truncated transfer, so not cached as a site without water-quality data
+            skip_store()
+            return {}
+        except (urllib3.exceptions.HTTPError, requests.RequestException) as err:
+            raise _interrupted_transfer(resp, parse_span, err) from err
+        finally:
+            _close_transfer(resp, parse_span)
+
+    if not organization_count:
+        return {}
+
     return {
-        'organization': (lambda desc: {
-            'id': _find(desc, 'OrganizationIdentifier'),
-            'name': _find(desc, 'OrganizationFormalName')
-        })(organization.find('OrganizationDescription', xml.nsmap)),
-        'activities': [{
-            'description': (lambda desc: {
-                'identifier': _find(desc, 'ActivityIdentifier'),
-                'type_code': _find(desc, 'ActivityTypeCode'),
-                'media_name': _find(desc, 'ActivityMediaName'),
-                'start_date': _find(desc, 'ActivityStartDate'),
-                'start_time': (lambda time: {
-                    'time': _find(time, 'Time'),
-                    'time_zone_code': _find(time, 'TimeZoneCode')
-                })(desc.find('ActivityStartTime', xml.nsmap)),
-                'project_identifier': _find(desc, 'ProjectIdentifier'),
-                'monitoring_location_identifier': _find(desc, 'MonitoringLocationIdentifier'),
-                'comment_text': _find(desc, 'ActivityCommentText')
-            })(activity.find('ActivityDescription', xml.nsmap)),
-            'sample_description': (lambda desc: {
-                'collection_method': (lambda method: {
-                    'identifier': _find(method, 'MethodIdentifier'),
-                    'identifier_context': _find(method, 'MethodIdentifierContext'),
-                    'name': _find(method, 'MethodName')
-                })(desc.find('SampleCollectionMethod', xml.nsmap)),
-                'collection_equipment_name': _find(desc, 'SampleCollectionEquipmentName')
-            })(activity.find('SampleDescription', xml.nsmap)),
-            'results': [{
-                'pcode': _find(result, 'USGSPcode'),
-                'provider_name': _find(result, 'ProviderName'),
-                'description': (lambda desc: {
-                    'detection_condition_text': _find(desc, 'ResultDetectionConditionText'),
-                    'characteristic_name': _find(desc, 'CharacteristicName'),
-                    'sample_fraction_text': _find(desc, 'ResultSampleFractionText'),
-                    'measure': (lambda measure: {
-                        'value': _find(measure, 'ResultMeasureValue'),
-                        'unit_code': _find(measure, 'MeasureUnitCode'),
-                    })(desc.find('ResultMeasure', xml.nsmap)),
-                    'value_type_name': _find(desc, 'ResultValueTypeName'),
-                    'temperature_basis_text': _find(desc, 'ResultTemperatureBasisText'),
-                    'comment_text': _find(desc, 'ResultCommentText')
-                })(result.find('ResultDescription', xml.nsmap)),
-                'analytical_method': (lambda method: {
-                    'identifier': _find(method, 'MethodIdentifier'),
-                    'identifier_context': _find(method, 'MethodIdentifierContext'),
-                    'name': _find(method, 'MethodName')
-                })(result.find('ResultAnalyticalMethod', xml.nsmap)),
-                'lab_information': (lambda info: {
-                    'analysis_start_date': _find(info, 'AnalysisStartDate'),
-                    'analysis_start_time': (lambda start_time: {
-                        'time': _find(start_time, 'Time'),
-                        'time_zone_code': _find(start_time, 'TimeZoneCode')
-                    })(info.find('AnalysisStartTime', xml.nsmap) if info is not None else None),
-                    'detection_quantitation_limit': (lambda limit: {
-                        'type_name': _find(limit, 'DetectionQuantitationLimitTypeName'),
-                        'measure': (lambda measure: {
-                            'value': _find(measure, 'MeasureValue'),
-                            'unit_code': _find(measure, 'MeasureUnitCode')
-                        })(limit.find('DetectionQuantitationLimitMeasure', xml.nsmap) if limit is not None else None)
-                    })(info.find('ResultDetectionQuantitationLimit', xml.nsmap) if info is not None else None)
-                })(result.find('ResultLabInformation', xml.nsmap))
-            } for result in activity.findall('Result', xml.nsmap)]
-        } for activity in organization.findall('Activity', xml.nsmap)]
+        'organization': organization or ORGANIZATION_PLAN(None, WQX_NAMESPACES),
+        'activities': activities
     }
 
 
+WELL_LOG_NAMESPACES = {
+    'gml': 'http://www.opengis.net/gml',
+    'gwml': 'http://www.nrcan.gc.ca/xml/gwml/1',
+    'gsml': 'urn:cgi:xmlns:CGI:GeoSciML:2.0'
+}
+
+
+def _feet_by_default(unit):
+    return _default(unit, 'ft')
+
+
+def _inches_by_default(unit):
+    return _default(unit, 'in')
+
+
+def _to_float(value):
+    return _cast(float, value)
+
+
+def _construction_component(kind, diameter_path):
+    return {
+        'id': Index(kind + '-{0}'),
+        'type': Const(kind),
+        'material': Text('gwml:material/gsml:CGI_TermValue/gsml:value'),
+        'position': Group('gwml:position/gml:LineString', {
+            'unit': Text('gml:uom', convert=_feet_by_default),
+            'coordinates': Text('gml:coordinates', convert=_coordinates)
+        }, optional=True),
+        'diameter': Group(diameter_path, {
+            'value': Text(raw=True, convert=_to_float),
+            'unit': Attribute('uom', convert=_inches_by_default)
+        }, optional=True)
+    }
+
+
+# Extraction plan for a GWML WaterWell element. Each log entry's 'ui' is filled in after extraction.
+WELL_LOG_PLAN = ExtractionPlan(Group('.', {
+    'name': Text('gml:name'),
+    'location': Text('gml:boundedBy/gml:envelope/gml:pos', convert=_location),
+    'elevation': Group('gwml:referenceElevation', {
+        'value': Text(raw=True, convert=_to_float),
+        'unit': Attribute('uom', convert=_feet_by_default),
+        'scheme': Text('../gwml:wellStatus/gsml:CGI_TermValue/gsml:value'
+                       '[@codeSpace="urn:gov.usgs.nwis.alt_datum_cd"]')
+    }, optional=True),
+    'well_depth': Group('gwml:wellDepth/gsml:CGI_NumericValue/gsml:principalValue', {
+        'value': Text(raw=True, convert=_to_float),
+        'unit': Attribute('uom', convert=_feet_by_default)
+    }, optional=True),
+    'water_use': Text('gwml:wellType/gsml:CGI_TermValue/gsml:value'),
+    'link': Group('gwml:onlineResource', {
+        'url': Attribute('{http://www.w3.org/1999/xlink}href'),
+        'title': Attribute('{http://www.w3.org/1999/xlink}title')
+    }, optional=True),
+    'log_entries': Each('gwml:logElement/gsml:MappedInterval', {
+        'id': Index(),
+        'method': Text('gsml:observationMethod/gsml:CGI_TermValue/gsml:value'),
+        'unit': Group('gsml:specification/gwml:HydrostratigraphicUnit', {
+            'description': Text('gml:description'),
+            'ui': Const(None),
+            'purpose': Text('gsml:purpose'),
+            'composition': Group('gsml:composition/gsml:CompositionPart', {
+                'role': Text('gsml:role'),
+                'lithology': Group('gsml:lithology/gsml:ControlledConcept/gml:name', {
+                    'scheme': Attribute('codeSpace'),
+                    'value': Text(raw=True)
+                }, optional=True),
+                'material': Group('gsml:material/gsml:UnconsolidatedMaterial', {
+                    'name': Text('gml:name'),
+                    'purpose': Text('gsml:purpose')
+                }, optional=True),
+                'proportion': Group('gsml:proportion/gsml:CGI_TermValue/gsml:value', {
+                    'scheme': Attribute('codeSpace'),
+                    'value': Text(raw=True)
+                }, optional=True)
+            }, optional=True)
+        }, optional=True),
+        'shape': Group('gsml:shape/gml:LineString', {
+            'dimension': Attribute('srsDimension'),
+            'unit': Attribute('uom', convert=_feet_by_default),
+            'coordinates': Text('gml:coordinates', convert=_coordinates)
+        }, optional=True)
+    }, optional=True),
+    'casings': Each('gwml:construction/gwml:WellCasing/gwml:wellCasingElement/gwml:WellCasingComponent',
+                    _construction_component(
+                        'casing', 'gwml:nominalPipeDimension/gsml:CGI_NumericValue/gsml:principalValue')),
+    'screens': Each('gwml:construction/gwml:Screen/gwml:screenElement/gwml:ScreenComponent',
+                    _construction_component(
+                        'screen', 'gwml:nomicalScreenDiameter/gsml:CGI_NumericValue/gsml:principalValue'))
+}), WELL_LOG_NAMESPACES)
+
+
+@timed('well_log')
+@coalesce('well_log')
+@cached('well_log')
 def get_well_log(agency_cd, location_id):
     """
     Retrieves water-quality data from the NGWMN iddata service.
@@ -178,7 +399,6 @@ def get_well_log(agency_cd, location_id):
     :return: array of activity dictionaries
     :rtype: array
     """
-    # pylint: disable=line-too-long
     xml = get_iddata('well_log', agency_cd, location_id)
     if xml is None:
         return {}
@@ -187,200 +407,74 @@ def get_well_log(agency_cd, location_id):
     if water_well is None:
         return {}
 
-    result = {
-        'name': _find(water_well, 'gml:name'),
-        'location': (lambda pos: {
-            'latitude': pos[0],
-            'longitude': pos[1]
-        })(re.split(' |,', _find(water_well, 'gml:boundedBy/gml:envelope/gml:pos')))
-    }
-
-    elev = water_well.find('gwml:referenceElevation', xml.nsmap)
-    if elev is not None:
-        result['elevation'] = {
-            'value': _cast(float, elev.text),
-            'unit': _default(elev.get('uom'), 'ft'),
-            'scheme': _find(water_well,
-                            'gwml:wellStatus/gsml:CGI_TermValue/gsml:value[@codeSpace="urn:gov.usgs.nwis.alt_datum_cd"]')
-        }
-
-    depth = water_well.find('gwml:wellDepth/gsml:CGI_NumericValue/gsml:principalValue', xml.nsmap)
-    if depth is not None:
-        result['well_depth'] = {
-            'value': _cast(float, depth.text),
-            'unit': _default(depth.get('uom'), 'ft')
-        }
-
-    result['water_use'] = _find(water_well, 'gwml:wellType/gsml:CGI_TermValue/gsml:value')
-
-    link = water_well.find('gwml:onlineResource', xml.nsmap)
-    if link is not None:
-        result['link'] = {
-            'url': link.get('{http://www.w3.org/1999/xlink}href'),
-            'title': link.get('{http://www.w3.org/1999/xlink}title')
-        }
-
-    entries = water_well.findall('gwml:logElement/gsml:MappedInterval', xml.nsmap)
-    if entries:
-        result['log_entries'] = []
-        for index, entry in enumerate(entries):
-            log_entry = {
-                'id': index,
-                'method': _find(entry, 'gsml:observationMethod/gsml:CGI_TermValue/gsml:value')
-            }
-
-            unit = entry.find('gsml:specification/gwml:HydrostratigraphicUnit', xml.nsmap)
-            if unit is not None:
-                log_entry['unit'] = {
-                    'description': _find(unit, 'gml:description'),
-                    'ui': (lambda words: {
-                        'colors': get_colors(words),
-                        'materials': classify_material(words)
-                    })(re.findall(r'\w+', _find(unit, 'gml:description', default='').lower())),
-                    'purpose': _find(unit, 'gsml:purpose')
-                }
-
-                part = unit.find('gsml:composition/gsml:CompositionPart', xml.nsmap)
-                if part is not None:
-                    log_entry_unit_composition = {
-                        'role': _find(part, 'gsml:role')
-                    }
-
-                    lith = part.find('gsml:lithology/gsml:ControlledConcept/gml:name', xml.nsmap)
-                    if lith is not None:
-                        log_entry_unit_composition['lithology'] = {
-                            'scheme': lith.get('codeSpace'),
-                            'value': lith.text
-                        }
-
-                    material = part.find('gsml:material/gsml:UnconsolidatedMaterial', xml.nsmap)
-                    if material is not None:
-                        log_entry_unit_composition['material'] = {
-                            'name': _find(material, 'gml:name'),
-                            'purpose': _find(material, 'gsml:purpose')
-                        }
-
-                    proportion = part.find('gsml:proportion/gsml:CGI_TermValue/gsml:value', xml.nsmap)
-                    if proportion is not None:
-                        log_entry_unit_composition['proportion'] = {
-                            'scheme': proportion.get('codeSpace'),
-                            'value': proportion.text
-                        }
-
-                    log_entry['unit']['composition'] = log_entry_unit_composition
-
-            shape = entry.find('gsml:shape/gml:LineString', xml.nsmap)
-            if shape is not None:
-                log_entry['shape'] = {
-                    'dimension': shape.get('srsDimension'),
-                    'unit': _default(shape.get('uom'), 'ft'),
-                    'coordinates': _coordinates(_find(shape, 'gml:coordinates'))
-                }
-
-            result['log_entries'].append(log_entry)
-
-    construction = []
-
-    casings = water_well.findall('gwml:construction/gwml:WellCasing/gwml:wellCasingElement/gwml:WellCasingComponent',
-                                 xml.nsmap)
-    for index, elem in enumerate(casings):
-        casing = {
-            'id': f'casing-{index}',
-            'type': 'casing',
-            'material': _find(elem, 'gwml:material/gsml:CGI_TermValue/gsml:value')
-        }
-
-        line = elem.find('gwml:position/gml:LineString', xml.nsmap)
-        if line is not None:
-            casing['position'] = {
-                'unit': _default(_find(line, 'gml:uom'), 'ft'),
-                'coordinates': _coordinates(_find(line, 'gml:coordinates'))
-            }
-
-        dimension = elem.find('gwml:nominalPipeDimension/gsml:CGI_NumericValue/gsml:principalValue', xml.nsmap)
-        if dimension is not None:
-            casing['diameter'] = {
-                'value': _cast(float, dimension.text),
-                'unit': _default(dimension.get('uom'), 'in')
-            }
-        construction.append(casing)
-
-    screens = water_well.findall('gwml:construction/gwml:Screen/gwml:screenElement/gwml:ScreenComponent', xml.nsmap)
-    for index, elem in enumerate(screens):
-        screen = {
-            'id': f'screen-{index}',
-            'type': 'screen',
-            'material': _find(elem, 'gwml:material/gsml:CGI_TermValue/gsml:value')
-        }
+    namespaces = {prefix: xml.nsmap.get(prefix, uri) for prefix, uri in WELL_LOG_NAMESPACES.items()}
+    result = WELL_LOG_PLAN(water_well, namespaces)
 
-        line = elem.find('gwml:position/gml:LineString', xml.nsmap)
-        if line is not None:
-            screen['position'] = {
-                'unit': _default(_find(line, 'gml:uom'), 'ft'),
-                'coordinates': _coordinates(_find(line, 'gml:coordinates'))
-            }
-
-        dimension = elem.find('gwml:nomicalScreenDiameter/gsml:CGI_NumericValue/gsml:principalValue', xml.nsmap)
-        if dimension is not None:
-            screen['diameter'] = {
-                'value': _cast(float, dimension.text),
-                'unit': _default(dimension.get('uom'), 'in')
-            }
-        construction.append(screen)
-    result['construction'] = construction
+    # Classify every interval of the well in one batch
+    units = [entry['unit'] for entry in result.get('log_entries', []) if 'unit' in entry]
+    descriptions = [description_words(unit['description']) for unit in units]
+    for unit, classification in zip(units, classify_descriptions(descriptions)):
+        unit['ui'] = classification
 
+    result['construction'] = result.pop('casings') + result.pop('screens')
     return result
 
 
-def generate_bounding_box_values(latitude, longitude, delta=0.01):
-    """
-    Calculate a small bounding box around a point
+# Feature properties used by the site page
+SITE_FEATURE_PROPERTIES = (
+    'AGENCY_CD', 'AGENCY_NM', 'SITE_NO', 'SITE_NAME', 'SITE_TYPE', 'STATE_NM', 'COUNTY_NM', 'HORZ_DATUM',
+    'DEC_LAT_VA', 'DEC_LONG_VA', 'WELL_DEPTH', 'WELL_DEPTH_UNITS_NM', 'LOCAL_AQUIFER_NAME', 'LOCAL_AQUIFER_CD',
+    'NAT_AQFR_DESC', 'NAT_AQUIFER_CD', 'AQFR_CHAR', 'WL_WELL_TYPE_DESC', 'WL_WELL_CHARS_DESC', 'QW_SYS_NAME', 'LINK',
+    'QW_SN_FLAG', 'WL_SN_FLAG'
+)
 
-    :param latitude: decimal latitude
-    :param longitude: decimal longitude
-    :param float delta: difference to use when calculating the bounding box
-    :return: bounding box values in the following order: lower longitude, lower latitude,
-        upper longitude, upper latitude
-    :rtype: tuple
 
-    """
-    flt_lat = float(latitude)
-    flt_lon = float(longitude)
-    lat_lower = flt_lat - delta
-    lon_lower = flt_lon - delta
-    lat_upper = flt_lat + delta
-    lon_upper = flt_lon + delta
-    return lon_lower, lat_lower, lon_upper, lat_upper
+def _cql_literal(value):
+    return "'{0}'".format(str(value).replace("'", "''"))
 
 
-def get_features(latitude, longitude, service_root=SERVICE_ROOT):
+@timed('feature')
+@coalesce('feature')
+@cached('feature')
+def get_site_feature(agency_cd, site_no, service_root=SERVICE_ROOT):
     """
-    Call geoserver GetFeature for a bounding box around the given latitude/longitude.
+    Call geoserver GetFeature for a single monitoring location, returning only
+    the properties used by the site page.
 
-    :param latitude: decimal latitude
-    :param longitude: decimal longitude
+    :param str agency_cd: agency code for the agency that manages the location
+    :param str site_no: the location's identifier
     :param str service_root: hostname of the service
+    :return: the location's feature properties, or an empty dict if it is not found
+    :rtype: dict
     """
-    bbox = generate_bounding_box_values(latitude, longitude)
     data = {
         'SERVICE': 'WFS',
         'VERSION': '1.0.0',
         'srsName': 'EPSG:4326',
         'outputFormat': 'json',
         'typeName': 'ngwmn:VW_GWDP_GEOSERVER',
-        'CQL_FILTER': "((QW_SN_FLAG='1') OR (WL_SN_FLAG='1')) AND (BBOX(GEOM,{},{},{},{}))".format(*bbox)
+        'propertyName': ','.join(SITE_FEATURE_PROPERTIES),
+        'CQL_FILTER': "((QW_SN_FLAG='1') OR (WL_SN_FLAG='1')) AND (AGENCY_CD={0}) AND (SITE_NO={1})".format(
+            _cql_literal(agency_cd), _cql_literal(site_no))
     }
     params = {'request': 'GetFeature'}
     target = urljoin(service_root, 'ngwmn/geoserver/wfs')
-    response = r.post(target, params=params, data=data)
+    response = http_client.post(target, params=params, data=data)
     app.logger.debug('Got %s response from %s', response.status_code, response.url)
 
     if response.status_code != 200:
         raise ServiceException()
 
-    return response.json()
+    for feature in response.json().get('features', []):
+        properties = feature.get('properties', {})
+        if properties.get('SITE_NO') == site_no:
+            return properties
+    return {}
 
 
+@timed('sites')
+@coalesce('sites')
+@cached('sites')
 def get_sites(agency_cd, service_root=SERVICE_ROOT):
     """
     Return the list of sites with there metadata for agency_cd
@@ -398,7 +492,7 @@ def get_sites(agency_cd, service_root=SERVICE_ROOT):
         'CQL_FILTER': "(AGENCY_CD='{0}')".format(agency_cd)
     }
     target = urljoin(service_root, 'ngwmn/geoserver/wfs')
-    response = r.post(target, params=params, data=data)
+    response = http_client.post(target, params=params, data=data)
     app.logger.debug('Got %s response from %s', response.status_code, response.url)
 
     if response.status_code != 200:
@@ -408,6 +502,8 @@ def get_sites(agency_cd, service_root=SERVICE_ROOT):
     return list(map(lambda x: convert_keys_and_booleans(x.get('properties', {})), features))
 
 
+@timed('statistic')
+@coalesce('statistic')
 def get_statistic(agency_cd, site_no, stat_type, service_root=SERVICE_ROOT):
     """
     fetches the statistics from the ngwmn cache
@@ -473,32 +569,40 @@ def get_statistic(agency_cd, site_no, stat_type, service_root=SERVICE_ROOT):
       }
     }
     """
+    stats = _get_statistic_json(agency_cd, site_no, stat_type, service_root)
+    if stats is None:
+        return {
+            'is_ranked': False,
+            'is_fetched': False
+        }
+
+    statistics = convert_keys_and_booleans({**stats, 'is_fetched': True})
+    app.logger.debug(statistics)
+
+    return statistics
+
+
+@cached('statistic')
+def _get_statistic_json(agency_cd, site_no, stat_type, service_root):
     url = '/'.join([service_root, 'ngwmn_cache', 'direct', 'json', stat_type, agency_cd, site_no])
-    resp = r.get(url)
+    resp = http_client.get(url)
     app.logger.debug('Got %s response from %s', resp.status_code, resp.url)
 
-    statistics = {
-        'is_ranked': False,
-        'is_fetched': False
-    }
     if resp.status_code == 404:
-        return statistics
+        mark_absent('statistic', agency_cd, site_no, stat_type, service_root)
+        return None
 
     if resp.status_code != 200:
         msg = '%s statistics fetch error from %s (reason: %s)'
         app.logger.error(msg, resp.status_code, resp.url, resp.reason)
         raise ServiceException()
 
-    json_txt = resp.text
-    stats = json.loads(json_txt)
-    stats['is_fetched'] = True
-
-    statistics = convert_keys_and_booleans(stats)
-    app.logger.debug(statistics)
-
-    return statistics
+    return json.loads(resp.text)
 
 
+@timed('providers')
+@coalesce('providers')
+@cached('providers')
 def get_providers(service_root=SERVICE_ROOT):
     """
     Retrieves the list of providers
@@ -507,7 +611,7 @@ def get_providers(service_root=SERVICE_ROOT):
     the JSON that is returned from the service will have it's keys changed to lowercase
     """
     target = urljoin(service_root, 'ngwmn/metadata/agencies')
-    response = r.get(target)
+    response = http_client.get(target)
     app.logger.debug('Got %s response from %s', response.status_code, response.url)
 
     if response.status_code != 200:
@@ -555,19 +659,13 @@ def replace_null_values(dictionary, replacement_value):
     return clean_dictionary
 
 
-def get_statistics(agency_cd, site_no):
+def default_statistics():
     """
-    Call ngwmn_cache for site statistics data.
+    Statistics to display for a site whose statistics could not be fetched.
 
-    :param agency_cd: string agency code
-    :param site_no: alphanumeric site number
-    :returns overall and monthly statistics
+    :rtype: dict
     """
-
-    substitution = '--'
-
-    # handle to potential fetch fail with default
-    stats = {
+    return {
         'overall': {
             'alt_datum': 'unknown',
             'calc_date': 'unknown',
@@ -575,33 +673,57 @@ def get_statistics(agency_cd, site_no):
         'monthly': []
     }
 
+
+@timed('statistics')
+@coalesce('statistics')
+def get_statistics(agency_cd, site_no):
+    """
+    Call ngwmn_cache for site statistics data.
+
+    :param agency_cd: string agency code
+    :param site_no: alphanumeric site number
+    :returns overall and monthly statistics, or the default statistics if the site has none
+    """
+    return _get_statistics(agency_cd, site_no) or default_statistics()
+
+
+@cached('statistics')
+def _get_statistics(agency_cd, site_no):
+    # None for a site without statistics, so that it is cached for CACHE_NEGATIVE_TTL rather than CACHE_TTL
+    substitution = '--'
+
     overall_statistics = get_statistic(agency_cd, site_no, 'wl-overall')
-    if overall_statistics.get('is_fetched'):
-        overall_statistics = replace_null_values(overall_statistics, substitution)
-        stats['overall'] = overall_statistics
-        site_info = get_statistic(agency_cd, site_no, 'site-info')
-        alt_datum_cd = ''
-        if site_info.get('is_fetched'):
-            alt_datum_cd = site_info['altdatumcd']
-
-        if overall_statistics.get('is_ranked'):
-            monthly_statistics = get_statistic(agency_cd, site_no, 'wl-monthly')
-            if monthly_statistics.get('is_fetched'):
-                stats['monthly'] = []
-                month_int = 0
-                for month_abbr in calendar.month_abbr[1:]:
-                    month_int += 1
-                    month_num = str(month_int)
-                    if month_num in monthly_statistics:
-                        month_stats = monthly_statistics[month_num]
-                        month_stats = replace_null_values(month_stats, substitution)
-                        month_stats['month'] = month_abbr
-                        stats['monthly'].append(month_stats)
-
-        if overall_statistics.get('mediation', '') == 'BelowLand':
-            stats['overall']['alt_datum'] = 'Depth to water, feet below land surface'
-        else:
-            stats['overall']['alt_datum'] = 'Water level in feet relative to ' + alt_datum_cd
+    if not overall_statistics.get('is_fetched'):
+        return None
+
+    stats = default_statistics()
+    overall_statistics = replace_null_values(overall_statistics, substitution)
+    stats['overall'] = overall_statistics
+    site_info = get_statistic(agency_cd, site_no, 'site-info')
+    alt_datum_cd = ''
+    if site_info.get('is_fetched'):
+        alt_datum_cd = site_info['altdatumcd']
+
+    if not overall_statistics.get('is_ranked'):
+        app.logger.debug('Skipped wl-monthly statistics for %s %s: site is not ranked', agency_cd, site_no)
+    else:
+        monthly_statistics = get_statistic(agency_cd, site_no, 'wl-monthly')
+        if monthly_statistics.get('is_fetched'):
+            stats['monthly'] = []
+            month_int = 0
+            for month_abbr in calendar.month_abbr[1:]:
+                month_int += 1
+                month_num = str(month_int)
+                if month_num in monthly_statistics:
+                    month_stats = monthly_statistics[month_num]
+                    month_stats = replace_null_values(month_stats, substitution)
+                    month_stats['month'] = month_abbr
+                    stats['monthly'].append(month_stats)
+
+    if overall_statistics.get('mediation', '') == 'BelowLand':
+        stats['overall']['alt_datum'] = 'Depth to water, feet below land surface'
+    else:
+        stats['overall']['alt_datum'] = 'Water level in feet relative to ' + alt_datum_cd
 
     # { SAMPLE stats
     #     "alt_datum": 'Below Land Surface',
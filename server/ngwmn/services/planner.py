@@ -0,0 +1,52 @@
+"""
+Planning of the upstream calls needed to render a site page.
+
+A site's metadata flags, and what upstream services have recently reported
+as missing, tell us ahead of time that some calls cannot return data. Those
+calls are skipped rather than paying for a round trip, and reported in the
+request's Server-Timing header and access log line.
+"""
+from collections import namedtuple
+
+from ngwmn import app
+from ngwmn.services.cache import is_absent
+from ngwmn.services.timing import note_skipped
+
+SERVICE_ROOT = app.config.get('SERVICE_ROOT')
+
+SiteFetchPlan = namedtuple('SiteFetchPlan', ['water_quality', 'statistics', 'skipped'])
+
+
+def plan_site_fetches(agency_cd, location_id, feature, service_root=SERVICE_ROOT):
+    """
+    Decide which optional upstream calls to make for a site page.
+
+    :param str agency_cd: agency code for the agency that manages the location
+    :param str location_id: the location's identifier
+    :param dict feature: the location's feature properties, or an empty dict if unknown
+    :param str service_root: hostname of the NGWMN services
+    :return: whether to fetch water quality and statistics, and a dict of
+        skipped call names to the reason they were skipped
+    :rtype: SiteFetchPlan
+    """
+    skipped = {}
+    if app.config.get('PLAN_SITE_FETCHES'):
+        if feature.get('QW_SN_FLAG') == '0':
+            skipped['water_quality'] = 'site is not in the water-quality network'
+        elif is_absent('iddata', 'water_quality', agency_cd, location_id, service_root):
+            skipped['water_quality'] = 'no water-quality data found recently'
+
+        if feature.get('WL_SN_FLAG') == '0':
+            skipped['statistics'] = 'site is not in the water-level network'
+        elif is_absent('statistic', agency_cd, location_id, 'wl-overall', service_root):
+            skipped['statistics'] = 'no water-level statistics found recently'
+
+    for call, reason in skipped.items():
+        app.logger.debug('Skipped %s for %s %s: %s', call, agency_cd, location_id, reason)
+        note_skipped(call, reason)
+
+    return SiteFetchPlan(
+        water_quality='water_quality' not in skipped,
+        statistics='statistics' not in skipped,
+        skipped=skipped
+    )
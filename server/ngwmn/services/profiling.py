@@ -0,0 +1,341 @@
+"""
+Per-request profiling.
+
+A request can be profiled on demand, when PROFILE_ON_DEMAND is set, by
+passing `profile=cprofile` or `profile=sample` as a query parameter or an
+X-Profile header (along with PROFILE_KEY as `profile_key` or X-Profile-Key,
+if it is set). The profile is returned in place of the page, as a download:
+
+- `cprofile`: a deterministic profile in the pstats format, for pstats or snakeviz
+- `sample`: wall-clock stack samples in the folded format, for speedscope or flamegraph.pl
+
+With PROFILE_SLOW_REQUESTS set to a number of seconds, every request is
+sampled, and the samples of those taking longer are written to PROFILE_DIR,
+which keeps only the PROFILE_DIR_MAX_FILES most recent. Sampling is cheap
+enough to leave on: a single background thread snapshots the stacks of the
+threads serving profiled requests every PROFILE_SAMPLE_INTERVAL seconds.
+
+The profile in progress lives in a context variable, and calls made on the
+upstream thread pool through `concurrency.submit` are profiled along with the
+request that submitted them. Work done on the lithology process pool is not.
+"""
+import abc
+import collections
+import contextvars
+import cProfile
+import itertools
+import marshal
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+
+from ngwmn import app
+
+_PROFILE = contextvars.ContextVar('profiling_profile', default=None)
+
+MODES = ('cprofile', 'sample')
+
+_saved = itertools.count()
+
+# Names of the files written by save_profile, the only files in PROFILE_DIR that are ever deleted
+_SAVED_NAME = re.compile(r'^\d{8}T\d{6}-[\w.-]+-\d+ms-\d+-\d+\.(prof|folded)$')
+
+
+class Profile(abc.ABC):
+    """
+    Profile of one request, across the threads attached to it.
+    """
+
+    def __init__(self, on_demand=False):
+        self.on_demand = on_demand
+        self.start = time.perf_counter()
+        self.duration = None
+
+    @abc.abstractmethod
+    def attach(self, label):
+        """
+        Start profiling the current thread.
+
+        :param str label: name of the thread's role, e.g. 'request' or 'upstream'
+        """
+
+    @abc.abstractmethod
+    def detach(self):
+        """
+        Stop profiling the current thread.
+        """
+
+    def stop(self):
+        """
+        Stop profiling every thread.
+        """
+        self.duration = time.perf_counter() - self.start
+
+    @abc.abstractmethod
+    def artifact(self):
+        """
+        The profile, as a file.
+
+        :return: the content of the file, its MIME type and its extension
+        :rtype: tuple
+        """
+
+
+class DeterministicProfile(Profile):
+    """
+    cProfile profile, merged over the attached threads.
+    """
+
+    def __init__(self, on_demand=False):
+        super().__init__(on_demand)
+        self._lock = threading.Lock()
+        self._active = {}
+        self._finished = []
+
+    def attach(self, label):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already active, on Python versions that allow only one at a time
+            return
+        with self._lock:
+            self._active[threading.get_ident()] = profiler
+
+    def detach(self):
+        with self._lock:
+            profiler = self._active.pop(threading.get_ident(), None)
+        if profiler is not None:
+            profiler.disable()
+            with self._lock:
+                self._finished.append(profiler)
+
+    def stop(self):
+        self.detach()
+        super().stop()
+
+    def artifact(self):
+        with self._lock:
+            profilers = [profiler for profiler in self._finished if profiler.getstats()]
+        if not profilers:
+            return b'', 'application/octet-stream', 'prof'
+        stats = pstats.Stats(profilers[0])
+        for profiler in profilers[1:]:
+            stats.add(profiler)
+        # The format written by pstats.Stats.dump_stats
+        return marshal.dumps(stats.stats), 'application/octet-stream', 'prof'
+
+
+class SamplingProfile(Profile):
+    """
+    Wall-clock stack samples of the attached threads.
+    """
+
+    def __init__(self, on_demand=False):
+        super().__init__(on_demand)
+        self._lock = threading.Lock()
+        self._attached = set()
+        self.samples = collections.Counter()
+
+    def attach(self, label):
+        ident = threading.get_ident()
+        with self._lock:
+            self._attached.add(ident)
+        _sampler.register(ident, self, label)
+
+    def detach(self):
+        ident = threading.get_ident()
+        with self._lock:
+            self._attached.discard(ident)
+        _sampler.unregister(ident, self)
+
+    def add(self, stack):
+        """
+        Record one sample.
+
+        :param tuple stack: frame labels, outermost first
+        """
+        with self._lock:
+            self.samples[stack] += 1
+
+    def stop(self):
+        with self._lock:
+            attached, self._attached = self._attached, set()
+        for ident in attached:
+            _sampler.unregister(ident, self)
+        super().stop()
+
+    def artifact(self):
+        with self._lock:
+            samples = self.samples.most_common()
+        lines = ''.join('{0} {1}\n'.format(';'.join(stack), count) for stack, count in samples)
+        return lines.encode('utf-8'), 'text/plain', 'folded'
+
+
+_frame_labels = {}
+
+
+def _short_filename(filename):
+    for path in sorted((path for path in sys.path if path), key=len, reverse=True):
+        if filename.startswith(path + os.sep):
+            return filename[len(path) + 1:]
+    return os.path.basename(filename)
+
+
+def _frame_label(code):
+    label = _frame_labels.get(code)
+    if label is None:
+        label = _frame_labels[code] = '{0} ({1}:{2})'.format(
+            code.co_name, _short_filename(code.co_filename), code.co_firstlineno)
+    return label
+
+
+class _Sampler:
+    """
+    Background thread sampling the stacks of the threads attached to sampling profiles.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._threads = {}
+        self._thread = None
+
+    def register(self, ident, profile, label):
+        """
+        Start sampling a thread for a profile, starting the sampling thread if it is not running.
+
+        :param int ident: identifier of the thread, as returned by threading.get_ident
+        :param SamplingProfile profile: the profile the samples are added to
+        :param str label: name of the thread's role, put at the root of its stacks
+        """
+        with self._condition:
+            self._threads.setdefault(ident, []).append((profile, label))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='ngwmn-profile-sampler', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def unregister(self, ident, profile):
+        """
+        Stop sampling a thread for a profile.
+
+        :param int ident: identifier of the thread
+        :param SamplingProfile profile: the profile the thread was sampled for
+        """
+        with self._condition:
+            entries = [entry for entry in self._threads.get(ident, []) if entry[0] is not profile]
+            if entries:
+                self._threads[ident] = entries
+            else:
+                self._threads.pop(ident, None)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._threads:
+                    self._condition.wait()
+                threads = {ident: list(entries) for ident, entries in self._threads.items()}
+            frames = sys._current_frames()  # pylint: disable=protected-access
+            for ident, entries in threads.items():
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                stack.reverse()
+                for profile, label in entries:
+                    profile.add((label,) + tuple(stack))
+            # Drop the frames, rather than keeping their locals alive until the next sample
+            frames = None
+            time.sleep(app.config.get('PROFILE_SAMPLE_INTERVAL') or 0.005)
+
+
+_sampler = _Sampler()
+
+
+def start_profile(mode, on_demand=False):
+    """
+    Start profiling the request being handled in the current context.
+
+    :param str mode: 'cprofile' or 'sample'
+    :param bool on_demand: whether the profile was requested, to be returned instead of the response
+    :rtype: Profile
+    """
+    profile = DeterministicProfile(on_demand) if mode == 'cprofile' else SamplingProfile(on_demand)
+    _PROFILE.set(profile)
+    profile.attach('request')
+    return profile
+
+
+def stop_profile():
+    """
+    Stop profiling the request being handled in the current context.
+
+    :return: the finished profile, or None if the request was not being profiled
+    :rtype: Profile
+    """
+    profile = _PROFILE.get()
+    _PROFILE.set(None)
+    if profile is not None:
+        profile.stop()
+    return profile
+
+
+def run_profiled(func, *args, **kwargs):
+    """
+    Call func, profiling the current thread if the current context has a
+    profile in progress. Used for calls run on the upstream thread pool.
+
+    :param func: the callable to run
+    :return: the result of the call
+    """
+    profile = _PROFILE.get()
+    if profile is None:
+        return func(*args, **kwargs)
+    profile.attach('upstream')
+    try:
+        return func(*args, **kwargs)
+    finally:
+        profile.detach()
+
+
+def save_profile(profile, name):
+    """
+    Write a profile to PROFILE_DIR, deleting the oldest profiles there beyond
+    PROFILE_DIR_MAX_FILES. Other files in the directory are left alone.
+
+    :param Profile profile: the finished profile
+    :param str name: what was profiled, e.g. the Flask endpoint
+    :return: path of the file written
+    :rtype: str
+    """
+    directory = app.config.get('PROFILE_DIR') or 'profiles'
+    os.makedirs(directory, exist_ok=True)
+    content, _, extension = profile.artifact()
+    path = os.path.join(directory, '{0}-{1}-{2}ms-{3}-{4}.{5}'.format(
+        time.strftime('%Y%m%dT%H%M%S'), re.sub(r'[^\w.-]', '_', name), int(profile.duration * 1000), os.getpid(),
+        next(_saved), extension))
+    with open(path, 'wb') as output:
+        output.write(content)
+
+    limit = app.config.get('PROFILE_DIR_MAX_FILES') or 50
+    profiles = sorted((os.path.join(directory, filename) for filename in os.listdir(directory)
+                       if _SAVED_NAME.match(filename)), key=_modified_time)
+    for old in profiles[:-limit]:
+        try:
+            os.remove(old)
+        except OSError:
+            pass
+    return path
+
+
+def _modified_time(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return 0
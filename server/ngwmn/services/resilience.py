@@ -0,0 +1,204 @@
+"""
+Circuit breakers and bulkheads protecting the application from a degraded
+upstream host. The HTTP client keeps one of each per host.
+
+A circuit breaker tracks the outcomes of the last HTTP_BREAKER_WINDOW calls
+to its host. Once at least HTTP_BREAKER_MIN_CALLS have been made and the
+proportion that failed (connection errors, timeouts and HTTP_BREAKER_STATUSES)
+reaches HTTP_BREAKER_FAILURE_RATE, the breaker opens, and calls fail at once
+for HTTP_BREAKER_OPEN_SECONDS. It then lets HTTP_BREAKER_PROBES calls through:
+if they succeed the breaker closes again, and if one fails it reopens.
+
+A bulkhead limits the calls in flight to its host to HTTP_HOST_MAX_CONCURRENCY,
+so that a host that has become slow cannot tie up every worker and upstream
+pool thread. A call that cannot get a slot within HTTP_BULKHEAD_WAIT seconds
+fails.
+
+Calls failed by either raise UpstreamUnavailable, a ServiceException, so that
+they are handled like any other upstream error.
+"""
+import collections
+import threading
+import time
+
+from ngwmn import app
+from ngwmn.services import ServiceException
+from ngwmn.services.metrics import observe_circuit, observe_rejection
+
+
+class UpstreamUnavailable(ServiceException):
+    """
+    Raised instead of calling an upstream host whose circuit breaker is open
+    or whose bulkhead is full.
+    """
+
+    def __init__(self, host, reason):
+        super().__init__(message='backing service unavailable', status_code=503)
+        self.host = host
+        self.reason = reason
+
+
+# When a circuit breaker opens and closes: see the HTTP_BREAKER_* settings of the same names
+BreakerPolicy = collections.namedtuple(
+    'BreakerPolicy', ['window', 'min_calls', 'failure_rate', 'open_seconds', 'probes'], defaults=(20, 10, 0.5, 30, 1))
+
+
+class CircuitBreaker:
+    """
+    Failure-rate circuit breaker for one upstream host.
+
+    :param str host: the host, for the logs and metrics
+    :param BreakerPolicy policy: when the breaker opens and closes
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, host, policy=BreakerPolicy()):
+        self.host = host
+        self.policy = policy
+        self.state = self.CLOSED
+        # Outcomes of the last calls while closed, or of the probes that succeeded while half open
+        self._outcomes = collections.deque(maxlen=max(policy.window, policy.probes))
+        self._opened_at = None
+        self._probes_in_flight = 0
+        self._lock = threading.Lock()
+
+    def _transition(self, state):
+        self.state = state
+        self._outcomes.clear()
+        self._probes_in_flight = 0
+        if state == self.OPEN:
+            self._opened_at = time.monotonic()
+        log = app.logger.info if state == self.CLOSED else app.logger.warning
+        log('Circuit breaker for %s is now %s', self.host, state)
+        observe_circuit(self.host, state)
+
+    def allow(self):
+        """
+        Whether a call may be made now. Every allowed call must be followed
+        by a call to `record`.
+
+        :rtype: bool
+        """
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.policy.open_seconds:
+                    return False
+                self._transition(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN:
+                if self._probes_in_flight >= self.policy.probes:
+                    return False
+                self._probes_in_flight += 1
+            return True
+
+    def record(self, success):
+        """
+        Record the outcome of an allowed call.
+
+        :param bool success: whether the host answered the call without failing, or None if the call was not
+            made or failed for reasons of its own, which says nothing about the host's health
+        """
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+                if success is None:
+                    return
+                if not success:
+                    self._transition(self.OPEN)
+                    return
+                self._outcomes.append(success)
+                if len(self._outcomes) >= self.policy.probes:
+                    self._transition(self.CLOSED)
+            elif self.state == self.CLOSED and success is not None:
+                self._outcomes.append(success)
+                failures = self._outcomes.count(False)
+                if len(self._outcomes) >= self.policy.min_calls and \
+                        failures >= self.policy.failure_rate * len(self._outcomes):
+                    self._transition(self.OPEN)
+
+
+class Bulkhead:
+    """
+    Limit on the concurrent calls to one upstream host.
+    """
+
+    def __init__(self, host, limit, wait=0):
+        self.host = host
+        self.wait = wait
+        self._slots = threading.BoundedSemaphore(limit)
+
+    def acquire(self):
+        """
+        Take a slot, waiting up to the bulkhead's wait for one to be released.
+
+        :rtype: bool
+        """
+        return self._slots.acquire(timeout=self.wait)
+
+    def release(self):
+        """
+        Give back a slot taken by `acquire`.
+        """
+        self._slots.release()
+
+
+class Guard:
+    """
+    The circuit breaker and bulkhead of one upstream host, configured from
+    the application configuration.
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self.statuses = app.config.get('HTTP_BREAKER_STATUSES', ())
+        self.breaker = None
+        if app.config.get('HTTP_BREAKER_ENABLED'):
+            self.breaker = CircuitBreaker(host, BreakerPolicy(
+                window=app.config.get('HTTP_BREAKER_WINDOW', 20),
+                min_calls=app.config.get('HTTP_BREAKER_MIN_CALLS', 10),
+                failure_rate=app.config.get('HTTP_BREAKER_FAILURE_RATE', 0.5),
+                open_seconds=app.config.get('HTTP_BREAKER_OPEN_SECONDS', 30),
+                probes=app.config.get('HTTP_BREAKER_PROBES', 1)
+            ))
+        self.bulkhead = None
+        if app.config.get('HTTP_HOST_MAX_CONCURRENCY'):
+            self.bulkhead = Bulkhead(host, app.config['HTTP_HOST_MAX_CONCURRENCY'],
+                                     app.config.get('HTTP_BULKHEAD_WAIT', 0))
+
+    def enter(self):
+        """
+        Admit a call to the host.
+
+        :raises UpstreamUnavailable: if the circuit breaker is open or the bulkhead is full
+        """
+        if self.breaker is not None and not self.breaker.allow():
+            observe_rejection(self.host, 'circuit_open')
+            raise UpstreamUnavailable(self.host, 'circuit_open')
+        if self.bulkhead is not None and not self.bulkhead.acquire():
+            if self.breaker is not None:
+                self.breaker.record(None)
+            observe_rejection(self.host, 'bulkhead_full')
+            app.logger.warning('Too many concurrent calls to %s', self.host)
+            raise UpstreamUnavailable(self.host, 'bulkhead_full')
+
+    def exit(self, success):
+        """
+        Finish a call admitted by `enter`.
+
+        :param success: whether the host answered without failing, or None if the call failed for
+            reasons of its own
+        """
+        if self.bulkhead is not None:
+            self.bulkhead.release()
+        if self.breaker is not None:
+            self.breaker.record(success)
+
+    def succeeded(self, response):
+        """
+        Whether a response counts as a success for the circuit breaker.
+
+        :param requests.Response response: the upstream response
+        :rtype: bool
+        """
+        return response.status_code not in self.statuses
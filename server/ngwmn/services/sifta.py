@@ -3,9 +3,9 @@ Helpers to retrieve SIFTA cooperator data.
 """
 import datetime
 
-import requests
-
 from ngwmn import app
+from ngwmn.services import ServiceException, http_client
+from ngwmn.services.timing import timed
 
 
 def get_current_date():
@@ -16,6 +16,7 @@ def get_current_date():
     return datetime.date.today()
 
 
+@timed('sifta')
 def get_cooperators(site_no):
     """
     Gets the cooperator data from the SIFTA service
@@ -35,9 +36,9 @@ def get_cooperators(site_no):
                                                           current_date=current_date.strftime("%m/%d/%Y"))
 
     try:
-        response = requests.get(url)
-    except requests.exceptions.RequestException as err:
-        app.logger.error('Failed to contact SIFTA services with this url: %s (reason: %s)', url, str(err))
+        response = http_client.get(url)
+    except ServiceException as err:
+        app.logger.error('Failed to contact SIFTA services with this url: %s (reason: %s)', url, err.message)
         return []
 
     # Gracefully degrade to an empty list of cooperators
@@ -0,0 +1,107 @@
+"""
+Coalescing of identical, concurrent upstream calls.
+
+While a call for a given key is in flight, further callers with the same key
+wait for it to finish and share its result (or exception) instead of making
+their own request. Waiting callers give up at the deadline of the request
+they are handling, if any (see concurrency.bounded_by).
+"""
+import functools
+import threading
+
+from ngwmn.services import ServiceException
+from ngwmn.services.cache import cache_key
+from ngwmn.services.concurrency import current_deadline, remaining
+from ngwmn.services.metrics import observe_coalesced
+from ngwmn.services.timing import note_cache
+
+
+# Result of a call that has not returned
+_NO_RESULT = object()
+
+
+class _Call:
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = _NO_RESULT
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Tracks in-flight calls by key so that concurrent duplicates run only once.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args, **kwargs):
+        """
+        Call func unless a call with the same key is already in flight, in which
+        case wait for that call and return its result.
+
+        :param str key: identifies calls that are interchangeable
+        :param func: the callable to run
+        :return: the result of func
+        :raises ServiceException: if the call in flight was interrupted (503), or the deadline of the request
+            being handled passed while waiting for it (504)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            note_cache('shared')
+            # Keys built by cache_key start with the endpoint name
+            observe_coalesced(key.partition(':')[0])
+            if not call.done.wait(remaining(current_deadline())):
+                raise ServiceException(message='timed out waiting for backing service', status_code=504)
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+            return call.result
+        except Exception as err:
+            call.error = err
+            raise
+        finally:
+            if call.result is _NO_RESULT and call.error is None:
+                # Interrupted by a BaseException, e.g. KeyboardInterrupt or a gevent Timeout, which is the leader's
+                # own to handle
+                call.error = ServiceException(message='shared backing service call was interrupted')
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self):
+        """
+        Number of calls currently in flight.
+        """
+        with self._lock:
+            return len(self._calls)
+
+
+_GROUP = SingleFlight()
+
+
+def coalesce(endpoint):
+    """
+    Decorator sharing one in-flight call between concurrent callers of a
+    service function that pass the same arguments. The shared result must be
+    treated as read-only.
+
+    :param str endpoint: name of the upstream endpoint, used to namespace the call keys
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return _GROUP.do(cache_key(endpoint, *args, **kwargs), func, *args, **kwargs)
+        return wrapper
+    return decorator
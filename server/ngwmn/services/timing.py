@@ -0,0 +1,243 @@
+"""
+Per-request timing of service calls.
+
+Service functions decorated with `timed` record their duration, outcome,
+upstream status and response size, and whether they were answered from the
+cache, in the timings of the request being handled and in the service call
+metrics, and as a span of the request's trace. Calls that were planned away
+are recorded in the request's timings too, with the reason they were skipped. The timings live in a
+context variable, so calls made on the upstream thread pool through
+`concurrency.submit` are attributed to the request that submitted them.
+"""
+import contextvars
+import functools
+import threading
+import time
+
+from ngwmn.services.metrics import observe_call
+from ngwmn.services.tracing import KIND_CLIENT, span
+
+_REQUEST = contextvars.ContextVar('timing_request', default=None)
+# The innermost timed call in progress, which upstream responses and cache lookups are attributed to
+_CALL = contextvars.ContextVar('timing_call', default=None)
+
+
+class Call:
+    """
+    One timed service call.
+    """
+    # pylint: disable=too-few-public-methods
+    __slots__ = ('name', 'start', 'duration', 'status', 'size', 'cache', 'error')
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        self.duration = None
+        self.status = None
+        self.size = None
+        self.cache = None
+        self.error = None
+
+
+class RequestTimings:
+    """
+    The timed service calls made, and those skipped, while handling one request.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.calls = []
+        self.skipped = {}
+        self._lock = threading.Lock()
+
+    def add(self, call):
+        """
+        Record a finished call.
+
+        :param Call call: the call
+        """
+        with self._lock:
+            self.calls.append(call)
+
+    def skip(self, name, reason):
+        """
+        Record a call that was not made.
+
+        :param str name: name of the call, as passed to `timed`
+        :param str reason: why it was skipped
+        """
+        with self._lock:
+            self.skipped[name] = reason
+
+    def elapsed(self):
+        """
+        Seconds since the request started.
+        """
+        return time.perf_counter() - self.start
+
+    def summary(self):
+        """
+        Calls aggregated by name: their count and total duration in milliseconds,
+        upstream statuses, bytes received, cache outcomes and errors, and the
+        reason a call was skipped, if it was.
+
+        :rtype: dict
+        """
+        with self._lock:
+            calls = list(self.calls)
+            skipped = dict(self.skipped)
+        summary = {}
+        for name, reason in skipped.items():
+            summary[name] = {'calls': 0, 'duration_ms': 0.0, 'skipped': reason}
+        for call in calls:
+            entry = summary.setdefault(call.name, {'calls': 0, 'duration_ms': 0.0})
+            entry['calls'] += 1
+            entry['duration_ms'] += call.duration * 1000
+            if call.status is not None:
+                entry.setdefault('statuses', {})
+                entry['statuses'][str(call.status)] = entry['statuses'].get(str(call.status), 0) + 1
+            if call.size is not None:
+                entry['bytes'] = entry.get('bytes', 0) + call.size
+            if call.cache is not None:
+                entry.setdefault('cache', {})
+                entry['cache'][call.cache] = entry['cache'].get(call.cache, 0) + 1
+            if call.error is not None:
+                entry.setdefault('errors', [])
+                entry['errors'].append(call.error)
+        for entry in summary.values():
+            entry['duration_ms'] = round(entry['duration_ms'], 1)
+        return summary
+
+    def server_timing(self):
+        """
+        Value of a Server-Timing header with one metric per call name and a
+        `total` metric for the whole request.
+
+        :rtype: str
+        """
+        metrics = []
+        for name, entry in sorted(self.summary().items()):
+            description = ['calls={0}'.format(entry['calls'])]
+            description.extend('{0}={1}'.format(outcome, count)
+                               for outcome, count in sorted(entry.get('cache', {}).items()))
+            description.extend('status_{0}={1}'.format(status, count)
+                               for status, count in sorted(entry.get('statuses', {}).items()))
+            if 'bytes' in entry:
+                description.append('bytes={0}'.format(entry['bytes']))
+            if 'errors' in entry:
+                description.append('errors={0}'.format(len(entry['errors'])))
+            if 'skipped' in entry:
+                description.append('skipped')
+            metrics.append('{0};dur={1:.1f};desc="{2}"'.format(name, entry['duration_ms'], ' '.join(description)))
+        metrics.append('total;dur={0:.1f}'.format(self.elapsed() * 1000))
+        return ', '.join(metrics)
+
+
+def begin_request():
+    """
+    Start collecting the timings of a new request in the current context.
+
+    :rtype: RequestTimings
+    """
+    timings = RequestTimings()
+    _REQUEST.set(timings)
+    return timings
+
+
+def end_request():
+    """
+    Stop collecting timings in the current context.
+
+    :return: the timings of the request, or None if none were being collected
+    """
+    timings = _REQUEST.get()
+    _REQUEST.set(None)
+    return timings
+
+
+def current_request():
+    """
+    The timings of the request being handled, or None outside of a request.
+
+    :rtype: RequestTimings
+    """
+    return _REQUEST.get()
+
+
+def timed(name):
+    """
+    Decorator recording each call of a service function in the service call
+    metrics and, while handling a request, in the request's timings and trace.
+
+    :param str name: name of the call, e.g. the upstream endpoint
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            call = Call(name)
+            token = _CALL.set(call)
+            try:
+                with span(name, KIND_CLIENT) as current:
+                    try:
+                        return func(*args, **kwargs)
+                    finally:
+                        if current is not None:
+                            current.set_attribute('ngwmn.cache', call.cache)
+                            current.set_attribute('http.status_code', call.status)
+                            current.set_attribute('ngwmn.response_bytes', call.size)
+            except Exception as err:
+                call.error = type(err).__name__
+                raise
+            finally:
+                _CALL.reset(token)
+                call.duration = time.perf_counter() - call.start
+                observe_call(call)
+                timings = _REQUEST.get()
+                if timings is not None:
+                    timings.add(call)
+        return wrapper
+    return decorator
+
+
+def note_cache(outcome):
+    """
+    Record how the timed call in progress was answered by the cache.
+
+    :param str outcome: 'hit', 'miss', 'stale', 'negative' (a cached empty result), 'error' (a cached upstream
+        error) or 'shared' (waited for an identical call in flight)
+    """
+    call = _CALL.get()
+    if call is not None and call.cache is None:
+        call.cache = outcome
+
+
+def note_skipped(name, reason):
+    """
+    Record in the timings of the request being handled that a call was skipped.
+
+    :param str name: name of the call, as passed to `timed`
+    :param str reason: why it was skipped
+    """
+    timings = _REQUEST.get()
+    if timings is not None:
+        timings.skip(name, reason)
+
+
+def note_response(response, streamed=False):
+    """
+    Record the status and size of an upstream response in the timed call in progress.
+
+    :param requests.Response response: the upstream response
+    :param bool streamed: whether the body is still to be read, so only its Content-Length is known
+    """
+    call = _CALL.get()
+    if call is None:
+        return
+    call.status = response.status_code
+    if streamed:
+        length = response.headers.get('Content-Length')
+        size = int(length) if length and length.isdigit() else None
+    else:
+        size = len(response.content)
+    if size is not None:
+        call.size = (call.size or 0) + size
@@ -0,0 +1,260 @@
+"""
+Request-scoped tracing spans.
+
+Each request handled while TRACE_EXPORT is set gets a root span, and the
+service calls, XML parses, lithology classifications and template renders
+made on its behalf are recorded as child spans. Once the request is finished,
+its spans are written as one line of OTLP/JSON (an OpenTelemetry
+ExportTraceServiceRequest) to the file named by TRACE_EXPORT, or to standard
+output if it is 'stdout'. Such a file can be read by the OpenTelemetry
+Collector's `otlpjsonfile` receiver, or inspected with jq.
+
+The span in progress lives in a context variable, so spans started on the
+upstream thread pool through `concurrency.submit` are children of the span
+that submitted them. A W3C `traceparent` request header, if any, is honoured.
+"""
+import collections
+import contextlib
+import contextvars
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+from ngwmn import __version__, app
+
+_SPAN = contextvars.ContextVar('tracing_span', default=None)
+
+# Span kinds and status codes of the OTLP protobuf enums
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+KIND_CLIENT = 3
+_STATUS_ERROR = 2
+
+_TRACEPARENT = re.compile(r'^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$')
+
+_export_lock = threading.Lock()
+
+# Where a span sits in its trace: the trace it belongs to, its own id, and the id of its parent span, if any
+SpanContext = collections.namedtuple('SpanContext', ['trace', 'span_id', 'parent_id'])
+
+
+def _attribute(key, value):
+    if isinstance(value, bool):
+        typed = {'boolValue': value}
+    elif isinstance(value, int):
+        typed = {'intValue': str(value)}
+    elif isinstance(value, float):
+        typed = {'doubleValue': value}
+    else:
+        typed = {'stringValue': str(value)}
+    return {'key': key, 'value': typed}
+
+
+class Trace:
+    """
+    The spans of one request. Spans ending after the request has been
+    exported, e.g. abandoned upstream calls, are exported on their own.
+    """
+
+    def __init__(self, trace_id):
+        self.trace_id = trace_id
+        self.spans = []
+        self.exported = False
+        self._lock = threading.Lock()
+
+    def finish(self, finished):
+        """
+        Record a finished span.
+
+        :param Span finished: the span
+        """
+        with self._lock:
+            if not self.exported:
+                self.spans.append(finished)
+                return
+        export([finished])
+
+    def export(self):
+        """
+        Export the finished spans of the trace.
+        """
+        with self._lock:
+            spans, self.spans = self.spans, []
+            self.exported = True
+        export(spans)
+
+
+class Span:
+    """
+    One timed operation within a trace.
+    """
+    __slots__ = ('context', 'name', 'kind', 'start', 'end', 'attributes', 'error')
+
+    def __init__(self, trace, name, parent_id=None, kind=KIND_INTERNAL, attributes=None):
+        self.context = SpanContext(trace, '{0:016x}'.format(random.getrandbits(64)), parent_id)
+        self.name = name
+        self.kind = kind
+        self.start = time.time_ns()
+        self.end = None
+        self.attributes = dict(attributes or {})
+        self.error = None
+
+    def set_attribute(self, key, value):
+        """
+        Set an attribute of the span. None values are left out.
+
+        :param str key: attribute name, e.g. 'http.status_code'
+        :param value: str, bool, int or float value
+        """
+        if value is not None:
+            self.attributes[key] = value
+
+    def to_otlp(self):
+        """
+        The span in the OTLP/JSON encoding.
+
+        :rtype: dict
+        """
+        otlp = {
+            'traceId': self.context.trace.trace_id,
+            'spanId': self.context.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start),
+            'endTimeUnixNano': str(self.end),
+            'attributes': [_attribute(key, value) for key, value in self.attributes.items() if value is not None],
+            'status': {'code': _STATUS_ERROR, 'message': self.error} if self.error is not None else {}
+        }
+        if self.context.parent_id:
+            otlp['parentSpanId'] = self.context.parent_id
+        return otlp
+
+
+def _enabled():
+    return bool(app.config.get('TRACE_EXPORT'))
+
+
+def start_trace(name, traceparent=None, **attributes):
+    """
+    Start the root span of a request in the current context, if tracing is
+    enabled by TRACE_EXPORT.
+
+    :param str name: span name, e.g. 'GET /provider/<agency_cd>/'
+    :param str traceparent: value of a W3C traceparent header to continue the trace of
+    :return: the root span, or None if tracing is disabled
+    :rtype: Span
+    """
+    if not _enabled():
+        _SPAN.set(None)
+        return None
+    match = _TRACEPARENT.match(traceparent or '')
+    if match:
+        trace_id, parent_id = match.groups()
+    else:
+        trace_id, parent_id = '{0:032x}'.format(random.getrandbits(128)), None
+    root = Span(Trace(trace_id), name, parent_id=parent_id, kind=KIND_SERVER, attributes=attributes)
+    _SPAN.set(root)
+    return root
+
+
+def end_trace(error=None):
+    """
+    End the root span started in the current context, and export the trace.
+
+    :param Exception error: the exception the request failed with, if any
+    """
+    root = _SPAN.get()
+    _SPAN.set(None)
+    if root is None:
+        return
+    _end(root, error)
+    root.context.trace.export()
+
+
+def current_span():
+    """
+    The span in progress, or None if the current context is not being traced.
+
+    :rtype: Span
+    """
+    return _SPAN.get()
+
+
+def _end(current, error=None):
+    current.end = time.time_ns()
+    if error is not None:
+        current.error = type(error).__name__
+    current.context.trace.finish(current)
+
+
+@contextlib.contextmanager
+def span(name, kind=KIND_INTERNAL, **attributes):
+    """
+    Context manager recording the enclosed block as a child of the span in
+    progress. Nothing is recorded if the current context is not being traced.
+
+    :param str name: span name
+    :param int kind: KIND_INTERNAL or KIND_CLIENT
+    :return: the span, or None if not traced
+    """
+    parent = _SPAN.get()
+    if parent is None:
+        yield None
+        return
+    current = Span(parent.context.trace, name, parent_id=parent.context.span_id, kind=kind, attributes=attributes)
+    token = _SPAN.set(current)
+    try:
+        yield current
+    except Exception as err:
+        _end(current, err)
+        raise
+    else:
+        _end(current)
+    finally:
+        _SPAN.reset(token)
+
+
+def _write(target, line):
+    if target == 'stdout':
+        sys.stdout.write(line)
+        sys.stdout.flush()
+        return
+    # A single write to a file opened for appending, so processes sharing the file do not interleave lines. The
+    # file is reopened each time so that it can be rotated.
+    descriptor = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        os.write(descriptor, line.encode('utf-8'))
+    finally:
+        os.close(descriptor)
+
+
+def export(spans):
+    """
+    Write spans to TRACE_EXPORT as one line of OTLP/JSON.
+
+    :param list spans: finished spans
+    """
+    target = app.config.get('TRACE_EXPORT')
+    if not spans or not target:
+        return
+    document = {'resourceSpans': [{
+        'resource': {'attributes': [
+            _attribute('service.name', 'ngwmn-ui'),
+            _attribute('service.version', __version__),
+            _attribute('process.pid', os.getpid())
+        ]},
+        'scopeSpans': [{
+            'scope': {'name': 'ngwmn', 'version': __version__},
+            'spans': [current.to_otlp() for current in spans]
+        }]
+    }]}
+    line = json.dumps(document, separators=(',', ':')) + '\n'
+    try:
+        with _export_lock:
+            _write(target, line)
+    except OSError as err:
+        app.logger.warning('Could not export trace to %s: %s', target, err)
@@ -5,6 +5,10 @@ pytest fixtures.
 import pytest
 
 from ngwmn import app as my_app
+from ngwmn.services.cache import reset_cache
+from ngwmn.services.http_client import reset_guards
+from ngwmn.services.classification import reset_memo
+from ngwmn.services.lithology_index import reset_index
 
 
 @pytest.fixture
@@ -14,3 +18,23 @@ def app():
     testing helpers.
     """
     return my_app
+
+
+@pytest.fixture(autouse=True)
+def clear_cache(monkeypatch, tmp_path):
+    """
+    Start every test with an empty upstream response cache, a fresh
+    lithology classification memo and index, and closed circuit breakers.
+    On-disk stores are kept in a temporary directory.
+    """
+    monkeypatch.setitem(my_app.config, 'CACHE_SQLITE_PATH', str(tmp_path / 'cache.sqlite'))
+    monkeypatch.setitem(my_app.config, 'LITHOLOGY_MEMO_PATH', None)
+    reset_cache()
+    reset_memo()
+    reset_index()
+    reset_guards()
+    yield
+    reset_cache()
+    reset_memo()
+    reset_index()
+    reset_guards()
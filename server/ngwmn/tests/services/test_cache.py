@@ -0,0 +1,346 @@
+"""
+Unit tests for the upstream response cache.
+"""
+
+import os
+import sqlite3
+import tempfile
+import time
+from unittest import TestCase, mock
+
+from ngwmn import app
+from ngwmn.services import ServiceException
+from ngwmn.services.cache import (
+    MISSING, MemoryCache, SQLiteCache, cache_key, cached, get_cache, get_refresh_executor, reset_cache, skip_store)
+from ngwmn.services.concurrency import bounded_by, get_executor
+from ngwmn.services.resilience import UpstreamUnavailable
+
+
+class CacheBackendTests:
+    # pylint: disable=no-member
+
+    def test_get_missing(self):
+        self.assertIs(self.cache.get('missing'), MISSING)
+
+    def test_set_get(self):
+        self.cache.set('key', {'a': [1, 2]}, 60)
+        self.assertEqual(self.cache.get('key'), {'a': [1, 2]})
+
+    def test_none_value(self):
+        self.cache.set('key', None, 60)
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_expiry(self):
+        self.cache.set('key', 'value', 60)
+        with mock.patch('ngwmn.services.cache.time.time', return_value=time.time() + 61):
+            self.assertIs(self.cache.get('key'), MISSING)
+
+    def test_lru_eviction(self):
+        self.cache.set('a', 1, 60)
+        self.cache.set('b', 2, 60)
+        with mock.patch('ngwmn.services.cache.time.time', return_value=time.time() + 1):
+            self.cache.get('a')
+            self.cache.set('c', 3, 60)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertIs(self.cache.get('b'), MISSING)
+        self.assertEqual(self.cache.get('c'), 3)
+
+    def test_delete_clear(self):
+        self.cache.set('a', 1, 60)
+        self.cache.set('b', 2, 60)
+        self.cache.delete('a')
+        self.assertIs(self.cache.get('a'), MISSING)
+        self.cache.clear()
+        self.assertIs(self.cache.get('b'), MISSING)
+
+
+class TestMemoryCache(CacheBackendTests, TestCase):
+
+    def setUp(self):
+        self.cache = MemoryCache(max_entries=2)
+
+
+class TestSQLiteCache(CacheBackendTests, TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'cache.sqlite')
+        self.cache = SQLiteCache(self.path, max_entries=2)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_shared_file(self):
+        self.cache.set('key', 'value', 60)
+        self.assertEqual(SQLiteCache(self.path).get('key'), 'value')
+
+    def test_locked(self):
+        self.cache.set('key', 'value', 60)
+        locked = sqlite3.OperationalError('database is locked')
+        with mock.patch.object(self.cache, '_connection') as connection:
+            connection.return_value.execute.side_effect = locked
+            with self.assertLogs(app.logger, 'WARNING'):
+                self.assertIs(self.cache.get('key'), MISSING)
+            with self.assertLogs(app.logger, 'WARNING'):
+                self.cache.set('other', 'value', 60)
+        self.assertEqual(self.cache.get('key'), 'value')
+        self.assertIs(self.cache.get('other'), MISSING)
+
+
+class TestGetCache(TestCase):
+
+    def test_backends(self):
+        with mock.patch.dict(app.config, {'CACHE_BACKEND': 'memory'}):
+            reset_cache()
+            self.assertIsInstance(get_cache(), MemoryCache)
+            self.assertIs(get_cache(), get_cache())
+        with mock.patch.dict(app.config, {'CACHE_BACKEND': None}):
+            reset_cache()
+            self.assertIsNone(get_cache())
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch.object(app, 'instance_path', os.path.join(directory, 'instance')), \
+                mock.patch.dict(app.config, {'CACHE_BACKEND': 'sqlite', 'CACHE_SQLITE_PATH': None}):
+            reset_cache()
+            self.assertEqual(get_cache().path, os.path.join(directory, 'instance', 'ngwmn_ui_cache.sqlite'))
+            reset_cache()
+        with mock.patch.dict(app.config, {'CACHE_BACKEND': 'bogus'}):
+            reset_cache()
+            with self.assertRaises(ValueError):
+                get_cache()
+
+
+class TestCached(TestCase):
+
+    def setUp(self):
+        self.calls = []
+
+        @cached('test')
+        def fetch(*args, **kwargs):
+            self.calls.append((args, kwargs))
+            return kwargs.get('result', ['value'])
+
+        self.fetch = fetch
+
+    def test_cache_key(self):
+        self.assertEqual(cache_key('iddata', 'well_log', 'USGS', '1', root='x'), 'iddata:well_log|USGS|1|root=x')
+
+    def test_hit(self):
+        with mock.patch.dict(app.config, {'CACHE_BACKEND': 'memory', 'CACHE_TTL': {'test': 60}}):
+            self.assertEqual(self.fetch('a'), ['value'])
+            self.assertEqual(self.fetch('a'), ['value'])
+            self.fetch('b')
+        self.assertEqual(len(self.calls), 2)
+
+    def test_empty_cached_briefly(self):
+        with mock.patch.dict(app.config, {'CACHE_BACKEND': 'memory', 'CACHE_TTL': {'test': 60},
+                                          'CACHE_NEGATIVE_TTL': 10}):
+            self.assertIsNone(self.fetch('a', result=None))
+            self.assertIsNone(self.fetch('a', result=None))
+            self.assertEqual(len(self.calls), 1)
+            with mock.patch('ngwmn.services.cache.time.time', return_value=time.time() + 20):
+                self.fetch('a', result=None)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_empty_not_cached(self):
+        with mock.patch.dict(app.config, {'CACHE_BACKEND': 'memory', 'CACHE_TTL': {'test': 60},
+                                          'CACHE_NEGATIVE_TTL': None}):
+            self.fetch('a', result=None)
+            self.fetch('a', result=None)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_no_ttl(self):
+        with mock.patch.dict(app.config, {'CACHE_BACKEND': 'memory', 'CACHE_TTL': {}}):
+            self.fetch('a')
+            self.fetch('a')
+        self.assertEqual(len(self.calls), 2)
+
+    def test_skip_store(self):
+        @cached('inner')
+        def inner(incomplete):
+            self.calls.append('inner')
+            if incomplete:
+                skip_store()
+            return ['inner']
+
+        @cached('outer')
+        def outer(incomplete):
+            self.calls.append('outer')
+            return inner(incomplete)
+
+        with mock.patch.dict(app.config, {'CACHE_BACKEND': 'memory', 'CACHE_TTL': {'inner': 60, 'outer': 60}}):
+            self.assertEqual(outer(True), ['inner'])
+            self.assertEqual(outer(True), ['inner'])
+            self.assertEqual(self.calls, ['outer', 'inner'] * 2)
+            outer(False)
+            outer(False)
+        self.assertEqual(self.calls, ['outer', 'inner'] * 3)
+
+
+class TestCachedErrors(TestCase):
+
+    def setUp(self):
+        self.errors = []
+
+        @cached('test')
+        def fetch(*args):
+            self.errors.append(args)
+            raise self.error
+
+        self.fetch = fetch
+        self.error = ServiceException(message='upstream failed', status_code=502)
+        self.config = mock.patch.dict(app.config, {
+            'CACHE_BACKEND': 'memory', 'CACHE_TTL': {'test': 60}, 'CACHE_ERROR_TTL': 30})
+        self.config.start()
+        self.addCleanup(self.config.stop)
+
+    def test_error_cached(self):
+        for _ in range(2):
+            with self.assertRaises(ServiceException) as raised:
+                self.fetch('a')
+            self.assertEqual((raised.exception.message, raised.exception.status_code), ('upstream failed', 502))
+        self.assertEqual(len(self.errors), 1)
+        with mock.patch('ngwmn.services.cache.time.time', return_value=time.time() + 40), \
+                self.assertRaises(ServiceException):
+            self.fetch('a')
+        self.assertEqual(len(self.errors), 2)
+
+    def _assert_not_cached(self):
+        for _ in range(2):
+            with self.assertRaises(ServiceException):
+                self.fetch('a')
+        self.assertEqual(len(self.errors), 2)
+
+    def test_disabled(self):
+        with mock.patch.dict(app.config, {'CACHE_ERROR_TTL': 0}):
+            self._assert_not_cached()
+
+    def test_unavailable_not_cached(self):
+        self.error = UpstreamUnavailable('fake.com', 'circuit_open')
+        self._assert_not_cached()
+
+    def test_client_error_not_cached(self):
+        self.error = ServiceException(status_code=404)
+        self._assert_not_cached()
+
+    def test_past_deadline_not_cached(self):
+        self.error = ServiceException(message='timed out waiting for backing service', status_code=504)
+        with bounded_by(time.monotonic() - 1):
+            self._assert_not_cached()
+
+
+class TestStaleWhileRevalidate(TestCase):
+
+    def setUp(self):
+        self.values = iter(['first', 'second', 'third'])
+        self.calls = []
+
+        @cached('test')
+        def fetch(*args):
+            self.calls.append(args)
+            return next(self.values)
+
+        self.fetch = fetch
+        self.config = mock.patch.dict(app.config, {
+            'CACHE_BACKEND': 'memory',
+            'CACHE_TTL': {'test': 60},
+            'CACHE_STALE_TTL': {'test': 600},
+            'CACHE_HOT_THRESHOLD': 3,
+            'CACHE_REFRESH_AHEAD': 0.5
+        })
+        self.config.start()
+        # Run background refreshes inline so their effect can be asserted on
+        self.executor = mock.patch('ngwmn.services.cache.get_refresh_executor')
+        self.executor.start().return_value.submit.side_effect = lambda func: func()
+
+    def tearDown(self):
+        self.executor.stop()
+        self.config.stop()
+
+    def _later(self, seconds):
+        return mock.patch('ngwmn.services.cache.time.time', return_value=time.time() + seconds)
+
+    def test_fresh(self):
+        self.assertEqual(self.fetch('a'), 'first')
+        self.assertEqual(self.fetch('a'), 'first')
+        self.assertEqual(len(self.calls), 1)
+
+    def test_stale_served_while_refreshed(self):
+        self.fetch('a')
+        with self._later(120):
+            self.assertEqual(self.fetch('a'), 'first')
+            self.assertEqual(len(self.calls), 2)
+            self.assertEqual(self.fetch('a'), 'second')
+
+    def test_past_stale_ttl(self):
+        self.fetch('a')
+        with self._later(700):
+            self.assertEqual(self.fetch('a'), 'second')
+        self.assertEqual(len(self.calls), 2)
+
+    def test_hot_refreshed_ahead(self):
+        self.fetch('a')
+        with self._later(40):
+            self.fetch('a')
+            self.fetch('a')
+            self.assertEqual(len(self.calls), 1, 'Cold entries are not refreshed before they expire')
+            self.assertEqual(self.fetch('a'), 'first')
+            self.assertEqual(len(self.calls), 2, 'Hot entries are refreshed before they expire')
+            self.assertEqual(self.fetch('a'), 'second')
+
+    def test_refresh_bypasses_nested_cache(self):
+        inner_values = iter(['inner-1', 'inner-2'])
+
+        @cached('inner')
+        def inner():
+            return next(inner_values)
+
+        @cached('test')
+        def outer():
+            return inner()
+
+        with mock.patch.dict(app.config, {'CACHE_TTL': {'test': 60, 'inner': 6000}}):
+            self.assertEqual(outer(), 'inner-1')
+            with self._later(120):
+                outer()
+                self.assertEqual(outer(), 'inner-2')
+
+    def test_failed_refresh_keeps_stale(self):
+        self.fetch('a')
+        self.values = iter([])
+        with self._later(120):
+            self.assertEqual(self.fetch('a'), 'first')
+            self.assertEqual(self.fetch('a'), 'first')
+
+    def test_empty_not_served_stale(self):
+        self.values = iter([None, 'found'])
+        with mock.patch.dict(app.config, {'CACHE_NEGATIVE_TTL': 10}):
+            self.assertIsNone(self.fetch('a'))
+            self.assertIsNone(self.fetch('a'))
+            self.assertEqual(len(self.calls), 1)
+            with self._later(20):
+                self.assertEqual(self.fetch('a'), 'found')
+        self.assertEqual(len(self.calls), 2)
+
+    def test_pending_refreshes_capped(self):
+        # Hold refreshes as if the refresh pool were busy
+        pending = []
+        self.executor.stop()
+        self.executor = mock.patch('ngwmn.services.cache.get_refresh_executor')
+        self.executor.start().return_value.submit.side_effect = pending.append
+        self.values = iter(['a1', 'b1', 'c1'])
+        for key in ('a', 'b', 'c'):
+            self.fetch(key)
+        with mock.patch.dict(app.config, {'CACHE_REFRESH_MAX_PENDING': 2}), self._later(120):
+            for key in ('a', 'b', 'c', 'a'):
+                self.fetch(key)
+            self.assertEqual(len(pending), 2)
+            self.values = iter(['a2', 'b2'])
+            for refresh in pending:
+                refresh()
+            self.fetch('c')
+        self.assertEqual(len(pending), 3)
+
+    def test_refresh_executor(self):
+        self.executor.stop()
+        self.executor.start()
+        self.assertIsNot(get_refresh_executor(), get_executor())
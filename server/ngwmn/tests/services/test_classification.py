@@ -0,0 +1,159 @@
+"""
+Tests for the memoized lithology classification
+"""
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+import json
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+from unittest import TestCase, mock
+
+import webcolors
+
+from ngwmn import app
+from ngwmn.services.cache import MISSING
+from ngwmn.services.classification import (
+    ClassificationMemo, classify_descriptions, get_memo, normalize, shutdown_pool)
+from ngwmn.services.lithology_index import write_index
+from ngwmn.services.lithology_parser import classify_material, parse_descriptions
+
+
+class TestClassificationMemo(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'lithology.sqlite')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_counts(self):
+        memo = ClassificationMemo()
+        self.assertIs(memo.get(('clay',)), MISSING)
+        memo.set(('clay',), {'colors': [], 'materials': [620]})
+        self.assertEqual(memo.get(('clay',)), {'colors': [], 'materials': [620]})
+        self.assertEqual(memo.stats(), {'hits': 1, 'misses': 1})
+
+    def test_lru(self):
+        memo = ClassificationMemo(max_entries=1)
+        memo.set(('clay',), {'materials': [620]})
+        memo.set(('sand',), {'materials': [607]})
+        self.assertIs(memo.get(('clay',)), MISSING)
+
+    def test_persistent(self):
+        ClassificationMemo(path=self.path).set(('brown', 'clay'), {'colors': ['#a52a2a'], 'materials': [620]})
+        memo = ClassificationMemo(path=self.path)
+        self.assertEqual(memo.get(('brown', 'clay')), {'colors': ['#a52a2a'], 'materials': [620]})
+
+    def test_stored_as_json(self):
+        ClassificationMemo(path=self.path).set(('clay',), {'colors': [], 'materials': [620]})
+        with sqlite3.connect(self.path) as connection:
+            (value,), = connection.execute('SELECT value FROM cache').fetchall()
+        self.assertEqual(json.loads(value), {'colors': [], 'materials': [620]})
+
+        # Values that are not JSON, e.g. pickles, are never decoded
+        with sqlite3.connect(self.path) as connection:
+            connection.execute('UPDATE cache SET value = ?', (sqlite3.Binary(pickle.dumps({'materials': [1]})),))
+        self.assertIs(ClassificationMemo(path=self.path).get(('clay',)), MISSING)
+
+    def test_clear(self):
+        memo = ClassificationMemo(path=self.path)
+        memo.set(('clay',), {'materials': [620]})
+        memo.clear()
+        self.assertIs(memo.get(('clay',)), MISSING)
+        self.assertIs(ClassificationMemo(path=self.path).get(('clay',)), MISSING)
+
+
+@mock.patch.dict(app.config, {'LITHOLOGY_MEMO_PATH': None})
+class TestClassifyDescriptions(TestCase):
+
+    def test_classify(self):
+        result = classify_descriptions([['brown', 'clay'], []])
+        self.assertEqual(result, [
+            {'colors': [webcolors.CSS3_NAMES_TO_HEX['brown']], 'materials': classify_material(['brown', 'clay'])},
+            {'colors': [], 'materials': []}
+        ])
+
+    def test_memoized(self):
+        with mock.patch('ngwmn.services.classification.parse_descriptions',
+                        side_effect=lambda descriptions: [{'colors': [], 'materials': [620]}
+                                                          for _ in descriptions]) as parse:
+            classify_descriptions([['Clay'], ['clay'], ['sand']])
+            result = classify_descriptions([['clay']])
+        self.assertEqual(result, [{'colors': [], 'materials': [620]}])
+        parse.assert_called_once_with([('clay',), ('sand',)])
+        self.assertEqual(get_memo().stats(), {'hits': 1, 'misses': 2})
+
+    def test_index(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'index.sqlite')
+            write_index(path, [(('clay',), {'colors': [], 'materials': [601]})])
+            with mock.patch.dict(app.config, {'LITHOLOGY_INDEX_PATH': path}):
+                result = classify_descriptions([['clay'], ['clay']])
+        self.assertEqual(result, [{'colors': [], 'materials': [601]}] * 2)
+
+    def test_normalize(self):
+        self.assertEqual(normalize(['Brown', 'CLAY']), ('brown', 'clay'))
+
+
+@mock.patch.dict(app.config, {'LITHOLOGY_MEMO_PATH': None, 'LITHOLOGY_PROCESS_POOL': True,
+                              'LITHOLOGY_PROCESSES': 1, 'LITHOLOGY_TIMEOUT': 0.05})
+class TestProcessPool(TestCase):
+
+    def setUp(self):
+        self.descriptions = [['red', 'clay'], ['fine', 'sand']]
+        self.degraded = [{'colors': [webcolors.CSS3_NAMES_TO_HEX['red']], 'materials': []},
+                         {'colors': [], 'materials': []}]
+
+    def tearDown(self):
+        shutdown_pool()
+
+    @mock.patch.dict(app.config, {'LITHOLOGY_TIMEOUT': 30})
+    def test_pool(self):
+        expected = parse_descriptions(self.descriptions)
+        self.assertEqual(classify_descriptions(self.descriptions), expected)
+        self.assertEqual(get_memo().get(('fine', 'sand')), expected[1])
+
+    @mock.patch('ngwmn.services.classification.get_pool')
+    def test_saturated(self, mock_pool):
+        mock_pool.return_value = (mock.Mock(), threading.BoundedSemaphore(1))
+        mock_pool.return_value[1].acquire()
+        with mock.patch('ngwmn.services.classification.skip_store') as mock_skip:
+            self.assertEqual(classify_descriptions(self.descriptions), self.degraded)
+        mock_skip.assert_called_once_with()
+        mock_pool.return_value[0].submit.assert_not_called()
+
+    @mock.patch('ngwmn.services.classification.get_pool')
+    def test_timeout(self, mock_pool):
+        future = Future()
+        slots = threading.BoundedSemaphore(1)
+        mock_pool.return_value = (mock.Mock(**{'submit.return_value': future}), slots)
+        self.assertEqual(classify_descriptions(self.descriptions), self.degraded)
+
+        # The late result is memoized, and frees the pool's slot
+        future.set_result(parse_descriptions([('red', 'clay'), ('fine', 'sand')]))
+        self.assertEqual(classify_descriptions(self.descriptions), parse_descriptions(self.descriptions))
+        self.assertTrue(slots.acquire(blocking=False))
+
+    def _assert_parsed_in_process(self, mock_pool, error):
+        slots = threading.BoundedSemaphore(1)
+        mock_pool.return_value = (mock.Mock(**{'submit.side_effect': error}), slots)
+        with mock.patch('ngwmn.services.classification.skip_store') as mock_skip:
+            self.assertEqual(classify_descriptions(self.descriptions), parse_descriptions(self.descriptions))
+        mock_skip.assert_not_called()
+        self.assertTrue(slots.acquire(blocking=False), 'The slot is released')
+
+    @mock.patch('ngwmn.services.classification.shutdown_pool')
+    @mock.patch('ngwmn.services.classification.get_pool')
+    def test_submit_after_shutdown(self, mock_pool, mock_shutdown):
+        self._assert_parsed_in_process(mock_pool, RuntimeError('cannot schedule new futures after shutdown'))
+        mock_shutdown.assert_not_called()
+
+    @mock.patch('ngwmn.services.classification.shutdown_pool')
+    @mock.patch('ngwmn.services.classification.get_pool')
+    def test_submit_to_broken_pool(self, mock_pool, mock_shutdown):
+        self._assert_parsed_in_process(mock_pool, BrokenProcessPool())
+        mock_shutdown.assert_called_once_with()
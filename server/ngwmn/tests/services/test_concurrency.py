@@ -0,0 +1,92 @@
+"""
+Unit tests for the concurrent service call helpers.
+"""
+
+import threading
+from unittest import TestCase, mock
+
+from ngwmn import app
+from ngwmn.services import ServiceException
+from ngwmn.services.concurrency import bounded_by, completed, current_deadline, deadline, earliest, partial_result, \
+    remaining, result, submit
+
+
+class TestSubmit(TestCase):
+
+    def test_concurrent(self):
+        with mock.patch.dict(app.config, {'CONCURRENT_FETCH': True}):
+            future = submit(lambda: threading.current_thread().name)
+            self.assertTrue(result(future, deadline(5)).startswith('ngwmn-upstream'))
+
+    def test_inline(self):
+        with mock.patch.dict(app.config, {'CONCURRENT_FETCH': False}):
+            future = submit(lambda: threading.current_thread().name)
+            self.assertTrue(future.done())
+            self.assertEqual(result(future), threading.current_thread().name)
+
+    def test_inline_exception(self):
+        def fail():
+            raise ServiceException(status_code=500)
+
+        with mock.patch.dict(app.config, {'CONCURRENT_FETCH': False}):
+            future = submit(fail)
+            with self.assertRaises(ServiceException) as context:
+                result(future)
+            self.assertEqual(context.exception.status_code, 500)
+
+
+class TestResult(TestCase):
+
+    def test_deadline_exceeded(self):
+        release = threading.Event()
+        with mock.patch.dict(app.config, {'CONCURRENT_FETCH': True}):
+            future = submit(release.wait, 5)
+            try:
+                with self.assertRaises(ServiceException) as context:
+                    result(future, deadline(0.01))
+                self.assertEqual(context.exception.status_code, 504)
+            finally:
+                release.set()
+
+    def test_no_deadline(self):
+        self.assertIsNone(deadline(None))
+        self.assertIsNone(remaining(None))
+        self.assertEqual(remaining(deadline(-1)), 0)
+
+    def test_earliest(self):
+        self.assertIsNone(earliest(None, None))
+        self.assertEqual(earliest(None, 5, 3), 3)
+
+
+class TestPartialResult(TestCase):
+
+    def test_ready(self):
+        self.assertEqual(partial_result(completed({'a': 1}), deadline(1), 'statistics'), {'a': 1})
+
+    def test_late(self):
+        release = threading.Event()
+        with mock.patch.dict(app.config, {'CONCURRENT_FETCH': True}):
+            future = submit(release.wait, 5)
+            try:
+                self.assertIsNone(partial_result(future, deadline(0.01), 'statistics'))
+            finally:
+                release.set()
+        # The call was left to complete
+        self.assertTrue(future.result(5))
+
+    def test_error(self):
+        def fail():
+            raise ServiceException()
+
+        with mock.patch.dict(app.config, {'CONCURRENT_FETCH': False}):
+            self.assertIsNone(partial_result(submit(fail), None, 'statistics'))
+
+
+class TestBoundedBy(TestCase):
+
+    def test_deadline_carries_over(self):
+        until = deadline(5)
+        with mock.patch.dict(app.config, {'CONCURRENT_FETCH': True}), bounded_by(until):
+            self.assertEqual(current_deadline(), until)
+            self.assertEqual(result(submit(current_deadline)), until)
+        self.assertIsNone(current_deadline())
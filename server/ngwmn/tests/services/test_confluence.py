@@ -6,7 +6,7 @@ from unittest import TestCase, mock
 from config import CONFLUENCE_URL
 import requests_mock
 
-from ngwmn.services.confluence import requests, pull_feed, confluence_url
+from ngwmn.services.confluence import pull_feed, confluence_url
 
 
 class TestPullFeed(TestCase):
@@ -19,7 +19,7 @@ class TestPullFeed(TestCase):
         # should return the empty string if the server has an error
         self.assertEqual(expect, actual)
 
-    @mock.patch('ngwmn.services.confluence.requests')
+    @mock.patch('ngwmn.services.confluence.http_client')
     def test_mock_good_url(self, mock_request):
         expect = MOCK_PAGE
         mock_request.get.return_value = MOCK_RESPONSE()
@@ -27,6 +27,15 @@ class TestPullFeed(TestCase):
         # should return the mock page if from the server (mocked up)
         self.assertEqual(expect, actual)
 
+    @mock.patch('ngwmn.services.confluence.http_client')
+    def test_cached(self, mock_request):
+        mock_request.get.return_value = MOCK_RESPONSE()
+        pull_feed('http:fakeserver.com/A/main')
+        actual = pull_feed('http:fakeserver.com/A/main')
+        # the second request should be served from the cache
+        self.assertEqual(MOCK_PAGE, actual)
+        self.assertEqual(mock_request.get.call_count, 1)
+
 
 class TestConfluenceUrl(TestCase):
 
@@ -0,0 +1,235 @@
+"""
+Unit tests for the pooled HTTP client.
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+from unittest import TestCase, mock
+
+import requests
+import requests_mock
+
+from ngwmn import app
+from ngwmn.services import ServiceException, http_client
+from ngwmn.services.concurrency import bounded_by, deadline
+from ngwmn.services.resilience import BreakerPolicy, CircuitBreaker, UpstreamUnavailable
+
+
+class TestGetSession(TestCase):
+
+    def tearDown(self):
+        http_client.close_sessions()
+
+    def test_one_session_per_host(self):
+        session = http_client.get_session('https://fake.gov/a/b')
+        self.assertIs(session, http_client.get_session('https://fake.gov/c?d=e'))
+        self.assertIsNot(session, http_client.get_session('https://fake.gov/a/b', retries=False))
+        self.assertIsNot(session, http_client.get_session('http://fake.gov/a/b'))
+        self.assertIsNot(session, http_client.get_session('https://other.gov/a/b'))
+
+    def test_adapter_configuration(self):
+        config = {'HTTP_POOL_MAXSIZE': 7, 'HTTP_RETRIES': 3, 'HTTP_RETRY_STATUSES': (503,)}
+        with mock.patch.dict(app.config, config):
+            adapter = http_client.get_session('https://fake.gov').get_adapter('https://fake.gov')
+            without_retries = http_client.get_session('https://fake.gov', retries=False).get_adapter('https://fake.gov')
+        self.assertEqual(adapter._pool_maxsize, 7)  # pylint: disable=protected-access
+        self.assertEqual(adapter.max_retries.total, 3)
+        self.assertEqual(adapter.max_retries.status_forcelist, (503,))
+        self.assertEqual(without_retries.max_retries.total, 0)
+
+    def test_close_sessions(self):
+        session = http_client.get_session('https://fake.gov')
+        http_client.close_sessions()
+        self.assertIsNot(session, http_client.get_session('https://fake.gov'))
+
+
+class TestRequest(TestCase):
+
+    def test_default_timeout(self):
+        config = {'HTTP_CONNECT_TIMEOUT': 2, 'HTTP_READ_TIMEOUT': 9}
+        with mock.patch.dict(app.config, config), \
+                mock.patch.object(requests.Session, 'request') as m_request:
+            http_client.get('https://fake.gov/path', params={'a': 'b'})
+        m_request.assert_called_with('GET', 'https://fake.gov/path', params={'a': 'b'}, timeout=(2, 9))
+
+    def test_deadline(self):
+        config = {'HTTP_CONNECT_TIMEOUT': 2, 'HTTP_READ_TIMEOUT': 9}
+        with mock.patch.dict(app.config, config), \
+                mock.patch.object(requests.Session, 'request') as m_request:
+            with bounded_by(deadline(4)):
+                http_client.get('https://fake.gov/path')
+            connect, read = m_request.call_args[1]['timeout']
+            self.assertEqual(connect, 2)
+            self.assertTrue(3 < read <= 4)
+
+            with bounded_by(deadline(0)), self.assertRaises(ServiceException) as context:
+                http_client.get('https://fake.gov/path')
+            self.assertEqual(context.exception.status_code, 504)
+            self.assertEqual(m_request.call_count, 1)
+
+    def test_explicit_timeout(self):
+        with mock.patch.object(requests.Session, 'request') as m_request:
+            http_client.post('https://fake.gov/path', data={'a': 'b'}, timeout=1)
+        m_request.assert_called_with('POST', 'https://fake.gov/path', data={'a': 'b'}, timeout=1)
+
+    def test_response(self):
+        with requests_mock.mock() as req:
+            req.get('https://fake.gov/path', text='content')
+            self.assertEqual(http_client.get('https://fake.gov/path').text, 'content')
+
+
+class _SlowHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Answer after a second, slower than the tests' read timeouts."""
+        time.sleep(1)
+        try:
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(b'late')
+        except OSError:
+            # The client gave up waiting
+            pass
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+@mock.patch.dict(app.config, {'HTTP_CONNECT_TIMEOUT': 2, 'HTTP_READ_TIMEOUT': 0.3, 'HTTP_RETRIES': 2,
+                              'HTTP_RETRY_BACKOFF': 0.5, 'HTTP_BREAKER_ENABLED': True, 'HTTP_BREAKER_WINDOW': 4,
+                              'HTTP_BREAKER_MIN_CALLS': 1, 'HTTP_BREAKER_FAILURE_RATE': 0.5,
+                              'HTTP_HOST_MAX_CONCURRENCY': None})
+class TestSlowUpstream(TestCase):
+
+    def setUp(self):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), _SlowHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.addCleanup(http_client.close_sessions)
+        self.url = 'http://127.0.0.1:{0}/slow'.format(server.server_address[1])
+
+    def test_deadline_not_extended_by_retries(self):
+        with mock.patch.dict(app.config, {'HTTP_READ_TIMEOUT': 30}):
+            start = time.monotonic()
+            with bounded_by(deadline(0.2)), self.assertRaises(ServiceException) as context:
+                http_client.get(self.url)
+            self.assertLessEqual(time.monotonic() - start, 0.2 + 0.15)
+        self.assertEqual(context.exception.status_code, 504)
+        # The host was only too slow for what was left of the deadline, so it is not held against it
+        self.assertEqual(http_client.get_guard(self.url).breaker.state, CircuitBreaker.CLOSED)
+
+    def test_retried_timeouts(self):
+        with self.assertRaises(ServiceException) as context:
+            http_client.get(self.url)
+        self.assertEqual(context.exception.status_code, 504)
+        self.assertEqual(http_client.get_guard(self.url).breaker.state, CircuitBreaker.OPEN)
+
+
+@mock.patch.dict(app.config, {'HTTP_BREAKER_ENABLED': True, 'HTTP_BREAKER_WINDOW': 4, 'HTTP_BREAKER_MIN_CALLS': 4,
+                              'HTTP_BREAKER_FAILURE_RATE': 0.5, 'HTTP_BREAKER_OPEN_SECONDS': 30,
+                              'HTTP_BREAKER_PROBES': 1, 'HTTP_BREAKER_STATUSES': (500, 503),
+                              'HTTP_HOST_MAX_CONCURRENCY': None})
+class TestCircuitBreaker(TestCase):
+
+    @requests_mock.Mocker()
+    def test_opens_on_failure_rate(self, mocker):
+        mocker.get('https://fake.gov/ok', text='ok')
+        mocker.get('https://fake.gov/error', status_code=500)
+        mocker.get('https://other.gov/ok', text='ok')
+        for path in ('ok', 'error', 'ok', 'error'):
+            http_client.get('https://fake.gov/' + path)
+
+        with self.assertRaises(UpstreamUnavailable) as context:
+            http_client.get('https://fake.gov/ok')
+        self.assertEqual(context.exception.status_code, 503)
+        self.assertEqual(context.exception.reason, 'circuit_open')
+        self.assertEqual(mocker.call_count, 4)
+        # Other hosts are unaffected
+        self.assertEqual(http_client.get('https://other.gov/ok').text, 'ok')
+
+    @requests_mock.Mocker()
+    def test_not_found_is_not_a_failure(self, mocker):
+        mocker.get('https://fake.gov/missing', status_code=404)
+        for _ in range(6):
+            self.assertEqual(http_client.get('https://fake.gov/missing').status_code, 404)
+
+    @requests_mock.Mocker()
+    def test_transport_errors(self, mocker):
+        mocker.get('https://fake.gov/refused', exc=requests.exceptions.ConnectionError)
+        mocker.get('https://fake.gov/slow', exc=requests.exceptions.ReadTimeout)
+        with self.assertRaises(ServiceException) as context:
+            http_client.get('https://fake.gov/refused')
+        self.assertEqual(context.exception.status_code, 503)
+        with self.assertRaises(ServiceException) as context:
+            http_client.get('https://fake.gov/slow')
+        self.assertEqual(context.exception.status_code, 504)
+        for _ in range(2):
+            with self.assertRaises(ServiceException):
+                http_client.get('https://fake.gov/slow')
+        self.assertEqual(http_client.get_guard('https://fake.gov').breaker.state, CircuitBreaker.OPEN)
+
+    @requests_mock.Mocker()
+    def test_half_open(self, mocker):
+        mocker.get('https://fake.gov/error', status_code=503)
+        mocker.get('https://fake.gov/ok', text='ok')
+        for _ in range(4):
+            http_client.get('https://fake.gov/error')
+        breaker = http_client.get_guard('https://fake.gov').breaker
+
+        with mock.patch('ngwmn.services.resilience.time.monotonic', return_value=time.monotonic() + 31):
+            # A failed probe reopens the breaker
+            http_client.get('https://fake.gov/error')
+            self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        with mock.patch('ngwmn.services.resilience.time.monotonic', return_value=time.monotonic() + 62):
+            self.assertEqual(http_client.get('https://fake.gov/ok').text, 'ok')
+            self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_probes_to_close(self):
+        breaker = CircuitBreaker('https://fake.gov', BreakerPolicy(window=1, min_calls=1, open_seconds=0, probes=2))
+        breaker.record(False)
+        for _ in range(2):
+            self.assertTrue(breaker.allow())
+        breaker.record(True)
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        breaker.record(True)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_one_probe_at_a_time(self):
+        breaker = CircuitBreaker('https://fake.gov', BreakerPolicy(window=2, min_calls=2, open_seconds=0, probes=1))
+        breaker.record(False)
+        breaker.record(False)
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertFalse(breaker.allow())
+        # A call that was not made frees the probe without deciding the state
+        breaker.record(None)
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(breaker.allow())
+
+
+@mock.patch.dict(app.config, {'HTTP_BREAKER_ENABLED': False, 'HTTP_HOST_MAX_CONCURRENCY': 1,
+                              'HTTP_BULKHEAD_WAIT': 0.01})
+class TestBulkhead(TestCase):
+
+    def test_limits_concurrent_calls(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_request(*args, **kwargs):  # pylint: disable=unused-argument
+            started.set()
+            release.wait(5)
+            return mock.Mock(status_code=200)
+
+        with mock.patch.object(requests.Session, 'request', side_effect=slow_request):
+            thread = threading.Thread(target=http_client.get, args=('https://fake.gov/slow',))
+            thread.start()
+            started.wait(5)
+            with self.assertRaises(UpstreamUnavailable) as context:
+                http_client.get('https://fake.gov/other')
+            self.assertEqual(context.exception.reason, 'bulkhead_full')
+            release.set()
+            thread.join()
+            http_client.get('https://fake.gov/other')
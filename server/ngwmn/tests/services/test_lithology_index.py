@@ -0,0 +1,90 @@
+"""
+Tests for the precomputed lithology classification index
+"""
+import os
+import sqlite3
+import tempfile
+from unittest import TestCase, mock
+
+from ngwmn import app
+from ngwmn.services.cache import MISSING
+from ngwmn.services.lithology_index import (
+    LithologyIndex, build_index, classify, collect_descriptions, get_index, write_index)
+from ngwmn.services.lithology_parser import parse_descriptions
+from ngwmn.xml_utils import parse_xml
+from .mock_data import MOCK_WELL_LOG_RESPONSE
+
+
+class TestLithologyIndex(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'index.sqlite')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_write_and_read(self):
+        write_index(self.path, [(('brown', 'clay'), {'colors': ['#a52a2a'], 'materials': [620]})])
+        index = LithologyIndex(self.path)
+        self.assertEqual(index.get(('brown', 'clay')), {'colors': ['#a52a2a'], 'materials': [620]})
+        self.assertIs(index.get(('clay',)), MISSING)
+
+    def test_rewrite(self):
+        write_index(self.path, [(('clay',), {'colors': [], 'materials': [620]})])
+        write_index(self.path, [(('sand',), {'colors': [], 'materials': [607]})])
+        index = LithologyIndex(self.path)
+        self.assertIs(index.get(('clay',)), MISSING)
+        self.assertEqual(index.get(('sand',)), {'colors': [], 'materials': [607]})
+
+    def test_other_classifier_version(self):
+        write_index(self.path, [(('clay',), {'colors': [], 'materials': [620]})])
+        connection = sqlite3.connect(self.path)
+        with connection:
+            connection.execute("UPDATE meta SET value = '0' WHERE name = 'classifier_version'")
+        connection.close()
+        self.assertIs(LithologyIndex(self.path).get(('clay',)), MISSING)
+
+    def test_get_index(self):
+        with mock.patch.dict(app.config, {'LITHOLOGY_INDEX_PATH': None}):
+            self.assertIsNone(get_index())
+
+    def test_get_index_missing_file(self):
+        with mock.patch.dict(app.config, {'LITHOLOGY_INDEX_PATH': self.path}):
+            self.assertIsNone(get_index())
+
+    def test_get_index_configured(self):
+        write_index(self.path, [])
+        with mock.patch.dict(app.config, {'LITHOLOGY_INDEX_PATH': self.path}):
+            self.assertIsInstance(get_index(), LithologyIndex)
+
+
+class TestBuildIndex(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'index.sqlite')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    @mock.patch('ngwmn.services.ngwmn.get_iddata')
+    @mock.patch('ngwmn.services.ngwmn.get_sites')
+    def test_collect_descriptions(self, mock_sites, mock_iddata):
+        mock_sites.return_value = [{'site_no': '1'}, {'site_no': '2'}, {'site_no': '3'}]
+        mock_iddata.side_effect = [parse_xml(MOCK_WELL_LOG_RESPONSE), None, ValueError()]
+        self.assertEqual(collect_descriptions(['USGS'], threads=1), {('sandstone',), ('siltstone',)})
+        mock_sites.assert_called_once_with('USGS')
+
+    def test_classify(self):
+        descriptions = {('sandstone',), ('fine', 'sand')}
+        expected = list(zip(sorted(descriptions), parse_descriptions(sorted(descriptions))))
+        self.assertEqual(classify(descriptions, processes=1), expected)
+        self.assertEqual(classify(descriptions, processes=2), expected)
+
+    @mock.patch('ngwmn.services.lithology_index.collect_descriptions')
+    def test_build_index(self, mock_collect):
+        mock_collect.return_value = {('sandstone',)}
+        self.assertEqual(build_index(self.path, ['USGS'], processes=1), 1)
+        self.assertEqual(LithologyIndex(self.path).get(('sandstone',)),
+                         {'colors': [], 'materials': [608, 609, 611, 612, 613]})
@@ -3,6 +3,7 @@ Tests for lithology string parsing.
 """
 
 import os
+from unittest import mock
 
 import webcolors
 
@@ -25,6 +26,46 @@ def test_classify_material():
     assert count == len(scores)
 
 
+def test_classify_material_rankings():
+    # Rankings are those of the fuzzywuzzy scorer this module used previously
+    assert lithology_parser.classify_material(['sandstone']) == [608, 609, 611, 612, 613]
+    assert lithology_parser.classify_material(['gray', 'shale']) == [622, 623, 624, 670, 671]
+    assert lithology_parser.classify_material(['coarse', 'gravel', 'and', 'sand']) == [601, 607, 608, 658, 733]
+    assert lithology_parser.classify_material(['fine', 'sand']) == [609, 611, 607, 634, 636]
+    assert lithology_parser.classify_material([]) == []
+
+
+def test_exact_phrases_not_fuzzy_matched():
+    # pylint: disable=protected-access
+    fuzzy_ranked = lithology_parser._fuzzy_classify(['sandstone', 'bedded sand'])
+    with mock.patch('ngwmn.services.lithology_parser._fuzzy_classify',
+                    wraps=lithology_parser._fuzzy_classify) as fuzzy_classify:
+        test = lithology_parser.parse_descriptions([['Sandstone'], ['bedded', 'sand'], ['gray', 'shale'],
+                                                    ['Gray', 'shale']])
+    # Exact lithology strings get the ranking fuzzy matching would give them
+    assert [parsed['materials'] for parsed in test[:2]] == fuzzy_ranked
+    assert test[0]['materials'] == [608, 609, 611, 612, 613]
+    # Repeated descriptions are scored once
+    fuzzy_classify.assert_called_once_with(['gray shale'])
+    assert test[2] == test[3]
+
+
+def test_parse_descriptions():
+    test = lithology_parser.parse_descriptions([['red', 'sandstone', 'red'], ['fine', 'sand'], []])
+    assert test == [
+        {'colors': [webcolors.CSS3_NAMES_TO_HEX['red']], 'materials': [608, 671, 609, 611, 612]},
+        {'colors': [], 'materials': [609, 611, 607, 634, 636]},
+        {'colors': [], 'materials': []}
+    ]
+
+
+def test_classify_materials():
+    descriptions = [['clay'], [], ['gray', 'shale'], ['clay']]
+    test = lithology_parser.classify_materials(descriptions)
+    assert test == [lithology_parser.classify_material(words) for words in descriptions]
+    assert lithology_parser.classify_materials([]) == []
+
+
 def test_get_colors():
     test = lithology_parser.get_colors(['red', 'sdf', 'orange', 'asdf'])
     assert set(test) == set([
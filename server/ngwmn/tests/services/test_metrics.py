@@ -0,0 +1,89 @@
+"""
+Unit tests for the Prometheus metrics.
+"""
+
+import tempfile
+from unittest import TestCase, mock
+
+from prometheus_client import REGISTRY
+
+from ngwmn import app
+from ngwmn.services.cache import cached
+from ngwmn.services.classification import classify_descriptions
+from ngwmn.services.metrics import exposition, observe_document, observe_request
+from ngwmn.services.timing import timed
+
+
+def _sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+@timed('metrics_test')
+@cached('metrics_test')
+def _fetch(value):
+    if value is None:
+        raise ValueError()
+    return value
+
+
+@mock.patch.dict(app.config, {'METRICS_ENABLED': True, 'CACHE_BACKEND': 'memory',
+                              'CACHE_TTL': {'metrics_test': 60}, 'LITHOLOGY_MEMO_PATH': None})
+class TestMetrics(TestCase):
+
+    def test_request(self):
+        before = _sample('ngwmn_request_duration_seconds_count', endpoint='site_page')
+        observe_request('site_page', 200, 0.3)
+        observe_request(None, 404, 0.01)
+        self.assertEqual(_sample('ngwmn_request_duration_seconds_count', endpoint='site_page'), before + 1)
+        self.assertGreaterEqual(_sample('ngwmn_requests_total', endpoint='unmatched', status='404'), 1)
+
+    def test_service_calls(self):
+        calls = _sample('ngwmn_service_call_duration_seconds_count', call='metrics_test')
+        errors = _sample('ngwmn_service_call_errors_total', call='metrics_test')
+        hits = _sample('ngwmn_cache_lookups_total', endpoint='metrics_test', outcome='hit')
+        misses = _sample('ngwmn_cache_lookups_total', endpoint='metrics_test', outcome='miss')
+
+        _fetch('a')
+        _fetch('a')
+        with self.assertRaises(ValueError):
+            _fetch(None)
+
+        self.assertEqual(_sample('ngwmn_service_call_duration_seconds_count', call='metrics_test'), calls + 3)
+        self.assertEqual(_sample('ngwmn_service_call_errors_total', call='metrics_test'), errors + 1)
+        self.assertEqual(_sample('ngwmn_cache_lookups_total', endpoint='metrics_test', outcome='hit'), hits + 1)
+        self.assertEqual(_sample('ngwmn_cache_lookups_total', endpoint='metrics_test', outcome='miss'), misses + 2)
+
+    def test_lithology(self):
+        parsed = _sample('ngwmn_lithology_descriptions_total', source='parsed')
+        memo = _sample('ngwmn_lithology_descriptions_total', source='memo')
+        timed_batches = _sample('ngwmn_lithology_classification_seconds_count', mode='inline')
+
+        classify_descriptions([['sandstone'], ['clay']])
+        classify_descriptions([['sandstone']])
+
+        self.assertEqual(_sample('ngwmn_lithology_descriptions_total', source='parsed'), parsed + 2)
+        self.assertEqual(_sample('ngwmn_lithology_descriptions_total', source='memo'), memo + 1)
+        self.assertEqual(_sample('ngwmn_lithology_classification_seconds_count', mode='inline'), timed_batches + 1)
+
+    def test_document(self):
+        before = _sample('ngwmn_xml_document_bytes_sum', request='well_log')
+        observe_document('well_log', 2048)
+        self.assertEqual(_sample('ngwmn_xml_document_bytes_sum', request='well_log'), before + 2048)
+
+    @mock.patch.dict(app.config, {'METRICS_ENABLED': False})
+    def test_disabled(self):
+        before = _sample('ngwmn_xml_document_bytes_count', request='well_log')
+        observe_document('well_log', 2048)
+        self.assertEqual(_sample('ngwmn_xml_document_bytes_count', request='well_log'), before)
+
+    def test_exposition(self):
+        content, content_type = exposition()
+        self.assertTrue(content_type.startswith('text/plain'))
+        self.assertIn(b'ngwmn_request_duration_seconds', content)
+
+    def test_multiprocess_exposition(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch.dict('os.environ', {'PROMETHEUS_MULTIPROC_DIR': directory}):
+            content, _ = exposition()
+        # Only metrics written to the directory by the worker processes are exposed
+        self.assertNotIn(b'ngwmn_request_duration_seconds', content)
@@ -3,16 +3,23 @@ Unit tests for data fetch utility functions
 """
 
 import copy
+import io
+import socket
+import time
 from unittest import TestCase, mock
 import urllib.parse
 
 import requests as r
 import requests_mock
+from urllib3 import HTTPResponse
 import ngwmn.services.ngwmn as mock_ngwmn
 
+from ngwmn import app
 from ngwmn.services import ServiceException
+from ngwmn.services.cache import is_absent
 from ngwmn.services.ngwmn import (
-    generate_bounding_box_values, get_iddata, get_water_quality, get_well_log, get_statistic, get_providers, get_sites)
+    default_statistics, get_iddata, get_water_quality, get_well_log, get_statistic,
+    get_statistics, get_providers, get_sites, get_site_feature)
 from .mock_data import (
     MOCK_WELL_LOG_RESPONSE, MOCK_WELL_LOG_RESPONSE2, MOCK_WQ_RESPONSE, MOCK_OVERALL_STATS, MOCK_MONTHLY_STATS,
     MOCK_PROVIDERS_RESPONSE, MOCK_SITES_RESPONSE)
@@ -98,7 +105,7 @@ class TestGetStatistics(TestCase):
             }
         }}
 
-    @mock.patch('ngwmn.services.ngwmn.r.get')
+    @mock.patch('ngwmn.services.ngwmn.http_client.get')
     def test_get_statistic__success(self, r_mock):
         m_resp = mock.Mock(r.Response)
         m_resp.text = '{"value":"SUCCESS"}'
@@ -114,7 +121,7 @@ class TestGetStatistics(TestCase):
             self.test_agency_cd, self.test_site_no])
         r_mock.assert_called_with(url)
 
-    @mock.patch('ngwmn.services.ngwmn.r.get')
+    @mock.patch('ngwmn.services.ngwmn.http_client.get')
     def test_get_statistic__status_500(self, r_mock):
         m_resp = mock.Mock(r.Response)
         m_resp.status_code = 500
@@ -124,7 +131,7 @@ class TestGetStatistics(TestCase):
         with self.assertRaises(ServiceException):
             get_statistic(self.test_agency_cd, self.test_site_no, 'site-info', self.test_service_root)
 
-    @mock.patch('ngwmn.services.ngwmn.r.get')
+    @mock.patch('ngwmn.services.ngwmn.http_client.get')
     def test_get_statistic__status_404(self, r_mock):
         m_resp = mock.Mock(r.Response)
         m_resp.status_code = 404
@@ -134,6 +141,20 @@ class TestGetStatistics(TestCase):
         result = get_statistic(self.test_agency_cd, self.test_site_no, 'site-info', self.test_service_root)
         self.assertEqual(False, result['is_fetched'])
         self.assertEqual(False, result['is_ranked'])
+        self.assertTrue(is_absent('statistic', self.test_agency_cd, self.test_site_no, 'site-info',
+                                  self.test_service_root))
+
+    @requests_mock.Mocker()
+    def test_get_statistics__missing_site_cached_briefly(self, mocker):
+        mocker.get(requests_mock.ANY, status_code=404)
+        config = {'CACHE_BACKEND': 'memory', 'CACHE_NEGATIVE_TTL': 60}
+        with mock.patch.dict(app.config, config):
+            for _ in range(2):
+                self.assertEqual(get_statistics(self.test_agency_cd, self.test_site_no), default_statistics())
+            self.assertEqual(mocker.call_count, 1)
+            with mock.patch('ngwmn.services.cache.time.time', return_value=time.time() + 120):
+                get_statistics(self.test_agency_cd, self.test_site_no)
+        self.assertEqual(mocker.call_count, 2)
 
     def mock_stat(self, agency_cd, site_no, stat_type, service='http://test.gov'):
         """
@@ -268,6 +289,15 @@ class TestGetProviders(TestCase):
                 'count': 5
             }])
 
+    def test_cached(self):
+        with requests_mock.mock() as m:
+            m.get('https://fake.gov/ngwmn/metadata/agencies', text=MOCK_PROVIDERS_RESPONSE)
+            first = get_providers(service_root=self.test_service_root)
+            second = get_providers(service_root=self.test_service_root)
+
+            self.assertEqual(first, second)
+            self.assertEqual(m.call_count, 1)
+
     def test_bad_request(self):
         with requests_mock.mock() as m:
             m.get('https://fake.gov/ngwmn/metadata/agencies', status_code=500)
@@ -305,6 +335,41 @@ class TestGetSites(TestCase):
                 get_sites('CODWR', service_root=self.test_service_root)
 
 
+class TestGetSiteFeature(TestCase):
+
+    def setUp(self):
+        self.test_service_root = 'https://fake.gov'
+
+    def test_success_good_data(self):
+        with requests_mock.mock() as m:
+            m.post('https://fake.gov/ngwmn/geoserver/wfs', text=MOCK_SITES_RESPONSE)
+            result = get_site_feature('CODWR', '1128', service_root=self.test_service_root)
+
+            body = urllib.parse.unquote_plus(m.request_history[0].text)
+            self.assertIn("(AGENCY_CD='CODWR') AND (SITE_NO='1128')", body)
+            self.assertIn('propertyName=AGENCY_CD,AGENCY_NM,SITE_NO,', body)
+            self.assertEqual(result['SITE_NO'], '1128')
+
+    def test_quoted_literals(self):
+        with requests_mock.mock() as m:
+            m.post('https://fake.gov/ngwmn/geoserver/wfs', text=MOCK_SITES_RESPONSE)
+            get_site_feature('CODWR', "11'28", service_root=self.test_service_root)
+
+            self.assertIn("(SITE_NO='11''28')", urllib.parse.unquote_plus(m.request_history[0].text))
+
+    def test_not_found(self):
+        with requests_mock.mock() as m:
+            m.post('https://fake.gov/ngwmn/geoserver/wfs',
+                   text='{"type": "FeatureCollection","totalFeatures": 0, "features": []}')
+            self.assertEqual(get_site_feature('CODWR', '1128', service_root=self.test_service_root), {})
+
+    def test_bad_request(self):
+        with requests_mock.mock() as m:
+            m.post('https://fake.gov/ngwmn/geoserver/wfs', status_code=500)
+            with self.assertRaises(ServiceException):
+                get_site_feature('CODWR', '1128', service_root=self.test_service_root)
+
+
 class TestGetWellData(TestCase):
 
     def setUp(self):
@@ -313,7 +378,7 @@ class TestGetWellData(TestCase):
         self.test_location_id = 'BP-1729'
         self.test_xml = '<site><agency>DOOP</agency><id>BP-1729</id></site>'
 
-    @mock.patch('ngwmn.services.ngwmn.r.get')
+    @mock.patch('ngwmn.services.ngwmn.http_client.get')
     def test_get_iddata__success(self, r_mock):
         m_resp = mock.Mock(r.Response)
         m_resp.content = self.test_xml
@@ -327,7 +392,7 @@ class TestGetWellData(TestCase):
             params={'request': 'well_log', 'agency_cd': 'DOOP', 'siteNo': 'BP-1729'}
         )
 
-    @mock.patch('ngwmn.services.ngwmn.r.get')
+    @mock.patch('ngwmn.services.ngwmn.http_client.get')
     def test_get_iddata_service_failure(self, r_mock):
         m_resp = mock.Mock(r.Response)
         m_resp.status_code = 500
@@ -339,7 +404,7 @@ class TestGetWellData(TestCase):
             # TODO this assertion is not executed
             self.assertIsNone(result)
 
-    @mock.patch('ngwmn.services.ngwmn.r.get')
+    @mock.patch('ngwmn.services.ngwmn.http_client.get')
     def test_get_iddata__syntax_error(self, r_mock):
         m_resp = mock.Mock(r.Response)
         m_resp.content = 'Stuff'
@@ -350,29 +415,58 @@ class TestGetWellData(TestCase):
         self.assertIsNone(result)
 
 
-class TestGenerateBoundingBox(TestCase):
-
-    def setUp(self):
-        self.latitude = 45.48
-        self.longitude = -16.71
-        self.delta = 0.01
-
-    def test_decimal_vals(self):
-        result = generate_bounding_box_values(self.latitude, self.longitude, self.delta)
-        self.assertAlmostEqual(result[0], -16.72)
-        self.assertAlmostEqual(result[1], 45.47)
-        self.assertAlmostEqual(result[2], -16.70)
-        self.assertAlmostEqual(result[3], 45.49)
-
-    def test_string_vals(self):
-        result = generate_bounding_box_values(str(self.latitude), str(self.longitude), self.delta)
-        self.assertAlmostEqual(result[0], -16.72)
-        self.assertAlmostEqual(result[1], 45.47)
-        self.assertAlmostEqual(result[2], -16.70)
-        self.assertAlmostEqual(result[3], 45.49)
+class TestWaterQualityResults(TestCase):
+    def test_streaming_matches_tree_parsing(self):
+        with requests_mock.mock() as req:
+            req.get(requests_mock.ANY, content=MOCK_WQ_RESPONSE)
+            with mock.patch.dict(app.config, {'WATER_QUALITY_STREAMING': True}):
+                streamed = get_water_quality('USGS', '1')
+            with mock.patch.dict(app.config, {'WATER_QUALITY_STREAMING': False}):
+                parsed = get_water_quality('USGS', '2')
+        self.assertEqual(streamed, parsed)
+
+    def test_streaming_first_organization_only(self):
+        second_org = MOCK_WQ_RESPONSE.replace(b'<WQX ', b'<Root ').replace(b'</WQX>', b'</Root>')
+        document = second_org.replace(b'</Organization>', b'</Organization><Organization><Activity/></Organization>')
+        with requests_mock.mock() as req:
+            req.get(requests_mock.ANY, content=document)
+            results = get_water_quality('USGS', '1')
+        self.assertEqual(results['organization']['id'], 'USGS-MI')
+        self.assertEqual(len(results['activities']), 1)
 
+    def test_streaming_invalid_xml(self):
+        with requests_mock.mock() as req:
+            req.get(requests_mock.ANY, content=MOCK_WQ_RESPONSE[:500])
+            self.assertEqual(get_water_quality('USGS', '1'), {})
+
+    def _interrupted(self, error):
+        # A response whose body breaks off with the error once its first 500 bytes have been read
+        class Interrupted(io.BytesIO):
+            """Body that fails partway through."""
+
+            def read(self, *args):
+                if self.tell() >= 500:
+                    raise error
+                return super().read(*args)
+
+        body = Interrupted(MOCK_WQ_RESPONSE)
+        return HTTPResponse(body=body, status=200, preload_content=False, decode_content=False)
+
+    def test_streaming_interrupted(self):
+        for error, status_code in ((socket.timeout('timed out'), 504), (ConnectionResetError('reset'), 502)):
+            with requests_mock.mock() as req, \
+                    mock.patch('ngwmn.services.ngwmn.skip_store') as mock_skip, \
+                    self.assertRaises(ServiceException) as context:
+                req.get(requests_mock.ANY, raw=self._interrupted(error))
+                get_water_quality('USGS', str(status_code))
+            self.assertEqual(context.exception.status_code, status_code)
+            mock_skip.assert_called_once_with()
+
+    def test_streaming_not_found(self):
+        with requests_mock.mock() as req:
+            req.get(requests_mock.ANY, status_code=404)
+            self.assertEqual(get_water_quality('USGS', '1'), {})
 
-class TestWaterQualityResults(TestCase):
     def test_wq_parsing(self):
         with requests_mock.mock() as req:
             req.get(requests_mock.ANY, content=MOCK_WQ_RESPONSE)
@@ -0,0 +1,57 @@
+"""
+Unit tests for site page fetch planning.
+"""
+
+from unittest import TestCase, mock
+
+from ngwmn import app
+from ngwmn.services.cache import mark_absent
+from ngwmn.services.planner import plan_site_fetches
+from ngwmn.services.timing import begin_request, end_request
+
+SERVICE_ROOT = app.config.get('SERVICE_ROOT')
+
+
+class TestPlanSiteFetches(TestCase):
+
+    def test_fetch_all(self):
+        plan = plan_site_fetches('USGS', '1', {'QW_SN_FLAG': '1', 'WL_SN_FLAG': '1'})
+        self.assertTrue(plan.water_quality)
+        self.assertTrue(plan.statistics)
+        self.assertEqual(plan.skipped, {})
+
+    def test_unknown_feature(self):
+        plan = plan_site_fetches('USGS', '1', {})
+        self.assertTrue(plan.water_quality)
+        self.assertTrue(plan.statistics)
+
+    def test_flags(self):
+        timings = begin_request()
+        plan = plan_site_fetches('USGS', '1', {'QW_SN_FLAG': '0', 'WL_SN_FLAG': '1'})
+        end_request()
+        self.assertFalse(plan.water_quality)
+        self.assertTrue(plan.statistics)
+        self.assertIn('water_quality', plan.skipped)
+        # Skipped calls are reported in the request's timings
+        self.assertEqual(timings.summary(), {'water_quality': {
+            'calls': 0, 'duration_ms': 0.0, 'skipped': 'site is not in the water-quality network'}})
+
+        plan = plan_site_fetches('USGS', '1', {'QW_SN_FLAG': '1', 'WL_SN_FLAG': '0'})
+        self.assertTrue(plan.water_quality)
+        self.assertFalse(plan.statistics)
+        self.assertIn('statistics', plan.skipped)
+
+    def test_recently_absent(self):
+        with mock.patch.dict(app.config, {'CACHE_BACKEND': 'memory', 'CACHE_NEGATIVE_TTL': 60}):
+            mark_absent('iddata', 'water_quality', 'USGS', '1', SERVICE_ROOT)
+            mark_absent('statistic', 'USGS', '1', 'wl-overall', SERVICE_ROOT)
+            plan = plan_site_fetches('USGS', '1', {'QW_SN_FLAG': '1', 'WL_SN_FLAG': '1'})
+            self.assertFalse(plan.water_quality)
+            self.assertFalse(plan.statistics)
+            self.assertTrue(plan_site_fetches('USGS', '2', {}).water_quality)
+
+    def test_disabled(self):
+        with mock.patch.dict(app.config, {'PLAN_SITE_FETCHES': False}):
+            plan = plan_site_fetches('USGS', '1', {'QW_SN_FLAG': '0', 'WL_SN_FLAG': '0'})
+        self.assertTrue(plan.water_quality)
+        self.assertTrue(plan.statistics)
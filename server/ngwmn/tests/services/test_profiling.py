@@ -0,0 +1,69 @@
+"""
+Unit tests for per-request profiling.
+"""
+
+import os
+import pstats
+import tempfile
+import time
+from unittest import TestCase, mock
+
+from ngwmn import app
+from ngwmn.services.concurrency import submit
+from ngwmn.services.profiling import save_profile, start_profile, stop_profile
+
+
+def _busy_upstream_call():
+    end = time.perf_counter() + 0.05
+    while time.perf_counter() < end:
+        pass
+
+
+@mock.patch.dict(app.config, {'CONCURRENT_FETCH': True, 'PROFILE_SAMPLE_INTERVAL': 0.001})
+class TestProfiles(TestCase):
+
+    def test_sampling(self):
+        profile = start_profile('sample')
+        submit(_busy_upstream_call).result()
+        stop_profile()
+
+        content, mimetype, extension = profile.artifact()
+        self.assertEqual((mimetype, extension), ('text/plain', 'folded'))
+        stacks = [line.rsplit(' ', 1) for line in content.decode('utf-8').splitlines()]
+        self.assertTrue(all(int(count) > 0 for _, count in stacks))
+        self.assertTrue(any(stack.startswith('upstream;') and '_busy_upstream_call' in stack for stack, _ in stacks))
+        self.assertTrue(any(stack.startswith('request;') for stack, _ in stacks))
+
+    def test_deterministic(self):
+        profile = start_profile('cprofile')
+        submit(_busy_upstream_call).result()
+        stop_profile()
+
+        content, _, extension = profile.artifact()
+        self.assertEqual(extension, 'prof')
+        with tempfile.NamedTemporaryFile(suffix='.prof') as output:
+            output.write(content)
+            output.flush()
+            functions = {function for _, _, function in pstats.Stats(output.name).stats}
+        self.assertIn('_busy_upstream_call', functions)
+
+    def test_not_profiled(self):
+        self.assertIsNone(stop_profile())
+        submit(_busy_upstream_call).result()
+
+    def test_save_profile(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch.dict(app.config, {'PROFILE_DIR': directory, 'PROFILE_DIR_MAX_FILES': 2}):
+            unrelated = os.path.join(directory, 'notes.txt')
+            with open(unrelated, 'w') as notes:
+                notes.write('kept')
+            os.utime(unrelated, (time.time() - 100, time.time() - 100))
+            paths = []
+            for _ in range(3):
+                start_profile('sample')
+                paths.append(save_profile(stop_profile(), 'site_page'))
+                # Distinct modification times, so the oldest profile is the one removed
+                os.utime(paths[-1], (time.time() - 10 + len(paths), time.time() - 10 + len(paths)))
+            self.assertEqual(sorted(os.listdir(directory)),
+                             sorted(['notes.txt'] + [os.path.basename(path) for path in paths[1:]]))
+            self.assertRegex(os.path.basename(paths[0]), r'^\d{8}T\d{6}-site_page-\d+ms-\d+-\d+\.folded$')
@@ -0,0 +1,106 @@
+"""
+Unit tests for coalescing of concurrent upstream calls.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+from unittest import TestCase
+
+from ngwmn.services import ServiceException
+from ngwmn.services.concurrency import bounded_by, deadline
+from ngwmn.services.singleflight import SingleFlight, coalesce
+
+
+class _Interrupted(BaseException):
+    pass
+
+
+class TestSingleFlight(TestCase):
+
+    def setUp(self):
+        self.group = SingleFlight()
+        self.release = threading.Event()
+        self.calls = []
+
+    def _slow(self, value):
+        self.calls.append(value)
+        self.release.wait(5)
+        if value == 'fail':
+            raise ServiceException()
+        if value == 'interrupt':
+            raise _Interrupted()
+        return {'value': value}
+
+    def _run_concurrently(self, key, value, count=5):
+        with ThreadPoolExecutor(max_workers=count) as executor:
+            futures = [executor.submit(self.group.do, key, self._slow, value) for _ in range(count)]
+            # Wait until the leader is in flight and the followers have had a chance to join it
+            while not self.calls:
+                pass
+            threading.Event().wait(0.05)
+            self.release.set()
+        return futures
+
+    def test_shared_result(self):
+        futures = self._run_concurrently('key', 'a')
+        results = [future.result() for future in futures]
+        self.assertEqual(len(self.calls), 1)
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertEqual(self.group.in_flight(), 0)
+
+    def test_shared_exception(self):
+        futures = self._run_concurrently('key', 'fail')
+        for future in futures:
+            with self.assertRaises(ServiceException):
+                future.result()
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(self.group.in_flight(), 0)
+
+    def test_interrupted_leader(self):
+        futures = self._run_concurrently('key', 'interrupt')
+        errors = []
+        for future in futures:
+            try:
+                future.result()
+            except BaseException as err:  # pylint: disable=broad-except
+                errors.append(type(err))
+        self.assertEqual(sorted(error.__name__ for error in errors),
+                         ['ServiceException'] * 4 + ['_Interrupted'])
+        self.assertEqual(self.group.in_flight(), 0)
+
+    def test_follower_deadline(self):
+        leader = threading.Thread(target=self.group.do, args=('key', self._slow, 'a'))
+        leader.start()
+        while not self.calls:
+            pass
+        start = time.monotonic()
+        with bounded_by(deadline(0.1)), self.assertRaises(ServiceException) as context:
+            self.group.do('key', self._slow, 'a')
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(context.exception.status_code, 504)
+        self.release.set()
+        leader.join()
+        self.assertEqual(len(self.calls), 1)
+
+    def test_sequential_calls_not_shared(self):
+        self.release.set()
+        self.group.do('key', self._slow, 'a')
+        self.group.do('key', self._slow, 'a')
+        self.assertEqual(len(self.calls), 2)
+
+    def test_distinct_keys(self):
+        self.release.set()
+        self.assertEqual(self.group.do('a', self._slow, 'a'), {'value': 'a'})
+        self.assertEqual(self.group.do('b', self._slow, 'b'), {'value': 'b'})
+
+
+class TestCoalesce(TestCase):
+
+    def test_decorator(self):
+        @coalesce('test')
+        def fetch(value, suffix=''):
+            return value + suffix
+
+        self.assertEqual(fetch('a', suffix='b'), 'ab')
+        self.assertEqual(fetch.__name__, 'fetch')
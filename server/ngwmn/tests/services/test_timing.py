@@ -0,0 +1,103 @@
+"""
+Unit tests for per-request timing of service calls.
+"""
+
+from unittest import TestCase, mock
+
+import requests_mock
+
+from ngwmn import app
+from ngwmn.services import ServiceException, http_client
+from ngwmn.services.cache import cached
+from ngwmn.services.concurrency import submit
+from ngwmn.services.timing import begin_request, current_request, end_request, note_skipped, timed
+
+
+@timed('test')
+@cached('test')
+def _fetch(url):
+    return http_client.get(url).json()
+
+
+@timed('outer')
+def _outer(url):
+    return _fetch(url)
+
+
+@timed('failing')
+def _fail():
+    raise ServiceException()
+
+
+@mock.patch.dict(app.config, {'CACHE_BACKEND': 'memory', 'CACHE_TTL': {'test': 60}, 'CONCURRENT_FETCH': True})
+class TestTimed(TestCase):
+
+    def setUp(self):
+        self.timings = begin_request()
+
+    def tearDown(self):
+        end_request()
+
+    @requests_mock.Mocker()
+    def test_records_calls(self, mocker):
+        mocker.get('http://fake.com/a', json={'a': 1})
+        _fetch('http://fake.com/a')
+        _fetch('http://fake.com/a')
+
+        self.assertEqual([call.cache for call in self.timings.calls], ['miss', 'hit'])
+        self.assertEqual([call.status for call in self.timings.calls], [200, None])
+        self.assertEqual(self.timings.calls[0].size, len(b'{"a": 1}'))
+        summary = self.timings.summary()
+        self.assertEqual(summary['test']['calls'], 2)
+        self.assertEqual(summary['test']['cache'], {'hit': 1, 'miss': 1})
+        self.assertEqual(summary['test']['statuses'], {'200': 1})
+
+    @requests_mock.Mocker()
+    def test_nested_calls(self, mocker):
+        mocker.get('http://fake.com/a', json={'a': 1})
+        _outer('http://fake.com/a')
+
+        names = [call.name for call in self.timings.calls]
+        self.assertEqual(names, ['test', 'outer'])
+        # The response is attributed to the innermost call only
+        self.assertIsNone(self.timings.calls[1].status)
+        self.assertGreaterEqual(self.timings.calls[1].duration, self.timings.calls[0].duration)
+
+    def test_records_errors(self):
+        with self.assertRaises(ServiceException):
+            _fail()
+        self.assertEqual(self.timings.summary()['failing']['errors'], ['ServiceException'])
+
+    @requests_mock.Mocker()
+    def test_submitted_calls(self, mocker):
+        mocker.get('http://fake.com/a', json={'a': 1})
+        submit(_fetch, 'http://fake.com/a').result()
+        self.assertEqual([call.name for call in self.timings.calls], ['test'])
+
+    @requests_mock.Mocker()
+    def test_server_timing(self, mocker):
+        mocker.get('http://fake.com/a', json={'a': 1})
+        _fetch('http://fake.com/a')
+        _fetch('http://fake.com/a')
+
+        metrics = self.timings.server_timing().split(', ')
+        self.assertEqual(len(metrics), 2)
+        self.assertRegex(metrics[0], r'^test;dur=\d+\.\d;desc="calls=2 hit=1 miss=1 status_200=1 bytes=8"$')
+        self.assertRegex(metrics[1], r'^total;dur=\d+\.\d$')
+
+
+    def test_skipped(self):
+        note_skipped('statistics', 'site is not in the water-level network')
+        self.assertEqual(self.timings.summary()['statistics'],
+                         {'calls': 0, 'duration_ms': 0.0, 'skipped': 'site is not in the water-level network'})
+        self.assertIn('statistics;dur=0.0;desc="calls=0 skipped"', self.timings.server_timing())
+
+
+class TestOutsideRequest(TestCase):
+
+    def test_not_recorded(self):
+        self.assertIsNone(current_request())
+        note_skipped('statistics', 'not recorded')
+        with self.assertRaises(ServiceException):
+            _fail()
+        self.assertIsNone(current_request())
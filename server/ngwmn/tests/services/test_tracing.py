@@ -0,0 +1,124 @@
+"""
+Unit tests for request-scoped tracing spans.
+"""
+
+import json
+import os
+import tempfile
+import threading
+from unittest import TestCase, mock
+
+import requests_mock
+
+from ngwmn import app
+from ngwmn.services import ServiceException, http_client
+from ngwmn.services.concurrency import submit
+from ngwmn.services.timing import timed
+from ngwmn.services.tracing import KIND_CLIENT, KIND_SERVER, current_span, end_trace, span, start_trace
+
+
+@timed('test')
+def _fetch(url):
+    return http_client.get(url).json()
+
+
+def _spans(lines):
+    return [exported for line in lines
+            for resource in json.loads(line)['resourceSpans']
+            for scope in resource['scopeSpans']
+            for exported in scope['spans']]
+
+
+class TestTracing(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'traces.jsonl')
+        patcher = mock.patch.dict(app.config, {'TRACE_EXPORT': self.path, 'CONCURRENT_FETCH': True})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _exported(self):
+        with open(self.path) as traces:
+            return traces.read().splitlines()
+
+    @requests_mock.Mocker()
+    def test_spans(self, mocker):
+        mocker.get('http://fake.com/a', json={'a': 1})
+        root = start_trace('GET /test', **{'http.route': '/test'})
+        with span('parse', size=3):
+            with span('inner'):
+                pass
+        _fetch('http://fake.com/a')
+        end_trace()
+
+        lines = self._exported()
+        self.assertEqual(len(lines), 1)
+        spans = {exported['name']: exported for exported in _spans(lines)}
+        self.assertEqual(set(spans), {'GET /test', 'parse', 'inner', 'test'})
+        self.assertEqual({exported['traceId'] for exported in spans.values()}, {root.context.trace.trace_id})
+        self.assertEqual(len(root.context.trace.trace_id), 32)
+        self.assertNotIn('parentSpanId', spans['GET /test'])
+        self.assertEqual(spans['GET /test']['kind'], KIND_SERVER)
+        self.assertEqual(spans['parse']['parentSpanId'], root.context.span_id)
+        self.assertEqual(spans['inner']['parentSpanId'], spans['parse']['spanId'])
+        self.assertEqual(spans['test']['parentSpanId'], root.context.span_id)
+        self.assertEqual(spans['test']['kind'], KIND_CLIENT)
+        self.assertIn({'key': 'http.status_code', 'value': {'intValue': '200'}}, spans['test']['attributes'])
+        self.assertIn({'key': 'size', 'value': {'intValue': '3'}}, spans['parse']['attributes'])
+        self.assertLessEqual(int(spans['GET /test']['startTimeUnixNano']), int(spans['parse']['startTimeUnixNano']))
+        self.assertIsNone(current_span())
+
+    @requests_mock.Mocker()
+    def test_submitted_spans(self, mocker):
+        mocker.get('http://fake.com/a', json={'a': 1})
+        root = start_trace('GET /test')
+        submit(_fetch, 'http://fake.com/a').result()
+        end_trace()
+
+        spans = _spans(self._exported())
+        self.assertEqual([exported['parentSpanId'] for exported in spans if exported['name'] == 'test'],
+                         [root.context.span_id])
+
+    def test_errors(self):
+        start_trace('GET /test')
+        with self.assertRaises(ServiceException):
+            with span('failing'):
+                raise ServiceException()
+        end_trace(ValueError())
+
+        spans = {exported['name']: exported for exported in _spans(self._exported())}
+        self.assertEqual(spans['failing']['status'], {'code': 2, 'message': 'ServiceException'})
+        self.assertEqual(spans['GET /test']['status'], {'code': 2, 'message': 'ValueError'})
+
+    def test_late_spans(self):
+        release = threading.Event()
+
+        def abandoned():
+            with span('abandoned'):
+                release.wait(5)
+
+        start_trace('GET /test')
+        future = submit(abandoned)
+        end_trace()
+        release.set()
+        future.result()
+
+        lines = self._exported()
+        self.assertEqual([[exported['name'] for exported in _spans([line])] for line in lines],
+                         [['GET /test'], ['abandoned']])
+
+    def test_traceparent(self):
+        root = start_trace('GET /test', '00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01')
+        end_trace()
+        self.assertEqual(root.context.trace.trace_id, '0af7651916cd43dd8448eb211c80319c')
+        self.assertEqual(_spans(self._exported())[0]['parentSpanId'], 'b7ad6b7169203331')
+
+    def test_disabled(self):
+        with mock.patch.dict(app.config, {'TRACE_EXPORT': None}):
+            self.assertIsNone(start_trace('GET /test'))
+            with span('parse') as current:
+                self.assertIsNone(current)
+            end_trace()
+        self.assertFalse(os.path.exists(self.path))
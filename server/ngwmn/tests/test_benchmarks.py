@@ -0,0 +1,17 @@
+"""
+Smoke tests of the performance benchmarks, so that changes to the code they drive do not break them unnoticed.
+"""
+from unittest import TestCase
+
+from benchmarks import suite  # pylint: disable=unused-import
+from benchmarks.runner import BENCHMARKS, measure
+
+
+class TestBenchmarks(TestCase):
+
+    def test_in_process_upstream(self):
+        # These run the service calls against the in-process upstream stand-in
+        for name in ('well_log[10]', 'site_page[100]'):
+            benchmark = next(benchmark for benchmark in BENCHMARKS if benchmark.name == name)
+            result = measure(benchmark, min_time=0, min_rounds=1)
+            self.assertEqual(result['rounds'], 1, name)
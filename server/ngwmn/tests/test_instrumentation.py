@@ -0,0 +1,132 @@
+"""
+Unit tests for request instrumentation
+"""
+import json
+import os
+import tempfile
+from unittest import TestCase, mock
+from urllib.parse import urljoin
+
+import requests_mock
+
+from .. import app
+from .services.mock_data import MOCK_PROVIDERS_RESPONSE
+
+SERVICE_ROOT = app.config.get('SERVICE_ROOT')
+
+
+@mock.patch.dict(app.config, {'CACHE_BACKEND': 'memory'})
+class TestRequestTiming(TestCase):
+
+    def setUp(self):
+        self.app_client = app.test_client()
+        self.providers_url = urljoin(SERVICE_ROOT, 'ngwmn/metadata/agencies')
+
+    @requests_mock.Mocker()
+    def test_server_timing(self, mocker):
+        mocker.get(self.providers_url, text=MOCK_PROVIDERS_RESPONSE)
+        response = self.app_client.get('/provider/')
+
+        self.assertEqual(response.status_code, 200)
+        metrics = response.headers['Server-Timing'].split(', ')
+        self.assertTrue(metrics[0].startswith('providers;dur='))
+        self.assertIn('miss=1 status_200=1', metrics[0])
+        self.assertTrue(metrics[-1].startswith('total;dur='))
+
+    @requests_mock.Mocker()
+    def test_access_log(self, mocker):
+        mocker.get(self.providers_url, text=MOCK_PROVIDERS_RESPONSE)
+        self.app_client.get('/provider/')
+        with self.assertLogs('ngwmn.access', level='INFO') as logs:
+            self.app_client.get('/provider/?a=b')
+
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['path'], '/provider/')
+        self.assertEqual(record['query'], 'a=b')
+        self.assertEqual(record['status'], 200)
+        self.assertEqual(record['upstream']['providers']['cache'], {'hit': 1})
+
+    @mock.patch.dict(app.config, {'SERVER_TIMING': False, 'ACCESS_LOG': False})
+    def test_disabled(self):
+        with mock.patch('ngwmn.instrumentation.access_logger') as m_logger:
+            response = self.app_client.get('/version')
+        self.assertNotIn('Server-Timing', response.headers)
+        m_logger.info.assert_not_called()
+
+
+class TestMetricsView(TestCase):
+
+    def setUp(self):
+        self.app_client = app.test_client()
+
+    @mock.patch.dict(app.config, {'METRICS_ENABLED': True})
+    def test_metrics(self):
+        self.app_client.get('/version')
+        response = self.app_client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'ngwmn_request_duration_seconds_count{endpoint="version"}', response.data)
+
+    @mock.patch.dict(app.config, {'METRICS_ENABLED': False})
+    def test_disabled(self):
+        self.assertEqual(self.app_client.get('/metrics').status_code, 404)
+
+
+class TestRequestTracing(TestCase):
+
+    def setUp(self):
+        self.app_client = app.test_client()
+
+    def test_trace(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'traces.jsonl')
+            with mock.patch.dict(app.config, {'TRACE_EXPORT': path}), \
+                    self.assertLogs('ngwmn.access', level='INFO') as logs:
+                self.app_client.get('/version', headers={
+                    'traceparent': '00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01'
+                })
+            with open(path) as traces:
+                document = json.loads(traces.read())
+
+        root = document['resourceSpans'][0]['scopeSpans'][0]['spans'][0]
+        self.assertEqual(root['name'], 'GET /version')
+        self.assertEqual(root['traceId'], '0af7651916cd43dd8448eb211c80319c')
+        self.assertIn({'key': 'http.status_code', 'value': {'intValue': '200'}}, root['attributes'])
+        self.assertEqual(json.loads(logs.records[0].getMessage())['trace_id'], root['traceId'])
+
+
+class TestRequestProfiling(TestCase):
+
+    def setUp(self):
+        self.app_client = app.test_client()
+
+    @mock.patch.dict(app.config, {'PROFILE_ON_DEMAND': True, 'PROFILE_KEY': None})
+    def test_on_demand(self):
+        response = self.app_client.get('/version?profile=cprofile')
+        self.assertEqual(response.headers['Content-Disposition'], 'attachment; filename="version.prof"')
+        self.assertEqual(response.headers['X-Profiled-Status'], '200')
+
+        response = self.app_client.get('/version', headers={'X-Profile': 'sample'})
+        self.assertEqual(response.headers['Content-Disposition'], 'attachment; filename="version.folded"')
+
+    @mock.patch.dict(app.config, {'PROFILE_ON_DEMAND': True, 'PROFILE_KEY': 'secret'})
+    def test_key(self):
+        response = self.app_client.get('/version?profile=sample')
+        self.assertNotIn('Content-Disposition', response.headers)
+        response = self.app_client.get('/version?profile=sample&profile_key=secret')
+        self.assertIn('Content-Disposition', response.headers)
+
+    @mock.patch.dict(app.config, {'PROFILE_ON_DEMAND': False})
+    def test_disabled(self):
+        response = self.app_client.get('/version?profile=cprofile')
+        self.assertNotIn('Content-Disposition', response.headers)
+        self.assertIn(b'version', response.data)
+
+    def test_slow_requests(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with mock.patch.dict(app.config, {'PROFILE_SLOW_REQUESTS': 0, 'PROFILE_DIR': directory}):
+                response = self.app_client.get('/version')
+            self.assertNotIn('Content-Disposition', response.headers)
+            self.assertEqual(len(os.listdir(directory)), 1)
+            with mock.patch.dict(app.config, {'PROFILE_SLOW_REQUESTS': 60, 'PROFILE_DIR': directory}):
+                self.app_client.get('/version')
+            self.assertEqual(len(os.listdir(directory)), 1)
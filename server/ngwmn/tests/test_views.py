@@ -5,12 +5,14 @@ Unit tests for NGWMN views
 # pylint: disable=C0103
 import datetime
 import json
+import threading
 from unittest import TestCase, mock
 from urllib.parse import urljoin
 
 import requests_mock
 
 from .. import app
+from ..services import ServiceException
 from .services.mock_data import MOCK_SIFTA_RESPONSE, MOCK_WELL_LOG_RESPONSE, MOCK_WQ_RESPONSE, \
     MOCK_OVERALL_STATS, MOCK_MONTHLY_STATS, MOCK_SITE_INFO
 
@@ -96,9 +98,62 @@ class TestWellPageView(TestCase):
         # check that the expected 'site no' is in the response, and the other 'site no' is not
         self.assertIn(id1, response.data)
         self.assertNotIn(id2, response.data)
+        # The site is not in the water-quality network, so its water quality was not fetched
+        self.assertIn('water_quality;dur=0.0;desc="calls=0 skipped"', response.headers['Server-Timing'])
 
+    # Long enough a budget for the other sections to complete against the mocks
+    @mock.patch.dict(app.config, {'CONCURRENT_FETCH': True, 'SITE_PAGE_BUDGET': 0.5})
     @requests_mock.Mocker()
-    def test_failed_service_with_non_server_error(self, mocker):
+    @mock.patch('ngwmn.services.sifta.get_current_date')
+    def test_late_section(self, mocker, m_get_current_date):
+        m_get_current_date.return_value = datetime.date(2020, 2, 20)
+        mocker.post(requests_mock.ANY, text=TEST_SUMMARY_JSON, status_code=200)
+        mocker.get(self.well_log_url, content=MOCK_WELL_LOG_RESPONSE, status_code=200)
+        mocker.get(self.wq_url, content=MOCK_WQ_RESPONSE, status_code=200)
+        mocker.get(self.sifta_url, text=MOCK_SIFTA_RESPONSE, status_code=200)
+        release = threading.Event()
+
+        def slow_statistics(*args):  # pylint: disable=unused-argument
+            release.wait(5)
+            return {}
+
+        with mock.patch('ngwmn.views.get_statistics', side_effect=slow_statistics) as m_get_statistics:
+            try:
+                response = self.app_client.get(self.site_loc_url_1)
+            finally:
+                release.set()
+
+        m_get_statistics.assert_called_once()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Water-level statistics are temporarily unavailable', response.data)
+        self.assertNotIn(b'id="overall-stats"', response.data)
+        self.assertNotIn(b'Water-quality data are temporarily unavailable', response.data)
+
+    @mock.patch.dict(app.config, {'CONCURRENT_FETCH': False})
+    @requests_mock.Mocker()
+    @mock.patch('ngwmn.services.sifta.get_current_date')
+    def test_failed_section(self, mocker, m_get_current_date):
+        m_get_current_date.return_value = datetime.date(2020, 2, 20)
+        mocker.post(requests_mock.ANY, text=TEST_SUMMARY_JSON, status_code=200)
+        mocker.get(self.well_log_url, content=MOCK_WELL_LOG_RESPONSE, status_code=200)
+        mocker.get(self.wq_url, content=MOCK_WQ_RESPONSE, status_code=200)
+        mocker.get(self.site_info_url, text=self.mock_site_info_json, status_code=200)
+        mocker.get(self.stats_overall_url, text=self.mock_overall_json, status_code=200)
+        mocker.get(self.stats_monthly_url, text=self.mock_monthly_json, status_code=200)
+
+        with mock.patch('ngwmn.views.get_cooperators', side_effect=ServiceException()):
+            response = self.app_client.get(self.site_loc_url_1)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Cooperator information is temporarily unavailable', response.data)
+        self.assertIn(b'id="overall-stats"', response.data)
+
+    # Fetch inline, so that no call is left running against the mocks when the page fails
+    @mock.patch.dict(app.config, {'CONCURRENT_FETCH': False})
+    @requests_mock.Mocker()
+    @mock.patch('ngwmn.services.sifta.get_current_date')
+    def test_failed_service_with_non_server_error(self, mocker, m_get_current_date):
+        m_get_current_date.return_value = datetime.date(2020, 2, 20)
         mocker.post(requests_mock.ANY, status_code=403)
         mocker.get(self.well_log_url, content=MOCK_WELL_LOG_RESPONSE, status_code=200)
         mocker.get(self.wq_url, content=MOCK_WQ_RESPONSE, status_code=200)
@@ -110,8 +165,12 @@ class TestWellPageView(TestCase):
         response = self.app_client.get(self.site_loc_url_1)
         self.assertEqual(response.status_code, 503)
 
+    # Fetch inline, so that no call is left running against the mocks when the page fails
+    @mock.patch.dict(app.config, {'CONCURRENT_FETCH': False})
     @requests_mock.Mocker()
-    def test_failed_service_with_server_error(self, mocker):
+    @mock.patch('ngwmn.services.sifta.get_current_date')
+    def test_failed_service_with_server_error(self, mocker, m_get_current_date):
+        m_get_current_date.return_value = datetime.date(2020, 2, 20)
         mocker.post(requests_mock.ANY, status_code=500)
         mocker.get(self.well_log_url, content=MOCK_WELL_LOG_RESPONSE, status_code=200)
         mocker.get(self.wq_url, content=MOCK_WQ_RESPONSE, status_code=200)
@@ -123,6 +182,8 @@ class TestWellPageView(TestCase):
         response = self.app_client.get(self.site_loc_url_1)
         self.assertEqual(response.status_code, 503)
 
+    # Fetch inline, so that no call is left running against the mocks when the page fails
+    @mock.patch.dict(app.config, {'CONCURRENT_FETCH': False})
     @requests_mock.Mocker()
     def test_no_xml(self, mocker):
         mocker.get(requests_mock.ANY, status_code=404)
@@ -166,6 +227,15 @@ class TestProviderView(TestCase):
         self.assertIn(b'Agency A', response.data)
         self.assertIn(b'<div>My Content</div>', response.data)
 
+    def test_content_fetched_per_section(self, m_pull_feed, m_get_providers):
+        m_pull_feed.side_effect = lambda url: '<div>{0}</div>'.format(url.rsplit('/', 1)[-1])
+        m_get_providers.return_value = [{'agency_cd': 'A', 'agency_nm': 'Agency A'}]
+        response = self.app_client.get('/provider/A/')
+
+        self.assertEqual(m_pull_feed.call_count, 5)
+        for content_type in ('main', 'siteselect', 'datacollection', 'datamanagement', 'otherinfo'):
+            self.assertIn('<div>{0}</div>'.format(content_type).encode(), response.data)
+
 
 @mock.patch('ngwmn.views.get_sites')
 class TestSitesView(TestCase):
@@ -5,7 +5,7 @@ from unittest import TestCase
 
 from defusedxml.lxml import RestrictedElement
 
-from ..xml_utils import parse_xml
+from ..xml_utils import Attribute, Const, Each, ExtractionPlan, Group, Index, Text, parse_xml
 
 
 class TestParseXml(TestCase):
@@ -21,3 +21,59 @@ class TestParseXml(TestCase):
     def test_bad_xml(self):
         result = parse_xml(self.bad_xml)
         self.assertIsNone(result)
+
+
+class TestExtractionPlan(TestCase):
+
+    def setUp(self):
+        self.xml = parse_xml(
+            '<a xmlns="urn:test" xmlns:x="urn:x">'
+            '<name>A site</name><depth uom="ft">12.5</depth><status>unknown</status><blank/>'
+            '<item><x:label>first</x:label></item><item><x:label>second</x:label></item>'
+            '</a>'
+        )
+        self.namespaces = {'t': 'urn:test', 'x': 'urn:x'}
+
+    def test_text(self):
+        plan = ExtractionPlan(Group('.', {
+            'name': Text('t:name'),
+            'status': Text('t:status', default='--'),
+            'blank': Text('t:blank'),
+            'missing': Text('t:missing', default='--'),
+            'raw_status': Text('t:status', raw=True),
+            'depth': Text('t:depth', convert=float)
+        }), self.namespaces)
+        self.assertEqual(plan(self.xml, self.namespaces), {
+            'name': 'A site',
+            'status': '--',
+            'blank': None,
+            'missing': '--',
+            'raw_status': 'unknown',
+            'depth': 12.5
+        })
+
+    def test_groups_and_lists(self):
+        plan = ExtractionPlan(Group('.', {
+            'depth': Group('t:depth', {'unit': Attribute('uom'), 'kind': Const('depth')}),
+            'missing': Group('t:missing', {'unit': Attribute('uom')}),
+            'omitted': Group('t:missing', {'unit': Attribute('uom')}, optional=True),
+            'items': Each('t:item', {'id': Index('item-{0}'), 'label': Text('x:label')}),
+            'none': Each('t:missing', {'id': Index()}),
+            'omitted_list': Each('t:missing', {'id': Index()}, optional=True)
+        }), self.namespaces)
+        self.assertEqual(plan(self.xml, self.namespaces), {
+            'depth': {'unit': 'ft', 'kind': 'depth'},
+            'missing': {'unit': None},
+            'items': [{'id': 'item-0', 'label': 'first'}, {'id': 'item-1', 'label': 'second'}],
+            'none': []
+        })
+
+    def test_namespaces(self):
+        plan = ExtractionPlan(Group('.', {'name': Text('t:name')}), self.namespaces)
+        no_namespace = parse_xml('<a><name>Plain</name></a>')
+        self.assertEqual(plan(no_namespace, {'t': None}), {'name': 'Plain'})
+        self.assertEqual(plan(self.xml, self.namespaces), {'name': 'A site'})
+
+    def test_missing_element(self):
+        plan = ExtractionPlan(Group('.', {'name': Text('t:name')}), self.namespaces)
+        self.assertEqual(plan(None, self.namespaces), {'name': None})
@@ -2,14 +2,19 @@
 NGWMN UI application views
 
 """
-from flask import abort, jsonify, render_template
+from flask import Response, abort, jsonify, render_template
 
 from . import __version__, app
-from .services.ngwmn import get_features, get_water_quality, get_well_log, get_statistics, get_providers, get_sites
+from .services.ngwmn import (
+    default_statistics, get_site_feature, get_water_quality, get_well_log, get_statistics, get_providers, get_sites)
 from .services.confluence import (
     pull_feed, confluence_url, MAIN_CONTENT, SITE_SELECTION_CONTENT, DATA_COLLECTION_CONTENT, DATA_MANAGEMENT_CONTENT,
     OTHER_AGENCY_INFO_CONTENT)
 from .services.sifta import (get_cooperators)
+from .services.concurrency import bounded_by, completed, deadline, earliest, partial_result, result, submit
+from .services.metrics import exposition
+from .services.planner import plan_site_fetches
+from .services.tracing import span
 from .string_utils import generate_subtitle
 
 
@@ -45,6 +50,15 @@ def version():
     })
 
 
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics of this server, or of all its processes in multi-process mode."""
+    if not app.config.get('METRICS_ENABLED'):
+        return abort(404)
+    content, content_type = exposition()
+    return Response(content, content_type=content_type)
+
+
 @app.route('/provider/statistics-methods/', methods=['GET'])
 def statistics_methods():
     """
@@ -67,17 +81,25 @@ def provider(agency_cd):
     """
     NGWMN provider information view
     """
-    providers = get_providers()
-    providers_by_agency_cd = dict(map(lambda x: (x['agency_cd'], x), providers))
+    until = deadline(app.config.get('PROVIDER_PAGE_TIMEOUT'))
+    providers_future = submit(get_providers)
+    content_futures = {
+        content_type: submit(pull_feed, confluence_url(agency_cd, content_type))
+        for content_type in (MAIN_CONTENT, SITE_SELECTION_CONTENT, DATA_COLLECTION_CONTENT, DATA_MANAGEMENT_CONTENT,
+                             OTHER_AGENCY_INFO_CONTENT)
+    }
+
+    provider_list = result(providers_future, until)
+    providers_by_agency_cd = dict(map(lambda x: (x['agency_cd'], x), provider_list))
     if agency_cd not in providers_by_agency_cd:
         return '{0} is not a valid agency code'.format(agency_cd), 404
 
     return render_template('provider.html', agency_metadata=providers_by_agency_cd.get(agency_cd),
-                           provider_content=pull_feed(confluence_url(agency_cd, MAIN_CONTENT)),
-                           site_selection=pull_feed(confluence_url(agency_cd, SITE_SELECTION_CONTENT)),
-                           data_collection=pull_feed(confluence_url(agency_cd, DATA_COLLECTION_CONTENT)),
-                           data_management=pull_feed(confluence_url(agency_cd, DATA_MANAGEMENT_CONTENT)),
-                           other_agency_info=pull_feed(confluence_url(agency_cd, OTHER_AGENCY_INFO_CONTENT)))
+                           provider_content=result(content_futures[MAIN_CONTENT], until),
+                           site_selection=result(content_futures[SITE_SELECTION_CONTENT], until),
+                           data_collection=result(content_futures[DATA_COLLECTION_CONTENT], until),
+                           data_management=result(content_futures[DATA_MANAGEMENT_CONTENT], until),
+                           other_agency_info=result(content_futures[OTHER_AGENCY_INFO_CONTENT], until))
 
 
 @app.route('/provider/<agency_cd>/site/', methods=['GET'])
@@ -96,30 +118,37 @@ def sites(agency_cd):
 @app.route('/provider/<agency_cd>/site/<location_id>/', methods=['GET'])
 def site_page(agency_cd, location_id):
     """
-    Site location view.
+    Site location view. The page fails with a 504 if the well log or the
+    site's metadata are not ready within SITE_PAGE_TIMEOUT, but the water
+    quality, statistics and cooperators sections are shown as temporarily
+    unavailable if they are not ready within SITE_PAGE_BUDGET.
 
     :param str agency_cd: agency code for the agency that manages the location
     :param location_id: the location's identifier
 
     """
+    until = deadline(app.config.get('SITE_PAGE_TIMEOUT'))
+    with bounded_by(until):
+        return _site_page(agency_cd, location_id, until)
+
+
+def _site_page(agency_cd, location_id, until):
+    # Optional sections still pending at the budget are left out, rather than holding up the page
+    budget = earliest(until, deadline(app.config.get('SITE_PAGE_BUDGET')))
 
+    # The site's metadata does not depend on the well log, so fetch them in parallel
+    feature_future = submit(get_site_feature, agency_cd, location_id)
     well_log = get_well_log(agency_cd, location_id)
     if not well_log:
         return abort(404)
 
-    summary = get_features(
-        well_log['location']['latitude'],
-        well_log['location']['longitude']
-    )
-    water_quality = get_water_quality(agency_cd, location_id)
-
-    # reduce the amount of data returned from GeoServer to only the monitoring location of interest
-    # this section is important for monitoring locations that have the same geographical coordinates (i.e. nested wells)
-    feature = {}
-    for a_single_feature in summary['features']:
-        if a_single_feature['properties']['SITE_NO'] == location_id:
-            feature = a_single_feature['properties']
-            break
+    # Once the well log is known, the remaining service calls are independent of each other. Skip those that
+    # the site's metadata says cannot return data.
+    cooperators_future = submit(get_cooperators, location_id)
+    feature = result(feature_future, until)
+    sections = _optional_sections(agency_cd, location_id, feature, cooperators_future, budget)
+    unavailable = {section for section, value in sections.items() if value is None}
+    water_quality = sections['water_quality'] or {}
 
     if 'organization' in water_quality:
         organization = water_quality['organization']['name']
@@ -129,21 +158,39 @@ def site_page(agency_cd, location_id):
     # run the logic to create web page subtitle also known as the 'monitoring location description'
     monitoring_location_description = generate_subtitle(feature)
 
+    with span('render_template', **{'ngwmn.template': 'site_location.html'}):
+        return render_template(
+            'site_location.html',
+            feature=feature,
+            organization=organization,
+            water_quality_activities=water_quality.get('activities') or [],
+            well_log=well_log,
+            lithology_ids=_lithology_ids(well_log),
+            stats=sections['statistics'] or default_statistics(),
+            monitoring_location_description=monitoring_location_description,
+            cooperators=sections['cooperators'] or [],
+            unavailable=unavailable
+        ), 200
+
+
+def _optional_sections(agency_cd, location_id, feature, cooperators_future, budget):
+    # The water quality, statistics and cooperators sections, or None for those not ready by the budget
+    plan = plan_site_fetches(agency_cd, location_id, feature)
+    water_quality_future = submit(get_water_quality, agency_cd, location_id) if plan.water_quality else completed({})
+    stats_future = submit(get_statistics, agency_cd, location_id) if plan.statistics else \
+        completed(default_statistics())
+    return {
+        'water_quality': partial_result(water_quality_future, budget, 'water_quality'),
+        'statistics': partial_result(stats_future, budget, 'statistics'),
+        'cooperators': partial_result(cooperators_future, budget, 'cooperators')
+    }
+
+
+def _lithology_ids(well_log):
     # Get the unique list of best-choice lithology IDs in the well log
     lithology_ids = set()
     for entry in well_log.get('log_entries', []):
         materials = entry['unit'].get('ui', {}).get('materials')
         if materials:
             lithology_ids.add(materials[0])
-
-    return render_template(
-        'site_location.html',
-        feature=feature,
-        organization=organization,
-        water_quality_activities=water_quality.get('activities') or [],
-        well_log=well_log,
-        lithology_ids=lithology_ids,
-        stats=get_statistics(agency_cd, location_id),
-        monitoring_location_description=monitoring_location_description,
-        cooperators=get_cooperators(location_id)
-    ), 200
+    return lithology_ids
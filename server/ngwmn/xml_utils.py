@@ -2,7 +2,10 @@
 Utility functions manipulating XML
 
 """
+import threading
+
 from defusedxml.lxml import fromstring
+from lxml import etree
 from lxml.etree import XMLSyntaxError
 
 
@@ -21,3 +24,250 @@ def parse_xml(xml_string):
     except XMLSyntaxError:
         parsed = None
     return parsed
+
+
+# Returned by a compiled schema node whose element is missing and whose key is to be left out
+_OMIT = object()
+
+
+class Text:
+    """
+    Schema node extracting the text of the first element at `path`. A missing
+    element, empty text or the text 'unknown' gives `default`, unless `raw` is
+    set, in which case the element's text is returned as-is (None if missing).
+    `convert`, if given, is applied to the extracted value.
+    """
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, path='.', default=None, convert=None, raw=False):
+        self.path = path
+        self.default = default
+        self.convert = convert
+        self.raw = raw
+
+    def compile(self, namespaces):
+        """
+        Compile this node against a namespace mapping.
+
+        :return: function of (element, index) returning the extracted value
+        """
+        first = _compile_path(self.path, namespaces)
+        default, convert, raw = self.default, self.convert, self.raw
+
+        def extract(elem, index):  # pylint: disable=unused-argument
+            node = first(elem)
+            if node is None:
+                value = None if raw else default
+            else:
+                value = node.text
+                if not raw and (not value or value == 'unknown'):
+                    value = default
+            return convert(value) if convert else value
+        return extract
+
+
+class Attribute:
+    """
+    Schema node extracting attribute `name` of the first element at `path`,
+    or None if the element or attribute is missing. `convert`, if given, is
+    applied to the extracted value.
+    """
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, name, path='.', convert=None):
+        self.name = name
+        self.path = path
+        self.convert = convert
+
+    def compile(self, namespaces):
+        """
+        Compile this node against a namespace mapping.
+
+        :return: function of (element, index) returning the extracted value
+        """
+        first = _compile_path(self.path, namespaces)
+        name, convert = self.name, self.convert
+
+        def extract(elem, index):  # pylint: disable=unused-argument
+            node = first(elem)
+            value = node.get(name) if node is not None else None
+            return convert(value) if convert else value
+        return extract
+
+
+class Const:
+    """
+    Schema node giving a fixed value.
+    """
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, value):
+        self.value = value
+
+    def compile(self, namespaces):  # pylint: disable=unused-argument
+        """
+        :return: function of (element, index) returning the value
+        """
+        value = self.value
+        return lambda elem, index: value
+
+
+class Index:
+    """
+    Schema node giving the position of the enclosing `Each` item, formatted
+    with `fmt` if given (e.g. 'casing-{0}').
+    """
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, fmt=None):
+        self.fmt = fmt
+
+    def compile(self, namespaces):  # pylint: disable=unused-argument
+        """
+        :return: function of (element, index) returning the index
+        """
+        fmt = self.fmt
+        if fmt is None:
+            return lambda elem, index: index
+        return lambda elem, index: fmt.format(index)
+
+
+class Group:
+    """
+    Schema node building a dict of `fields` from the first element at `path`.
+    If the element is missing, an optional group's key is left out of the
+    enclosing dict; otherwise its fields are extracted as if from an empty
+    element, giving their defaults.
+    """
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, path, fields, optional=False):
+        self.path = path
+        self.fields = fields
+        self.optional = optional
+
+    def compile(self, namespaces):
+        """
+        Compile this node and its fields against a namespace mapping.
+
+        :return: function of (element, index) returning the dict
+        """
+        first = _compile_path(self.path, namespaces)
+        build = _compile_fields(self.fields, namespaces)
+        optional = self.optional
+
+        def extract(elem, index):
+            node = first(elem)
+            if node is None and optional:
+                return _OMIT
+            return build(node, index)
+        return extract
+
+
+class Each:
+    """
+    Schema node building a list holding a dict of `fields` for every element
+    at `path`. If there are none, an optional list's key is left out of the
+    enclosing dict; otherwise the list is empty.
+    """
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, path, fields, optional=False):
+        self.path = path
+        self.fields = fields
+        self.optional = optional
+
+    def compile(self, namespaces):
+        """
+        Compile this node and its fields against a namespace mapping.
+
+        :return: function of (element, index) returning the list
+        """
+        find_all = _compile_path(self.path, namespaces, first_only=False)
+        build = _compile_fields(self.fields, namespaces)
+        optional = self.optional
+
+        def extract(elem, index):  # pylint: disable=unused-argument
+            nodes = find_all(elem)
+            if not nodes and optional:
+                return _OMIT
+            return [build(node, position) for position, node in enumerate(nodes)]
+        return extract
+
+
+def _compile_path(path, namespaces, first_only=True):
+    if path == '.':
+        if first_only:
+            return lambda elem: elem
+        return lambda elem: [elem] if elem is not None else []
+
+    # Prefixes bound to no namespace URI match elements in no namespace
+    for prefix, uri in namespaces.items():
+        if uri is None:
+            path = path.replace(prefix + ':', '')
+    xpath = etree.XPath(path, namespaces={prefix: uri for prefix, uri in namespaces.items() if uri is not None})
+
+    if first_only:
+        def find(elem):
+            if elem is None:
+                return None
+            nodes = xpath(elem)
+            return nodes[0] if nodes else None
+    else:
+        def find(elem):
+            if elem is None:
+                return []
+            return xpath(elem)
+    return find
+
+
+def _compile_fields(fields, namespaces):
+    compiled = [(key, node.compile(namespaces)) for key, node in fields.items()]
+
+    def build(elem, index):
+        result = {}
+        for key, extract in compiled:
+            value = extract(elem, index)
+            if value is not _OMIT:
+                result[key] = value
+        return result
+    return build
+
+
+class ExtractionPlan:
+    """
+    A declarative schema of `Text`, `Attribute`, `Const`, `Index`, `Group` and
+    `Each` nodes, compiled into `etree.XPath` expressions once per namespace
+    mapping and then evaluated against any number of elements.
+
+    Paths use the prefixes of the namespace mapping passed when the plan is
+    evaluated; the mapping given to the constructor is compiled up front.
+    """
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, schema, namespaces):
+        self.schema = schema
+        self._compiled = {}
+        self._lock = threading.Lock()
+        self._compile(namespaces)
+
+    def _compile(self, namespaces):
+        key = tuple(sorted(namespaces.items(), key=str))
+        extract = self._compiled.get(key)
+        if extract is None:
+            with self._lock:
+                extract = self._compiled.get(key)
+                if extract is None:
+                    extract = self._compiled[key] = self.schema.compile(namespaces)
+        return extract
+
+    def __call__(self, elem, namespaces):
+        """
+        Extract the schema's value from an element.
+
+        :param elem: element the schema's root node is evaluated against; may be None
+        :param dict namespaces: mapping of the schema's prefixes to namespace URIs
+        :return: the extracted value
+        """
+        value = self._compile(namespaces)(elem, None)
+        return None if value is _OMIT else value
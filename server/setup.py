@@ -80,11 +80,12 @@ setup(
     description='USGS Water Data',
     author='Andrew Yan, Mary Bucknell, Dan Naab, David Uselmann',
     author_email='ayan@usgs.gov',
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
     include_package_data=True,
     long_description=read('README.md'),
     install_requires=read_requirements()['install_requires'],
     platforms='any',
+    python_requires='>=3.8',
     test_suite='unittest:TestLoader',
     zip_safe=False,
     # include the tier agnostic configuration file in the distributable